@@ -0,0 +1,266 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from analytics import create_analytic_backend
+from analytics.backends.base import BaseAnalyticsBackend
+
+from collections import defaultdict
+
+import datetime
+import logging
+import Queue
+import threading
+import types
+
+logger = logging.getLogger(__name__)
+
+BLOCK = "block"
+DROP_OLDEST = "drop-oldest"
+DROP_NEW = "drop-new"
+
+
+class BackgroundWriter(BaseAnalyticsBackend):
+    """
+    Wraps another analytics backend so that tracking never waits on the backend. Tracked events
+    are put on a bounded in-memory queue and a background worker thread writes them out in batches
+    using the wrapped backend's ``track_events``. Everything else is passed straight through to the
+    wrapped backend.
+
+    >>> analytics = create_analytic_backend({
+    >>>     'backend': 'analytics.backends.background.BackgroundWriter',
+    >>>     'settings': {
+    >>>         'backend': 'analytics.backends.redis.Redis',
+    >>>         'settings': {'hosts': [{'db': 0}]},
+    >>>         'queue_size': 10000,
+    >>>         'batch_size': 1000,
+    >>>         'overflow': 'drop-oldest',
+    >>>     },
+    >>> })
+
+    ``overflow`` decides what happens when the queue is full: ``block`` waits for room,
+    ``drop-oldest`` throws away the oldest queued event and ``drop-new`` throws away the new one.
+    """
+    def __init__(self, settings, **kwargs):
+        self._backend = create_analytic_backend(settings)
+        self._analytics_backend = self._backend.get_backend()
+
+        self._overflow = settings.get("overflow", BLOCK)
+        if self._overflow not in (BLOCK, DROP_OLDEST, DROP_NEW):
+            raise Exception("Allowed values for overflow are block, drop-oldest or drop-new.")
+
+        self._batch_size = settings.get("batch_size", 1000)
+        self._queue = Queue.Queue(settings.get("queue_size", 10000))
+        self._lock = threading.Lock()
+        self._counters = {"queued": 0, "dropped": 0, "flushed": 0, "failed": 0}
+
+        #once closed, nothing else is queued. The worker stops when ``_stopped`` is set and the queue
+        #is empty, which only happens once every ``_put`` already under way has finished.
+        self._closed = False
+        self._putting = 0
+        self._puts_done = threading.Condition(self._lock)
+        self._stopped = threading.Event()
+
+        self._worker = threading.Thread(target=self._run, name="analytics-background-writer")
+        self._worker.daemon = True
+        self._worker.start()
+
+        super(BackgroundWriter, self).__init__(settings, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._backend, name)
+
+    def _increment_counter(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _put(self, item):
+        """
+        Queues ``item`` following the overflow policy. Items are dropped once the writer is closed.
+
+        :return: ``True`` if ``item`` was queued, ``False`` if it was dropped
+        """
+        with self._lock:
+            if self._closed:
+                self._counters["dropped"] += 1
+                return False
+            self._putting += 1
+
+        try:
+            return self._enqueue(item)
+        finally:
+            with self._lock:
+                self._putting -= 1
+                if not self._putting:
+                    self._puts_done.notify_all()
+
+    def _enqueue(self, item):
+        if self._overflow == BLOCK:
+            self._queue.put(item)
+            self._increment_counter("queued")
+            return True
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                self._increment_counter("queued")
+                return True
+            except Queue.Full:
+                if self._overflow == DROP_NEW:
+                    self._increment_counter("dropped")
+                    return False
+
+            #make room by throwing away the oldest event
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._increment_counter("dropped")
+            except Queue.Empty:
+                pass
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=0.1)]
+            except Queue.Empty:
+                #nothing can be queued once stopped, so an empty queue stays empty
+                if self._stopped.is_set() and self._queue.empty():
+                    return
+                continue
+
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            try:
+                self._write(batch)
+                self._increment_counter("flushed", len(batch))
+            except Exception:
+                logger.exception("Failed to write %s analytics events", len(batch))
+                self._increment_counter("failed", len(batch))
+            finally:
+                for item in batch:
+                    self._queue.task_done()
+
+    def _write(self, events):
+        """
+        Writes a batch of queued events. Metrics go through ``track_events`` and counters are
+        summed before being written.
+        """
+        metric_events = []
+        counts = defaultdict(int)
+        for event in events:
+            if event[0] == "metric":
+                metric_events.append(event[1:])
+            else:
+                counts[event[1:3]] += event[3]
+
+        if metric_events:
+            self._backend.track_events(metric_events)
+        for (unique_identifier, metric), inc_amt in counts.iteritems():
+            self._backend.track_count(unique_identifier, metric, inc_amt)
+
+    def get_stats(self):
+        """
+        Returns how many events were queued, dropped, flushed (written to the backend) and
+        failed (the backend raised while writing them), along with the current queue size.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def track_count(self, unique_identifier, metric, inc_amt=1, **kwargs):
+        """
+        Queues a counter increment.
+
+        :return: ``True`` if the increment was queued, ``False`` if it was dropped
+        """
+        return self._put(("count", unique_identifier, metric, inc_amt))
+
+    def track_metric(self, unique_identifier, metric, date=None, inc_amt=1, **kwargs):
+        """
+        Queues a metric. Lists of ``unique_identifier`` and ``metric`` are supported, the
+        same way as the ``Redis`` backend does.
+
+        :return: ``True`` if every event was queued, ``False`` if any of them were dropped
+        """
+        metric = [metric] if isinstance(metric, basestring) else metric
+        unique_identifier = [unique_identifier] if not isinstance(unique_identifier, (types.ListType, types.TupleType, types.GeneratorType,)) else unique_identifier
+        if date is None:
+            date = datetime.date.today()
+
+        results = [
+            self._put(("metric", uid, single_metric, date, inc_amt))
+            for uid in unique_identifier for single_metric in metric]
+        return all(results)
+
+    def track_events(self, events, **kwargs):
+        """
+        Queues a stream of ``(unique_identifier, metric, date, inc_amt)`` events.
+
+        :return: A dictionary with the number of events queued and dropped
+        """
+        num_queued = num_dropped = 0
+        today = datetime.date.today()
+        for event in events:
+            unique_identifier, metric, date = event[:3]
+            inc_amt = event[3] if len(event) > 3 else 1
+            if self._put(("metric", unique_identifier, metric, date or today, inc_amt)):
+                num_queued += 1
+            else:
+                num_dropped += 1
+
+        return {"events": num_queued, "dropped": num_dropped}
+
+    def flush(self):
+        """
+        Waits until every queued event has been handed to the wrapped backend, then flushes it.
+        """
+        self._queue.join()
+        self._backend.flush()
+
+    def close(self):
+        """
+        Stops queuing, drains the queue, stops the worker thread and closes the wrapped backend.
+        Anything tracked after this is dropped.
+        """
+        with self._lock:
+            self._closed = True
+            while self._putting:
+                self._puts_done.wait()
+
+        self._stopped.set()
+        self._worker.join()
+        self._backend.close()
+
+
+def _pass_through(name):
+    def method(self, *args, **kwargs):
+        return getattr(self._backend, name)(*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = "Calls ``%s`` of the wrapped backend." % (name,)
+    return method
+
+#``BaseAnalyticsBackend`` methods are found before ``__getattr__``, so every public method of the
+#backend API the writer doesn't queue is passed through to the wrapped backend explicitly
+for _name in dir(BaseAnalyticsBackend):
+    if not _name.startswith("_") and _name not in BackgroundWriter.__dict__:
+        setattr(BackgroundWriter, _name, _pass_through(_name))
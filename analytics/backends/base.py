@@ -15,6 +15,7 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
+import time
 
 
 class BaseAnalyticsBackend(object):
@@ -51,6 +52,42 @@ class BaseAnalyticsBackend(object):
         """
         raise NotImplementedError()
 
+    def track_events(self, events, **kwargs):
+        """
+        Tracks a stream of events. Each event is a tuple of the form
+        ``(unique_identifier, metric, date, inc_amt)``, where ``inc_amt`` is optional.
+
+        By default this just calls ``track_metric`` for every event. Backends should override
+        it with something more efficient.
+
+        :param events: An iterable of events
+        :return: A dictionary summarizing how many events were tracked and how long it took
+        """
+        started = time.time()
+        num_events = 0
+        for event in events:
+            self.track_metric(*event)
+            num_events += 1
+
+        return self._get_throughput_summary(num_events, num_events, time.time() - started)
+
+    def bulk_load(self, rows, **kwargs):
+        """
+        Loads historical daily counts. Each row is a tuple of the form ``(unique_identifier, metric, date, count)``.
+
+        :param rows: An iterable of rows
+        :return: A dictionary summarizing how many rows (``events``) were loaded and how long it took
+        """
+        raise NotImplementedError()
+
+    def _get_throughput_summary(self, num_events, num_writes, seconds):
+        return {
+            "events": num_events,
+            "writes": num_writes,
+            "seconds": seconds,
+            "events_per_second": num_events / seconds if seconds > 0 else float(num_events),
+        }
+
     def get_metric_by_day(self, unique_identifier, metric, from_date, limit=10, **kwargs):
         """
         Returns the ``metric`` for ``unique_identifier`` segmented by day
@@ -88,6 +125,46 @@ class BaseAnalyticsBackend(object):
         """
         raise NotImplementedError()
 
+    def iter_metric(self, unique_identifier, metric, start_date, end_date, granularity="day", **kwargs):
+        """
+        Lazily yields ``(date, value)`` pairs for the ``metric`` for ``unique_identifier`` from ``start_date``
+        to ``end_date``, in order.
+
+        :param unique_identifier: Unique string indetifying the object this metric is for
+        :param metric: A unique name for the metric you want to track
+        :param start_date: A python date object
+        :param end_date: A python date object, included in the series
+        :param granularity: The size of each period. Choices are: ``day``, ``week`` or ``month``
+        """
+        raise NotImplementedError()
+
+    def list_metrics(self, unique_identifier=None, **kwargs):
+        """
+        Returns the set of metrics tracked for ``unique_identifier``, or of all the metrics if it isn't given.
+
+        :param unique_identifier: Unique string indetifying the object to list the metrics of
+        """
+        raise NotImplementedError()
+
+    def list_uids(self, metric, **kwargs):
+        """
+        Returns the set of unique identifiers the ``metric`` was tracked for.
+
+        :param metric: A unique name for the metric
+        """
+        raise NotImplementedError()
+
+    def get_all_metrics(self, unique_identifier, from_date, limit=10, group_by="week", **kwargs):
+        """
+        Retrieves every metric tracked for ``unique_identifier``.
+
+        :param unique_identifier: Unique string indetifying the object to get the metrics of
+        :param from_date: A python date object
+        :param limit: The total number of periods to retrive starting from ``from_date``
+        :param group_by: The type of aggregation to perform on the metric. Choices are: ``day``, ``week`` or ``month``
+        """
+        raise NotImplementedError()
+
     def get_metrics(self, metric_identifiers, from_date, limit=10, group_by="week", **kwargs):
         """
         Retrieves a multiple metrics as efficiently as possible.
@@ -100,6 +177,19 @@ class BaseAnalyticsBackend(object):
         """
         raise NotImplementedError()
 
+    def aggregate_metrics(self, unique_identifiers, metric, from_date, limit=10, group_by="week", **kwargs):
+        """
+        Returns the total of the ``metric`` across all the ``unique_identifiers``, segmented by ``group_by``
+        starting from ``from_date``.
+
+        :param unique_identifiers: A list of unique strings indetifying the objects to sum the metric for
+        :param metric: A unique name for the metric you want to track
+        :param from_date: A python date object
+        :param limit: The total number of periods to retrive starting from ``from_date``
+        :param group_by: The type of aggregation to perform on the metric. Choices are: ``day``, ``week`` or ``month``
+        """
+        raise NotImplementedError()
+
     def get_count(self, unique_identifier, metric, **kwargs):
         """
         Gets the count for the ``metric`` for ``unique_identifier``
@@ -118,5 +208,79 @@ class BaseAnalyticsBackend(object):
         """
         raise NotImplementedError()
 
+    def get_total_between(self, unique_identifier, metric, start_date, end_date, **kwargs):
+        """
+        Gets the total of the ``metric`` for ``unique_identifier`` from ``start_date`` to ``end_date``, both included.
+
+        :param unique_identifier: Unique string indetifying the object this metric is for
+        :param metric: A unique name for the metric you want to track
+        :param start_date: A python date object
+        :param end_date: A python date object
+        """
+        raise NotImplementedError()
+
+    def flush(self):
+        """
+        Writes out any data the backend is holding on to before sending it to its store.
+        Backends that don't buffer writes don't need to do anything here.
+        """
+        pass
+
+    def close(self):
+        """
+        Flushes any buffered data and releases the resources held by the backend.
+        """
+        self.flush()
+
+    def track_unique(self, metric, member, date=None, **kwargs):
+        """
+        Adds ``member`` to the unique members of ``metric`` for the day, week and month of ``date``.
+
+        :param metric: A unique name for the metric you want to track
+        :param member: The member to count, e.g. a user id
+        :param date: A python date object indicating when this event occured
+        """
+        raise NotImplementedError()
+
+    def get_unique_by_day(self, metric, from_date, limit=30, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` segmented by day starting from ``from_date``
+
+        :param metric: A unique name for the metric
+        :param from_date: A python date object
+        :param limit: The total number of days to retrive starting from ``from_date``
+        """
+        raise NotImplementedError()
+
+    def get_unique_by_week(self, metric, from_date, limit=10, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` segmented by week starting from ``from_date``
+
+        :param metric: A unique name for the metric
+        :param from_date: A python date object
+        :param limit: The total number of weeks to retrive starting from ``from_date``
+        """
+        raise NotImplementedError()
+
+    def get_unique_by_month(self, metric, from_date, limit=10, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` segmented by month starting from ``from_date``
+
+        :param metric: A unique name for the metric
+        :param from_date: A python date object
+        :param limit: The total number of months to retrive starting from ``from_date``
+        """
+        raise NotImplementedError()
+
+    def get_unique_count(self, metric, start_date, end_date, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` between ``start_date`` and ``end_date``
+
+        :param metric: A unique name for the metric
+        :param start_date: Count the unique members from this date
+        :param end_date: Count the unique members up to this date
+        """
+        raise NotImplementedError()
+
     def get_backend(self):
         return self._analytics_backend
@@ -7,6 +7,12 @@ class Dummy(BaseAnalyticsBackend):
     def track_metric(self, unique_identifier, metric, date, inc_amt=1, **kwargs):
         pass
 
+    def track_events(self, events, **kwargs):
+        pass
+
+    def bulk_load(self, rows, **kwargs):
+        pass
+
     def get_metric_by_day(self, unique_identifier, metric, from_date, limit=10, **kwargs):
         pass
 
@@ -16,11 +22,44 @@ class Dummy(BaseAnalyticsBackend):
     def get_metric_by_month(self, unique_identifier, metric, from_date, limit=10, **kwargs):
         pass
 
+    def iter_metric(self, unique_identifier, metric, start_date, end_date, granularity="day", **kwargs):
+        return iter([])
+
+    def list_metrics(self, unique_identifier=None, **kwargs):
+        pass
+
+    def list_uids(self, metric, **kwargs):
+        pass
+
+    def get_all_metrics(self, unique_identifier, from_date, limit=10, group_by="week", **kwargs):
+        pass
+
     def get_metrics(self, metric_identifiers, from_date, limit=10, group_by="week", **kwargs):
         pass
 
+    def aggregate_metrics(self, unique_identifiers, metric, from_date, limit=10, group_by="week", **kwargs):
+        pass
+
     def get_count(self, unique_identifier, metric, **kwargs):
         pass
 
     def get_counts(self, metric_identifiers, **kwargs):
-        pass
\ No newline at end of file
+        pass
+
+    def get_total_between(self, unique_identifier, metric, start_date, end_date, **kwargs):
+        pass
+
+    def track_unique(self, metric, member, date=None, **kwargs):
+        pass
+
+    def get_unique_by_day(self, metric, from_date, limit=30, **kwargs):
+        pass
+
+    def get_unique_by_week(self, metric, from_date, limit=10, **kwargs):
+        pass
+
+    def get_unique_by_month(self, metric, from_date, limit=10, **kwargs):
+        pass
+
+    def get_unique_count(self, metric, start_date, end_date, **kwargs):
+        pass
@@ -15,21 +15,114 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
+from __future__ import absolute_import
+
 from analytics.backends.base import BaseAnalyticsBackend
+from analytics.backends import scripts
+from analytics.buffer import FlushError, IncrementBuffer
+from analytics.cache import LRUCache
+from analytics.utils import RateLimiter, import_string
 
 from nydus.db import create_cluster
+from nydus.db.routers import routing_params
+from nydus.db.routers.keyvalue import ConsistentHashingRouter, get_key
+from redis.exceptions import RedisError, ResponseError
+
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
-from calendar import monthrange
 from dateutil.relativedelta import relativedelta
-from dateutil import rrule
 
 import datetime
 import itertools
 import calendar
+import re
+import copy
+import threading
+import time
 import types
+import uuid
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def get_hash_tag(key):
+    """
+    Returns the part of ``key`` between the first ``{`` and the following ``}``, the same way
+    redis cluster hash tags work. If there is no hash tag, the whole key is returned.
+    """
+    start = key.find("{")
+    if start != -1:
+        end = key.find("}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+class HashTagRouter(ConsistentHashingRouter):
+    """
+    Consistent hashing router that only hashes the hash tag of a key, so keys sharing
+    a hash tag are always routed to the same host.
+    """
+    @routing_params
+    def _route(self, attr, args, kwargs, **fkwargs):
+        key = get_key(args, kwargs)
+        return super(HashTagRouter, self)._route(attr=attr, args=(get_hash_tag(str(key)),), kwargs={}, **fkwargs)
+
+
+#the unique identifier global rollups are stored under
+GLOBAL_IDENTIFIER = "__all__"
+
+#marks a value missing from the read-through cache, since ``None`` is a valid cached value
+_MISSING = object()
+
+
+class PartialReply(object):
+    """
+    The reply of an HMGET that was partly answered without asking redis, because the values were
+    in the read-through cache or because the hash can't hold the fields. Only the other fields are
+    sent to redis. The first time the reply is read, it is merged with the known values and the
+    fetched values of closed periods are cached.
+    """
+    def __init__(self, cache, key, fields, known, missing, reply, closed_fields):
+        self._cache = cache
+        self._key = key
+        self._fields = fields
+        self._known = known
+        self._missing = missing
+        self._reply = reply
+        self._closed_fields = closed_fields
+        self._values = None
+
+    def _resolve(self):
+        if self._values is None:
+            fetched = dict(zip(self._missing, self._reply)) if self._missing else {}
+            if self._cache is not None:
+                for field, value in fetched.iteritems():
+                    if field in self._closed_fields:
+                        self._cache.set((self._key, field), value)
+            self._values = [self._known[field] if field in self._known else fetched[field] for field in self._fields]
+        return self._values
+
+    def __iter__(self):
+        return iter(self._resolve())
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        return self._resolve()[index]
 
 
 class Redis(BaseAnalyticsBackend):
+    #maximum number of increments sent to a node in a single script call
+    _script_chunk_size = 1000
+    #dates are stored as offsets from this date in the compact key layout
+    _compact_epoch = datetime.date(year=2000, month=1, day=1)
+
     def __init__(self, settings, **kwargs):
         nydus_hosts = {}
 
@@ -47,14 +140,179 @@ class Redis(BaseAnalyticsBackend):
                 'port': 6379,
             })
 
+        #opt-in key layout that wraps the unique identifier in a hash tag, so all the keys for a
+        #unique identifier live on the same host
+        self._hash_tags = settings.get("hash_tags", False)
+
+        #opt-in compact key layout that interns metric names to short ids and stores dates as offsets
+        self._compact_keys = settings.get("compact_keys", False)
+        self._metric_ids = {}
+
+        #opt-in number of days to keep each granularity for after its period ends,
+        #e.g. {"day": 90, "week": 365 * 3, "month": 365 * 3}
+        self._retention = settings.get("retention", {})
+        #key: the time the expiry this client sent for it runs out
+        self._expiring_keys = LRUCache(max_size=100000)
+
+        #opt-in yearly totals, maintained alongside the weekly and monthly metrics so date ranges can be
+        #counted with a single field per whole year. Only turn this on for data tracked with it on.
+        self._year_rollups = settings.get("year_rollups", False)
+
+        #opt-in totals of each metric across all unique identifiers, stored under ``GLOBAL_IDENTIFIER``.
+        #Either True for all metrics or a list of the metrics to keep global rollups for.
+        global_rollups = settings.get("global_rollups", False)
+        self._global_rollups = global_rollups if isinstance(global_rollups, bool) else frozenset(global_rollups)
+
+        #opt-in sets of the metrics tracked for each unique identifier, of the unique identifiers tracked
+        #for each metric and of all the metrics, so they can be listed without scanning keys
+        self._metric_index = settings.get("metric_index", False)
+
+        #opt-in leaderboards of the top unique identifiers for each metric. Either True for all
+        #metrics or a list of the metrics to keep leaderboards for.
+        leaderboards = settings.get("leaderboards", False)
+        self._leaderboards = leaderboards if isinstance(leaderboards, bool) else frozenset(leaderboards)
+
         self._analytics_backend = create_cluster({
             'engine': 'nydus.db.backends.redis.Redis',
-            'router': 'nydus.db.routers.keyvalue.ConsistentHashingRouter',
+            'router': HashTagRouter if self._hash_tags else 'nydus.db.routers.keyvalue.ConsistentHashingRouter',
             'hosts': nydus_hosts,
             'defaults': defaults,
         })
+
+        #opt-in client side coalescing of writes, e.g. {"max_size": 1000, "max_age": 1.0}
+        buffer_settings = settings.get("buffer")
+        self._buffer = IncrementBuffer(self._flush_increments, **buffer_settings) if buffer_settings else None
+
+        #opt-in read-through cache for periods that have ended, e.g. {"max_size": 10000, "grace_days": 1}.
+        #``backend`` can be set to the class or import path of another cache implementation.
+        cache_settings = dict(settings.get("cache") or {})
+        self._cache_grace = datetime.timedelta(days=cache_settings.pop("grace_days", 1))
+        self._cache = None
+        if settings.get("cache"):
+            cache_class = cache_settings.pop("backend", LRUCache)
+            if isinstance(cache_class, basestring):
+                cache_class = import_string(cache_class)
+            self._cache = cache_class(**cache_settings)
+
+        #opt-in server side lua scripts. Falls back to pipelines if the servers don't support scripting.
+        self._use_scripts = settings.get("use_scripts", False)
+        self._scripts = {}
+        #threads calling the scripts on all the hosts at once, started the first time they are needed
+        self._nodes_pool = None
+        self._nodes_pool_lock = threading.Lock()
+
+        #UNLINK frees deleted keys in the background, DEL is used instead on servers older than redis 4.0
+        self._use_unlink = True
+
         super(Redis, self).__init__(settings, **kwargs)
 
+    def _parse_key(self, key):
+        """
+        Works out what a redis key created by this backend holds.
+
+        :return: A ``(kind, unique_identifier, value)`` tuple, or ``None`` if ``key`` isn't a metric key.
+            ``kind`` is ``day`` for the daily hash of a month, ``year`` for the weekly and monthly hash of a
+            year or ``count`` for an overall counter. ``value`` is the first date of the period for hashes
+            and the metric for counters (its id in the compact key layout).
+        """
+        if not key.startswith(self._prefix + ":"):
+            return None
+
+        rest = key[len(self._prefix) + 1:]
+        try:
+            if self._compact_keys:
+                kind, remainder = rest.split(":", 1)
+                unique_identifier, value = remainder.rsplit(":", 1)
+                if kind == "d":
+                    kind, value = "day", self._compact_epoch + relativedelta(months=int(value))
+                elif kind == "y":
+                    kind, value = "year", datetime.date(year=self._compact_epoch.year + int(value), month=1, day=1)
+                elif kind == "c":
+                    kind = "count"
+                else:
+                    return None
+            elif rest.startswith("user:") and ":analy:" in rest:
+                unique_identifier, period = rest[len("user:"):].rsplit(":analy:", 1)
+                if len(period) == 5:
+                    kind, value = "day", datetime.datetime.strptime(period, "%y-%m").date()
+                elif len(period) == 2:
+                    kind, value = "year", datetime.datetime.strptime(period, "%y").date()
+                else:
+                    return None
+            elif rest.startswith("analy:") and ":count:" in rest:
+                kind = "count"
+                unique_identifier, value = rest[len("analy:"):].split(":count:", 1)
+            else:
+                return None
+        except ValueError:
+            return None
+
+        if self._hash_tags and unique_identifier.startswith("{") and unique_identifier.endswith("}"):
+            unique_identifier = unique_identifier[1:-1]
+
+        return kind, unique_identifier, value
+
+    def _get_expire_at(self, key):
+        """
+        Returns the unix timestamp ``key`` should expire at according to the retention settings,
+        or ``None`` if it should be kept forever.
+        """
+        parsed_key = self._parse_key(key)
+        if parsed_key is None:
+            #unique counts and leaderboards have a key per day, week or month
+            parsed_key = self._parse_period_key(key)
+            if parsed_key is None:
+                return None
+            metric, granularity, period_start = parsed_key
+            retention = self._retention.get(granularity)
+            if retention is None:
+                return None
+            return calendar.timegm((self._get_period_end(granularity, period_start) + datetime.timedelta(days=retention)).timetuple())
+
+        kind, unique_identifier, period_start = parsed_key
+        if kind == "day":
+            retention = self._retention.get("day")
+            period_end = period_start + relativedelta(months=1)
+        elif kind == "year":
+            #weekly and monthly metrics share the yearly hash, so keep it for the longer of the two
+            retentions = [self._retention[rollup] for rollup in ("week", "month") if rollup in self._retention]
+            retention = max(retentions) if retentions else None
+            period_end = period_start + relativedelta(years=1)
+        else:
+            return None
+
+        if retention is None:
+            return None
+        return calendar.timegm((period_end + datetime.timedelta(days=retention)).timetuple())
+
+    def _expire_new_keys(self, conn, keys):
+        """
+        Queues an EXPIREAT on ``conn`` for each of ``keys`` this client hasn't set an expiry on yet,
+        so the expiry is only sent once per key instead of on every write. Pass what it returns to
+        ``_mark_expiring`` once ``conn`` has run.
+        """
+        if not self._retention:
+            return []
+
+        now = time.time()
+        expiring = []
+        for key in set(keys):
+            if self._expiring_keys.get(key, 0) > now:
+                continue
+            expire_at = self._get_expire_at(key)
+            if expire_at is not None:
+                conn.expireat(key, expire_at)
+            expiring.append((key, expire_at))
+        return expiring
+
+    def _mark_expiring(self, expiring):
+        """
+        Remembers the expiries queued by ``_expire_new_keys`` after they were sent. Once an expiry runs
+        out the key may be created again, so it is forgotten.
+        """
+        for key, expire_at in expiring:
+            self._expiring_keys.set(key, float("inf") if expire_at is None else expire_at)
+
     def _get_closest_week(self, metric_date):
         """
         Gets the closest monday to the date provided.
@@ -64,36 +322,198 @@ class Redis(BaseAnalyticsBackend):
 
         return metric_date - datetime.timedelta(days=days_after_monday)
 
+    def _get_uid_key_part(self, unique_identifier):
+        """
+        The part of a redis key identifying ``unique_identifier``. It is wrapped in a hash tag
+        when the backend uses the ``hash_tags`` key layout.
+        """
+        return "{%s}" % (unique_identifier,) if self._hash_tags else unique_identifier
+
+    def _get_metric_id(self, metric):
+        """
+        Returns the short id ``metric`` is interned to in the compact key layout. A new id is
+        assigned the first time a metric is seen. Ids are stored in redis and cached by the client.
+        """
+        metric_id = self._metric_ids.get(metric)
+        if metric_id is None:
+            ids_key = self._prefix + ":metric_ids"
+            metric_id = self._analytics_backend.hget(ids_key, metric)
+            if metric_id is None:
+                new_id = self._analytics_backend.incr(ids_key + ":next")
+                if self._analytics_backend.hsetnx(ids_key, metric, new_id):
+                    self._analytics_backend.hset(self._prefix + ":metric_names", new_id, metric)
+                    metric_id = str(new_id)
+                else:
+                    #somebody else interned the metric first
+                    metric_id = self._analytics_backend.hget(ids_key, metric)
+            self._metric_ids[metric] = metric_id
+
+        return metric_id
+
+    def _get_day_offset(self, metric_date):
+        return metric_date.toordinal() - self._compact_epoch.toordinal()
+
+    def _get_month_offset(self, metric_date):
+        return (metric_date.year - self._compact_epoch.year) * 12 + metric_date.month - 1
+
     def _get_daily_metric_key(self, unique_identifier, metric_date):
         """
         Redis key for daily metric
         """
-        return self._prefix + ":" + "user:%s:analy:%s" % (unique_identifier, metric_date.strftime("%y-%m"),)
+        if self._compact_keys:
+            return self._prefix + ":" + "d:%s:%s" % (self._get_uid_key_part(unique_identifier), self._get_month_offset(metric_date),)
+        return self._prefix + ":" + "user:%s:analy:%s" % (self._get_uid_key_part(unique_identifier), metric_date.strftime("%y-%m"),)
 
     def _get_weekly_metric_key(self, unique_identifier, metric_date):
         """
         Redis key for weekly metric
         """
-        return self._prefix + ":" + "user:%s:analy:%s" % (unique_identifier, metric_date.strftime("%y"),)
+        if self._compact_keys:
+            return self._prefix + ":" + "y:%s:%s" % (self._get_uid_key_part(unique_identifier), metric_date.year - self._compact_epoch.year,)
+        return self._prefix + ":" + "user:%s:analy:%s" % (self._get_uid_key_part(unique_identifier), metric_date.strftime("%y"),)
+
+    def _get_count_key(self, unique_identifier, metric):
+        """
+        Redis key for the overall counter of a metric
+        """
+        if self._compact_keys:
+            return self._prefix + ":" + "c:%s:%s" % (self._get_uid_key_part(unique_identifier), self._get_metric_id(metric),)
+        return self._prefix + ":" + "analy:%s:count:%s" % (self._get_uid_key_part(unique_identifier), metric,)
+
+    def _get_unique_key(self, metric, granularity, metric_date):
+        """
+        Redis key for the HyperLogLog holding the unique members of a metric for a day, week or month
+        """
+        date_format = "%y-%m" if granularity == "month" else "%y-%m-%d"
+        return self._prefix + ":" + "uniq:%s:%s:%s" % (self._get_uid_key_part(metric), granularity[0], metric_date.strftime(date_format),)
+
+    def _get_leaderboard_key(self, metric, granularity, metric_date):
+        """
+        Redis key for the sorted set ranking the unique identifiers of a metric for a day, week or month
+        """
+        date_format = "%y-%m" if granularity == "month" else "%y-%m-%d"
+        return self._prefix + ":" + "top:%s:%s:%s" % (self._get_uid_key_part(metric), granularity[0], metric_date.strftime(date_format),)
+
+    def _get_metrics_index_key(self, unique_identifier=None):
+        """
+        Redis key for the set of metrics tracked for ``unique_identifier``, or of all metrics
+        """
+        if unique_identifier is None:
+            return self._prefix + ":" + "metrics"
+        return self._prefix + ":" + "user:%s:metrics" % (self._get_uid_key_part(unique_identifier),)
+
+    def _get_uids_index_key(self, metric):
+        """
+        Redis key for the set of unique identifiers a metric was tracked for
+        """
+        return self._prefix + ":" + "metric:%s:uids" % (self._get_uid_key_part(metric),)
+
+    def _has_leaderboard(self, metric):
+        if isinstance(self._leaderboards, bool):
+            return self._leaderboards
+        return metric in self._leaderboards
+
+    def _has_global_rollup(self, metric):
+        if isinstance(self._global_rollups, bool):
+            return self._global_rollups
+        return metric in self._global_rollups
 
     def _get_daily_metric_name(self, metric, metric_date):
         """
         Hash key for daily metric
         """
+        if self._compact_keys:
+            return "%s:%s" % (self._get_metric_id(metric), self._get_day_offset(metric_date),)
         return "%s:%s" % (metric, metric_date.strftime("%y-%m-%d"),)
 
     def _get_weekly_metric_name(self, metric, metric_date):
         """
         Hash key for weekly metric
         """
+        if self._compact_keys:
+            return "%s:w%s" % (self._get_metric_id(metric), self._get_day_offset(metric_date),)
         return "%s:%s" % (metric, metric_date.strftime("%y-%m-%d"),)
 
     def _get_monthly_metric_name(self, metric, metric_date):
         """
         Hash key for monthly metric
         """
+        if self._compact_keys:
+            return "%s:m%s" % (self._get_metric_id(metric), self._get_month_offset(metric_date),)
         return "%s:%s" % (metric, metric_date.strftime("%y-%m"),)
 
+    def _get_yearly_metric_name(self, metric, metric_date):
+        """
+        Hash key for yearly metric
+        """
+        if self._compact_keys:
+            return "%s:y%s" % (self._get_metric_id(metric), metric_date.year - self._compact_epoch.year,)
+        return "%s:%s" % (metric, metric_date.strftime("%y"),)
+
+    def _get_range_buckets(self, start_date, end_date):
+        """
+        Covers the days from ``start_date`` to ``end_date`` (inclusive) with as few buckets as possible.
+        Whole years are used first (if ``year_rollups`` is on), then whole months, then whole weeks for
+        what is left on either side, and finally single days.
+
+        :return: A list of ``(granularity, first_date)`` tuples
+        """
+        granularities = [
+            #(granularity, first period starting on or after a date, first day of the next period)
+            ("month",
+                lambda date: date if date.day == 1 else datetime.date(year=date.year, month=date.month, day=1) + relativedelta(months=1),
+                lambda date: date + relativedelta(months=1)),
+            ("week",
+                lambda date: date + datetime.timedelta(days=(7 - date.weekday()) % 7),
+                lambda date: date + datetime.timedelta(weeks=1)),
+        ]
+        if self._year_rollups:
+            granularities.insert(0, (
+                "year",
+                lambda date: date if (date.month, date.day) == (1, 1) else datetime.date(year=date.year + 1, month=1, day=1),
+                lambda date: date + relativedelta(years=1)))
+
+        def cover(start_date, end_date, granularities):
+            if start_date > end_date:
+                return []
+            if not granularities:
+                return [("day", start_date + datetime.timedelta(days=i)) for i in xrange((end_date - start_date).days + 1)]
+
+            (granularity, align, next_period), finer = granularities[0], granularities[1:]
+            periods = []
+            period = align(start_date)
+            while next_period(period) - datetime.timedelta(days=1) <= end_date:
+                periods.append(period)
+                period = next_period(period)
+
+            if not periods:
+                return cover(start_date, end_date, finer)
+            return cover(start_date, periods[0] - datetime.timedelta(days=1), finer) + \
+                [(granularity, period_start) for period_start in periods] + \
+                cover(next_period(periods[-1]), end_date, finer)
+
+        return cover(start_date, end_date, granularities)
+
+    def _get_bucket_fields(self, unique_identifier, metric, granularity, bucket_date):
+        """
+        Returns the ``(key, field, period_end)`` hash fields holding the count of a bucket returned by
+        ``_get_range_buckets``. A week that spans two years is stored in the hashes of both years.
+        """
+        if granularity == "day":
+            return [(self._get_daily_metric_key(unique_identifier, bucket_date),
+                self._get_daily_metric_name(metric, bucket_date), bucket_date + datetime.timedelta(days=1))]
+        elif granularity == "week":
+            field = self._get_weekly_metric_name(metric, bucket_date)
+            period_end = bucket_date + datetime.timedelta(weeks=1)
+            sunday = period_end - datetime.timedelta(days=1)
+            dates = [bucket_date] if sunday.year == bucket_date.year else [bucket_date, sunday]
+            return [(self._get_weekly_metric_key(unique_identifier, date), field, period_end) for date in dates]
+        elif granularity == "month":
+            return [(self._get_weekly_metric_key(unique_identifier, bucket_date),
+                self._get_monthly_metric_name(metric, bucket_date), bucket_date + relativedelta(months=1))]
+        return [(self._get_weekly_metric_key(unique_identifier, bucket_date),
+            self._get_yearly_metric_name(metric, bucket_date), bucket_date + relativedelta(years=1))]
+
     def _get_daily_date_range(self, metric_date, delta):
         """
         Get the range of months that we need to use as keys to scan redis.
@@ -126,20 +546,302 @@ class Redis(BaseAnalyticsBackend):
                     year=metric_date.year + (i + 1), month=1, day=1))
         return dates
 
+    def _get_metric_increments(self, unique_identifier, metric, date, inc_amt):
+        """
+        Returns the ``(command, key, field, amount)`` increments needed to track ``metric`` for
+        ``unique_identifier`` on ``date``. ``command`` is one of ``incrby``, ``hincrby``, ``zincrby`` or
+        ``sadd`` and ``field`` is the hash field or (sorted) set member, ``None`` for plain counters.
+        """
+        increments = self._get_bucket_increments(unique_identifier, metric, date, inc_amt)
+
+        if self._has_global_rollup(metric) and unique_identifier != GLOBAL_IDENTIFIER:
+            increments.extend(self._get_bucket_increments(GLOBAL_IDENTIFIER, metric, date, inc_amt))
+
+        if self._metric_index:
+            increments.extend([
+                ("sadd", self._get_metrics_index_key(unique_identifier), metric, 1),
+                ("sadd", self._get_uids_index_key(metric), str(unique_identifier), 1),
+                ("sadd", self._get_metrics_index_key(), metric, 1),
+            ])
+
+        if self._has_leaderboard(metric):
+            increments.extend(self._get_leaderboard_increments(unique_identifier, metric, date, inc_amt))
+
+        return increments
+
+    def _get_leaderboard_increments(self, unique_identifier, metric, date, inc_amt):
+        """
+        Returns the increments for the daily, weekly and monthly leaderboards of ``metric``.
+        """
+        closest_monday = self._get_closest_week(date)
+        return [
+            ("zincrby", self._get_leaderboard_key(metric, granularity, bucket_date), str(unique_identifier), inc_amt)
+            for granularity, bucket_date in (("day", date), ("week", closest_monday), ("month", date))]
+
+    def _get_set_propagations(self, unique_identifier, metric, date, sync_agg, update_counter):
+        """
+        Returns the ``(command, key, field)`` counters that move by the same amount as the count of
+        ``metric`` for ``unique_identifier`` on ``date`` when it is set.
+        """
+        bucket_increments = self._get_bucket_increments(unique_identifier, metric, date, 0)
+        #the daily bucket is the one being set and the overall counter is always last
+        propagations = bucket_increments[1:-1] if sync_agg else []
+        if update_counter:
+            propagations.append(bucket_increments[-1])
+        if self._has_leaderboard(metric):
+            #the day leaderboard always moves with the day being set, the week and month ones with their buckets
+            leaderboard_increments = self._get_leaderboard_increments(unique_identifier, metric, date, 0)
+            propagations.extend(leaderboard_increments if sync_agg else leaderboard_increments[:1])
+        if self._has_global_rollup(metric) and unique_identifier != GLOBAL_IDENTIFIER:
+            #the global day always moves with the day being set, the rest follow the same rules as above
+            global_increments = self._get_bucket_increments(GLOBAL_IDENTIFIER, metric, date, 0)
+            propagations.append(global_increments[0])
+            if sync_agg:
+                propagations.extend(global_increments[1:-1])
+            if update_counter:
+                propagations.append(global_increments[-1])
+
+        return [(command, key, field) for command, key, field, amount in propagations]
+
+    def _get_bucket_increments(self, unique_identifier, metric, date, inc_amt):
+        """
+        Returns the increments for the daily, weekly, monthly (and yearly) buckets and the overall
+        counter of ``metric`` for ``unique_identifier`` on ``date``.
+        """
+        closest_monday = self._get_closest_week(date)
+        hash_key_weekly = self._get_weekly_metric_key(unique_identifier, date)
+
+        increments = [
+            ("hincrby", self._get_daily_metric_key(unique_identifier, date), self._get_daily_metric_name(metric, date), inc_amt),
+            ("hincrby", hash_key_weekly, self._get_weekly_metric_name(metric, closest_monday), inc_amt),
+            ("hincrby", hash_key_weekly, self._get_monthly_metric_name(metric, date), inc_amt),
+            ("incrby", self._get_count_key(unique_identifier, metric), None, inc_amt),
+        ]
+
+        if self._year_rollups:
+            increments.insert(3, ("hincrby", hash_key_weekly, self._get_yearly_metric_name(metric, date), inc_amt))
+
+        return increments
+
+    def _write_increments(self, conn, increments):
+        """
+        Queues the ``(command, key, field, amount)`` increments on ``conn``.
+        """
+        results = []
+        for command, key, field, amount in increments:
+            if command == "incrby":
+                results.append(conn.incr(key, amount))
+            elif command == "hincrby":
+                results.append(conn.hincrby(key, field, amount))
+            elif command == "sadd":
+                results.append(conn.sadd(key, field))
+            else:
+                results.append(conn.zincrby(key, field, amount))
+        return results
+
+    def _get_script(self, name):
+        """
+        Registers the lua script called ``name`` from ``analytics.backends.scripts`` once
+        and returns it.
+        """
+        if name not in self._scripts:
+            host = self._analytics_backend[iter(self._analytics_backend).next()]
+            self._scripts[name] = host.connection.register_script(getattr(scripts, name))
+        return self._scripts[name]
+
+    def _apply_increments(self, increments, failed=None):
+        """
+        Writes the ``(command, key, field, amount)`` increments and returns their results in order.
+        If scripting is enabled, each node gets a single EVALSHA for the increments it owns, with
+        the nodes written in parallel, so all the buckets on a node are updated atomically. Otherwise
+        everything is pipelined.
+
+        If ``failed`` is a list, the increments are written node by node and the ones whose write
+        raised a redis error are appended to it instead of raising. Their results are left as ``None``.
+        """
+        increments = list(increments)
+        if self._cache is not None:
+            for command, key, field, amount in increments:
+                if command == "hincrby":
+                    self._invalidate_cache(key, field)
+
+        if not self._use_scripts and failed is None:
+            with self._analytics_backend.map() as conn:
+                results = self._write_increments(conn, increments)
+                expiring = self._expire_new_keys(conn, (key for command, key, field, amount in increments))
+            self._mark_expiring(expiring)
+            return results
+
+        results = [None] * len(increments)
+        indexes_by_node = defaultdict(list)
+        for index, (command, key, field, amount) in enumerate(increments):
+            indexes_by_node[self._analytics_backend.get_conn(key).num].append(index)
+
+        def write_chunk(client, chunk):
+            try:
+                return self._apply_node_increments(client, [increments[index] for index in chunk])
+            except RedisError:
+                if failed is None:
+                    raise
+
+        written = []
+        for chunk, node_results in self._map_nodes(write_chunk, indexes_by_node):
+            node_increments = [increments[index] for index in chunk]
+            if node_results is None:
+                failed.extend(node_increments)
+                continue
+            for index, result in zip(chunk, node_results):
+                results[index] = result
+            written.extend(node_increments)
+
+        if self._retention:
+            #keys that weren't written may not exist, and an expiry sent to them would be lost
+            with self._analytics_backend.map() as conn:
+                expiring = self._expire_new_keys(conn, (key for command, key, field, amount in written))
+            self._mark_expiring(expiring)
+
+        return results
+
+    def _map_nodes(self, func, indexes_by_node):
+        """
+        Calls ``func(client, chunk)`` for every chunk of up to ``_script_chunk_size`` of the indexes each
+        node owns in ``indexes_by_node``. The nodes are called in parallel and the chunks of a node one
+        after the other.
+
+        :return: A list of the ``(chunk, result)`` of every call
+        """
+        def map_node((db_num, indexes)):
+            client = self._analytics_backend[db_num].connection
+            return [(indexes[start:start + self._script_chunk_size], func(client, indexes[start:start + self._script_chunk_size]))
+                for start in xrange(0, len(indexes), self._script_chunk_size)]
+
+        nodes = indexes_by_node.items()
+        if len(nodes) > 1:
+            with self._nodes_pool_lock:
+                if self._nodes_pool is None:
+                    self._nodes_pool = ThreadPool(len(list(self._analytics_backend)))
+            return list(itertools.chain.from_iterable(self._nodes_pool.map(map_node, nodes)))
+        return list(itertools.chain.from_iterable(map(map_node, nodes)))
+
+    def _apply_node_increments(self, client, increments):
+        """
+        Writes ``increments`` that all live on the redis ``client``, using the ``TRACK_INCREMENTS``
+        script if possible.
+        """
+        if self._use_scripts:
+            keys = [key for command, key, field, amount in increments]
+            args = list(itertools.chain.from_iterable((command, field or "", amount) for command, key, field, amount in increments))
+            try:
+                return self._get_script("TRACK_INCREMENTS")(keys=keys, args=args, client=client)
+            except ResponseError, e:
+                if "unknown command" not in str(e).lower():
+                    raise
+                #scripting isn't available on this server, use pipelines from now on
+                self._use_scripts = False
+
+        pipe = client.pipeline(transaction=False)
+        self._write_increments(pipe, increments)
+        return pipe.execute()
+
+    def _flush_increments(self, pending):
+        """
+        Writes a dictionary of ``(command, key, field): amount`` increments in a single batch. If some
+        nodes couldn't be written, raises a ``FlushError`` holding only their increments so the buffer
+        doesn't count the others twice when it retries.
+        """
+        failed = []
+        self._apply_increments(((command, key, field, amount) for (command, key, field), amount in pending.iteritems()), failed=failed)
+        if failed:
+            raise FlushError(dict(((command, key, field), amount) for command, key, field, amount in failed))
+
+    def _get_closed_fields(self, fields, period_ends):
+        """
+        Returns the set of ``fields`` whose period ended (the date in ``period_ends`` is the first
+        day after it) at least ``grace_days`` ago. Those periods shouldn't change anymore, so their
+        values can be cached.
+        """
+        if self._cache is None:
+            return frozenset()
+
+        today = datetime.date.today()
+        return frozenset(field for field, period_end in itertools.izip(fields, period_ends)
+            if (period_end.date() if hasattr(period_end, 'date') else period_end) + self._cache_grace <= today)
+
+    def _hmget(self, conn, key, fields, closed_fields=frozenset(), owned_fields=None):
+        """
+        HMGET ``fields`` of ``key`` on ``conn``, answering the ``closed_fields`` from the read-through
+        cache where possible. If ``owned_fields`` is given, the other fields can't be in ``key`` and are
+        answered with ``None`` without asking redis. The reply always lines up with ``fields``.
+        """
+        known = {}
+        missing = []
+        for field in fields:
+            if owned_fields is not None and field not in owned_fields:
+                known[field] = None
+                continue
+
+            value = self._cache.get((key, field), _MISSING) if field in closed_fields else _MISSING
+            if value is _MISSING:
+                missing.append(field)
+            else:
+                known[field] = value
+
+        if not known and not closed_fields:
+            return conn.hmget(key, fields)
+
+        reply = conn.hmget(key, missing) if missing else None
+        return PartialReply(self._cache, key, fields, known, missing, reply, closed_fields)
+
+    def _get_owned_fields(self, key_func, fields, owner_dates):
+        """
+        Maps the hash keys returned by ``key_func`` to the set of ``fields`` they can hold. ``owner_dates``
+        has the dates of the hashes each field is stored in, e.g. both years for a week that spans two.
+        """
+        owned_fields = defaultdict(set)
+        for field, dates in itertools.izip(fields, owner_dates):
+            for date in dates:
+                owned_fields[key_func(date)].add(field)
+        return owned_fields
+
+    def _invalidate_cache(self, key, field):
+        """
+        Drops ``field`` of the hash ``key`` from the read-through cache after it was written.
+        """
+        if self._cache is not None:
+            self._cache.delete((key, field))
+
     def _parse_and_process_metrics(self, series, list_of_metrics):
-        formatted_result_list = []
-        series = [dt.strftime("%Y-%m-%d") for dt in series]
+        """
+        Sums the HMGET replies in ``list_of_metrics`` position-wise, in a single pass, and maps the
+        totals to the dates in ``series``.
+        """
+        #isoformat is much faster than strftime, the slice drops the time of datetimes
+        series = [dt.isoformat()[:10] for dt in series]
+        totals = [0] * len(series)
         for result in list_of_metrics:
-            values = {}
-            for index, date_string in enumerate(series):
-                values[date_string] = int(result[index]) if result[index] is not None else 0
-            formatted_result_list.append(values)
+            for index, value in enumerate(result):
+                if value is not None:
+                    totals[index] += int(value)
 
-        merged_values = reduce(
-            lambda a, b: dict((n, a.get(n, 0) + b.get(n, 0)) for n in set(a) | set(b)),
-            formatted_result_list)
+        return set(series), dict(itertools.izip(series, totals))
 
-        return set(series), merged_values
+    def _get_metrics_matrix(self, results):
+        """
+        Merges the ``(series, list_of_metrics)`` results of several metrics into a single int64 numpy
+        array. The HMGET replies of every metric are converted in one go and the replies belonging to
+        the same metric are summed position-wise.
+        """
+        if not results:
+            return [], numpy.zeros((0, 0), dtype=numpy.int64)
+
+        series = [dt.strftime("%Y-%m-%d") for dt in results[0][0]]
+        replies = [list(reply) for _, list_of_metrics in results for reply in list_of_metrics]
+        values = numpy.array(replies, dtype=object).reshape(len(replies), len(series))
+        values[numpy.equal(values, None)] = 0
+
+        #index of the first reply of each metric
+        offsets = numpy.cumsum([0] + [len(list_of_metrics) for _, list_of_metrics in results[:-1]])
+        return series, numpy.add.reduceat(values.astype(numpy.int64), offsets, axis=0)
 
     def _num_weeks(self, start_date, end_date):
         closest_monday = self._get_closest_week(start_date)
@@ -148,20 +850,466 @@ class Redis(BaseAnalyticsBackend):
     def _num_months(self, start_date, end_date):
         return ((end_date.year - start_date.year) * 12) + (end_date.month - start_date.month) + 1
 
-    def clear_all(self):
+    def flush(self):
+        """
+        Writes out all the increments held in the write buffer. Does nothing if the
+        backend isn't configured with a ``buffer``.
+        """
+        if self._buffer is not None:
+            self._buffer.flush()
+
+    def close(self):
+        """
+        Flushes the write buffer and disconnects from all the redis hosts.
         """
-        Deletes all ``sandsnake`` related data from redis.
+        self.flush()
+        with self._nodes_pool_lock:
+            if self._nodes_pool is not None:
+                self._nodes_pool.close()
+                self._nodes_pool.join()
+                self._nodes_pool = None
+        for host in self._analytics_backend.hosts.itervalues():
+            host.connection_pool.disconnect()
+
+    def clear_all(self, batch_size=1000):
+        """
+        Deletes all ``sandsnake`` related data from redis, including the metric ids used by the
+        compact key layout, and empties the read-through cache. The keys are found with ``SCAN``
+        and deleted in batches, on all the hosts in parallel.
 
         .. warning::
 
             Very expensive and destructive operation. Use with causion
+
+        :param batch_size: The number of keys deleted at a time on each host
+        :return: The number of keys deleted
         """
-        keys = self._analytics_backend.keys()
+        deleted = self._scan_hosts([self._prefix + "*"], self._unlink, batch_size)
+
+        self._metric_ids = {}
+        self._expiring_keys.clear()
+        if self._cache is not None:
+            self._cache.clear()
+
+        return deleted
 
-        for key in itertools.chain(*keys):
+    def clear_unique_identifier(self, unique_identifier, batch_size=1000):
+        """
+        Deletes the daily, weekly, monthly and yearly metrics and the counters of every metric
+        tracked for ``unique_identifier``, and removes it from the ``metric_index``. It stays in
+        the leaderboards and unique counts it was tracked in.
+
+        :param unique_identifier: Unique string indetifying the object to delete the metrics of
+        :param batch_size: The number of keys checked at a time on each host
+        :return: The number of keys deleted
+        """
+        uid_part = self._escape_pattern(self._get_uid_key_part(unique_identifier))
+        if self._compact_keys:
+            patterns = [self._prefix + ":[dyc]:" + uid_part + ":*"]
+        else:
+            patterns = [self._prefix + ":user:" + uid_part + ":analy:*", self._prefix + ":analy:" + uid_part + ":count:*"]
+
+        def clear_batch(client, keys):
+            #the patterns also match unique identifiers that start with this one followed by a colon
+            parsed_keys = [(key, self._parse_key(key)) for key in keys]
+            return self._unlink(client, [key for key, parsed_key in parsed_keys if parsed_key and parsed_key[1] == str(unique_identifier)])
+
+        deleted = self._scan_hosts(patterns, clear_batch, batch_size)
+
+        if self._metric_index:
+            metrics_key = self._get_metrics_index_key(unique_identifier)
+            metrics = self._analytics_backend.smembers(metrics_key)
+            with self._analytics_backend.map() as conn:
+                for metric in metrics:
+                    conn.srem(self._get_uids_index_key(metric), str(unique_identifier))
+                conn.delete(metrics_key)
+
+        if self._cache is not None:
+            self._cache.clear()
+
+        return deleted
+
+    def clear_metric(self, metric, batch_size=1000):
+        """
+        Deletes everything tracked for ``metric``: its fields in the daily and yearly hashes, its
+        counters, leaderboards and unique counts, and its entries in the ``metric_index``.
+
+        :param metric: The name of the metric to delete
+        :param batch_size: The number of keys checked at a time on each host
+        :return: The number of keys and hash fields deleted
+        """
+        if self._compact_keys:
+            #fields and counters name the metric by its id, a metric that was never interned has none
+            metric_id = self._metric_ids.get(metric) or self._analytics_backend.hget(self._prefix + ":metric_ids", metric)
+        else:
+            metric_id = metric
+
+        def clear_batch(client, keys):
+            hash_keys, deleted_keys = [], []
+            for key in keys:
+                parsed_key = self._parse_key(key)
+                if parsed_key is not None:
+                    kind, unique_identifier, value = parsed_key
+                    if kind != "count":
+                        hash_keys.append((key, kind))
+                    elif value == metric_id:
+                        deleted_keys.append(key)
+                else:
+                    parsed_key = self._parse_period_key(key)
+                    if parsed_key is not None and parsed_key[0] == metric:
+                        deleted_keys.append(key)
+
+            select_field = lambda kind, field: (self._parse_field(kind, field) or (None, None, None))[1] == metric_id
+            return self._unlink(client, deleted_keys) + self._hdel_fields(client, hash_keys, select_field)
+
+        deleted = self._scan_hosts([self._prefix + ":*"], clear_batch, batch_size)
+
+        if self._metric_index:
+            uids_key = self._get_uids_index_key(metric)
+            unique_identifiers = self._analytics_backend.smembers(uids_key)
             with self._analytics_backend.map() as conn:
-                if key.startswith(self._prefix):
-                    conn.delete(key)
+                for unique_identifier in unique_identifiers:
+                    conn.srem(self._get_metrics_index_key(unique_identifier), metric)
+                conn.srem(self._get_metrics_index_key(), metric)
+                conn.delete(uids_key)
+
+        return deleted
+
+    def clear_before(self, date, batch_size=1000):
+        """
+        Deletes the days, weeks, months and years that ended before ``date``, along with their
+        leaderboards and unique counts. The overall counters are kept.
+
+        :param date: A python date object. Periods ending on or before it are deleted
+        :param batch_size: The number of keys checked at a time on each host
+        :return: The number of keys and hash fields deleted
+        """
+        date = date.date() if hasattr(date, 'date') else date
+
+        def clear_batch(client, keys):
+            hash_keys, deleted_keys = [], []
+            for key in keys:
+                parsed_key = self._parse_key(key)
+                if parsed_key is not None:
+                    kind, unique_identifier, period_start = parsed_key
+                    if kind == "count":
+                        continue
+                    granularity = "month" if kind == "day" else "year"
+                    if self._get_period_end(granularity, period_start) <= date:
+                        deleted_keys.append(key)
+                    elif period_start < date:
+                        hash_keys.append((key, kind))
+                else:
+                    parsed_key = self._parse_period_key(key)
+                    if parsed_key is not None and self._get_period_end(parsed_key[1], parsed_key[2]) <= date:
+                        deleted_keys.append(key)
+
+            def select_field(kind, field):
+                parsed_field = self._parse_field(kind, field)
+                return parsed_field is not None and self._get_period_end(parsed_field[0], parsed_field[2]) <= date
+
+            return self._unlink(client, deleted_keys) + self._hdel_fields(client, hash_keys, select_field)
+
+        deleted = self._scan_hosts([self._prefix + ":*"], clear_batch, batch_size)
+
+        #whole hashes are deleted, so the fields cached for them can't be picked out one by one
+        if self._cache is not None:
+            self._cache.clear()
+
+        return deleted
+
+    def _scan_hosts(self, patterns, process_batch, batch_size):
+        """
+        Finds the keys matching any of the glob ``patterns`` with ``SCAN`` and calls
+        ``process_batch(client, keys)`` with up to ``batch_size`` of them at a time. The hosts
+        are scanned in parallel.
+
+        :return: The sum of what ``process_batch`` returned
+        """
+        def scan_host(db_num):
+            client = self._analytics_backend[db_num].connection
+            total = 0
+            for pattern in patterns:
+                keys = client.scan_iter(match=pattern, count=batch_size)
+                while True:
+                    batch = list(itertools.islice(keys, batch_size))
+                    if not batch:
+                        break
+                    total += process_batch(client, batch)
+            return total
+
+        db_nums = list(self._analytics_backend)
+        pool = ThreadPool(len(db_nums))
+        try:
+            return sum(pool.map(scan_host, db_nums))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _unlink(self, client, keys):
+        """
+        Deletes ``keys`` with a single ``UNLINK``, so redis frees their memory in the background.
+        Falls back to ``DEL`` on servers that don't have ``UNLINK`` (redis < 4.0).
+        """
+        if not keys:
+            return 0
+
+        #keys written again after being deleted need their expiry set again
+        for key in keys:
+            self._expiring_keys.delete(key)
+
+        if self._use_unlink:
+            try:
+                return client.execute_command("UNLINK", *keys)
+            except ResponseError, e:
+                if "unknown command" not in str(e).lower():
+                    raise
+                self._use_unlink = False
+
+        return client.delete(*keys)
+
+    def _hdel_fields(self, client, hash_keys, select_field):
+        """
+        Deletes the fields of the ``(key, kind)`` hashes for which ``select_field(kind, field)``
+        is true. The fields of all the hashes are read in one pipeline and deleted in another.
+
+        :return: The number of fields deleted
+        """
+        if not hash_keys:
+            return 0
+
+        pipe = client.pipeline(transaction=False)
+        for key, kind in hash_keys:
+            pipe.hkeys(key)
+        replies = pipe.execute()
+
+        pipe = client.pipeline(transaction=False)
+        for (key, kind), fields in zip(hash_keys, replies):
+            fields = [field for field in fields if select_field(kind, field)]
+            if fields:
+                #redis deletes the hash along with its last field
+                self._expiring_keys.delete(key)
+                pipe.hdel(key, *fields)
+                for field in fields:
+                    self._invalidate_cache(key, field)
+        return sum(pipe.execute())
+
+    def _escape_pattern(self, value):
+        """
+        Escapes the glob characters in ``value`` so it only matches itself in a ``SCAN`` pattern.
+        """
+        return re.sub(r"([*?\[\]\\])", r"\\\1", value)
+
+    def _parse_field(self, kind, field):
+        """
+        Works out what a field of a hash of the given ``kind`` (see ``_parse_key``) holds.
+
+        :return: A ``(granularity, metric, period_start)`` tuple, or ``None`` if ``field`` isn't a metric
+            field. ``metric`` is the metric id in the compact key layout.
+        """
+        try:
+            if self._compact_keys:
+                metric, offset = field.split(":", 1)
+                if offset[0] == "w":
+                    return "week", metric, self._compact_epoch + datetime.timedelta(days=int(offset[1:]))
+                elif offset[0] == "m":
+                    return "month", metric, self._compact_epoch + relativedelta(months=int(offset[1:]))
+                elif offset[0] == "y":
+                    return "year", metric, datetime.date(year=self._compact_epoch.year + int(offset[1:]), month=1, day=1)
+                return "day", metric, self._compact_epoch + datetime.timedelta(days=int(offset))
+
+            metric, period = field.rsplit(":", 1)
+            if kind == "day":
+                return "day", metric, datetime.datetime.strptime(period, "%y-%m-%d").date()
+            elif len(period) == 8:
+                return "week", metric, datetime.datetime.strptime(period, "%y-%m-%d").date()
+            elif len(period) == 5:
+                return "month", metric, datetime.datetime.strptime(period, "%y-%m").date()
+            return "year", metric, datetime.datetime.strptime(period, "%y").date()
+        except (IndexError, ValueError):
+            return None
+
+    def _parse_period_key(self, key):
+        """
+        Works out what a leaderboard or unique count key holds.
+
+        :return: A ``(metric, granularity, period_start)`` tuple, or ``None`` if ``key`` is neither
+        """
+        rest = key[len(self._prefix) + 1:]
+        if not key.startswith(self._prefix + ":") or not rest.startswith(("uniq:", "top:")):
+            return None
+
+        try:
+            metric, granularity, period = rest.split(":", 1)[1].rsplit(":", 2)
+            granularity = {"d": "day", "w": "week", "m": "month"}[granularity]
+            period_start = datetime.datetime.strptime(period, "%y-%m" if granularity == "month" else "%y-%m-%d").date()
+        except (KeyError, ValueError):
+            return None
+
+        if self._hash_tags and metric.startswith("{") and metric.endswith("}"):
+            metric = metric[1:-1]
+
+        return metric, granularity, period_start
+
+    def _get_period_end(self, granularity, period_start):
+        """
+        Returns the first day after the ``granularity`` long period starting on ``period_start``.
+        """
+        if granularity == "day":
+            return period_start + datetime.timedelta(days=1)
+        elif granularity == "week":
+            return period_start + datetime.timedelta(weeks=1)
+        elif granularity == "month":
+            return period_start + relativedelta(months=1)
+        return period_start + relativedelta(years=1)
+
+    def apply_retention(self, batch_size=1000):
+        """
+        Sets an expiry on every existing metric key that doesn't have one yet, according to the
+        ``retention`` settings. Keys whose retention period is already over are deleted.
+
+        :param batch_size: The number of keys checked at a time on each host
+        :return: The number of keys that were given an expiry
+        """
+        updated = 0
+        for db_num in self._analytics_backend:
+            client = self._analytics_backend[db_num].connection
+            keys = client.scan_iter(match=self._prefix + ":*", count=batch_size)
+            while True:
+                batch = list(itertools.islice(keys, batch_size))
+                if not batch:
+                    break
+
+                pipe = client.pipeline(transaction=False)
+                for key in batch:
+                    pipe.ttl(key)
+                ttls = pipe.execute()
+
+                pipe = client.pipeline(transaction=False)
+                for key, ttl in zip(batch, ttls):
+                    #keys without an expiry have a ttl of -1 (None on older versions of redis-py)
+                    expire_at = self._get_expire_at(key) if ttl is None or ttl < 0 else None
+                    if expire_at is not None:
+                        pipe.expireat(key, expire_at)
+                        updated += 1
+                pipe.execute()
+
+        return updated
+
+    def migrate_to_hash_tags(self, batch_size=1000):
+        """
+        Moves data stored with the default key layout over to the ``hash_tags`` key layout. The backend
+        has to be configured with ``hash_tags``. Old values are added to whatever is stored under the new
+        keys, so switch everything that tracks metrics over to ``hash_tags`` before running this.
+
+        :param batch_size: The number of keys read, written and deleted at a time on each host
+        :return: The number of keys that were migrated
+        """
+        if not self._hash_tags:
+            raise Exception("The backend must be configured with hash_tags to migrate to them.")
+        if self._compact_keys:
+            raise Exception("Only the default key layout can be migrated to hash_tags.")
+
+        hash_key_prefix = self._prefix + ":user:"
+        count_key_prefix = self._prefix + ":analy:"
+        is_tagged = lambda uid: uid.startswith("{") and uid.endswith("}")
+        migrated = 0
+
+        for db_num in self._analytics_backend:
+            client = self._analytics_backend[db_num].connection
+            keys = client.scan_iter(match=self._prefix + ":*", count=batch_size)
+            while True:
+                scanned = list(itertools.islice(keys, batch_size))
+                if not scanned:
+                    break
+
+                batch = []
+                for key in scanned:
+                    if key.startswith(hash_key_prefix) and ":analy:" in key:
+                        uid, period = key[len(hash_key_prefix):].rsplit(":analy:", 1)
+                        if not is_tagged(uid):
+                            batch.append((key, self._prefix + ":" + "user:{%s}:analy:%s" % (uid, period,), True))
+                    elif key.startswith(count_key_prefix) and ":count:" in key:
+                        uid, metric = key[len(count_key_prefix):].split(":count:", 1)
+                        if not is_tagged(uid):
+                            batch.append((key, self._get_count_key(uid, metric), False))
+                if not batch:
+                    continue
+
+                pipe = client.pipeline(transaction=False)
+                for key, new_key, is_hash in batch:
+                    pipe.hgetall(key) if is_hash else pipe.get(key)
+                values = pipe.execute()
+
+                increments = []
+                for (key, new_key, is_hash), value in zip(batch, values):
+                    if is_hash:
+                        increments.extend(("hincrby", new_key, field, int(amount)) for field, amount in value.iteritems())
+                    elif value is not None:
+                        increments.append(("incrby", new_key, None, int(value)))
+                self._apply_increments(increments)
+
+                client.delete(*[key for key, new_key, is_hash in batch])
+                migrated += len(batch)
+
+        return migrated
+
+    def get_compact_savings(self, unique_identifier, metric, date):
+        """
+        Reports how many bytes the compact key layout saves on the keys holding ``metric`` for
+        ``unique_identifier`` around ``date``: the daily hash of its month, the hash of its year and
+        the overall counter. The names of the key and of the fields of ``metric`` stored in it are
+        measured in both layouts. Nothing is written to redis, so metrics that were never given a
+        compact id are measured with the id they would get next.
+
+        :return: A list of ``(key, compact_key, bytes_saved)`` tuples, one for each of the keys that
+            exist, using the default layout for ``key``
+        """
+        metric_id = self._metric_ids.get(metric) or self._analytics_backend.hget(self._prefix + ":metric_ids", metric)
+        if metric_id is None:
+            metric_id = str(int(self._analytics_backend.get(self._prefix + ":metric_ids:next") or 0) + 1)
+
+        #copies of the backend that only format names, the metric id is set so none gets allocated
+        layouts = {}
+        for compact_keys in (False, True):
+            layouts[compact_keys] = copy.copy(self)
+            layouts[compact_keys]._compact_keys = compact_keys
+            layouts[compact_keys]._metric_ids = {metric: metric_id}
+        current, other = layouts[self._compact_keys], layouts[not self._compact_keys]
+
+        field_names = {
+            "day": "_get_daily_metric_name",
+            "week": "_get_weekly_metric_name",
+            "month": "_get_monthly_metric_name",
+            "year": "_get_yearly_metric_name",
+        }
+        keys = [
+            ("day", current._get_daily_metric_key(unique_identifier, date), other._get_daily_metric_key(unique_identifier, date)),
+            ("year", current._get_weekly_metric_key(unique_identifier, date), other._get_weekly_metric_key(unique_identifier, date)),
+            ("count", current._get_count_key(unique_identifier, metric), other._get_count_key(unique_identifier, metric)),
+        ]
+        with self._analytics_backend.map() as conn:
+            replies = [conn.exists(key) if kind == "count" else conn.hkeys(key) for kind, key, other_key in keys]
+
+        savings = []
+        for (kind, key, other_key), reply in zip(keys, replies):
+            if not reply:
+                continue
+
+            bytes_saved = len(key) - len(other_key)
+            if kind != "count":
+                for field in reply:
+                    parsed_field = self._parse_field(kind, field)
+                    if parsed_field is not None and parsed_field[1] == (metric_id if self._compact_keys else metric):
+                        granularity, _, period_start = parsed_field
+                        bytes_saved += len(field) - len(getattr(other, field_names[granularity])(metric, period_start))
+
+            if self._compact_keys:
+                savings.append((other_key, key, -bytes_saved))
+            else:
+                savings.append((key, other_key, bytes_saved))
+
+        return savings
 
     def track_count(self, unique_identifier, metric, inc_amt=1, **kwargs):
         """
@@ -173,7 +1321,11 @@ class Redis(BaseAnalyticsBackend):
         :param inc_amt: The amount you want to increment the ``metric`` for the ``unique_identifier``
         :return: ``True`` if successful ``False`` otherwise
         """
-        return self._analytics_backend.incr(self._prefix + ":" + "analy:%s:count:%s" % (unique_identifier, metric), inc_amt)
+        if self._buffer is not None:
+            self._buffer.add(("incrby", self._get_count_key(unique_identifier, metric), None), inc_amt)
+            return True
+
+        return self._analytics_backend.incr(self._get_count_key(unique_identifier, metric), inc_amt)
 
     def track_metric(self, unique_identifier, metric, date=None, inc_amt=1, **kwargs):
         """
@@ -181,6 +1333,9 @@ class Redis(BaseAnalyticsBackend):
         lists for both ``unique_identifier`` and ``metric`` allowing for tracking of multiple metrics for multiple
         unique_identifiers efficiently. Not all backends may support this.
 
+        If the backend was configured with a ``buffer``, the increments are summed in-process and
+        only written to redis once the buffer is flushed. They won't show up in queries until then.
+
         :param unique_identifier: Unique string indetifying the object this metric is for
         :param metric: A unique name for the metric you want to track. This can be a list or a string.
         :param date: A python date object indicating when this event occured. Defaults to today.
@@ -189,31 +1344,153 @@ class Redis(BaseAnalyticsBackend):
         """
         metric = [metric] if isinstance(metric, basestring) else metric
         unique_identifier = [unique_identifier] if not isinstance(unique_identifier, (types.ListType, types.TupleType, types.GeneratorType,)) else unique_identifier
-        results = []
         if date is None:
             date = datetime.date.today()
-        with self._analytics_backend.map() as conn:
+
+        if self._buffer is not None:
             for uid in unique_identifier:
+                for single_metric in metric:
+                    for command, key, field, amount in self._get_metric_increments(uid, single_metric, date, inc_amt):
+                        self._buffer.add((command, key, field), amount)
+            return True
 
-                hash_key_daily = self._get_daily_metric_key(uid, date)
-                closest_monday = self._get_closest_week(date)
-                hash_key_weekly = self._get_weekly_metric_key(uid, date)
+        increments = [
+            self._get_metric_increments(uid, single_metric, date, inc_amt)
+            for uid in unique_identifier for single_metric in metric]
+        flat_results = iter(self._apply_increments(itertools.chain(*increments)))
 
-                for single_metric in metric:
-                    daily_metric_name = self._get_daily_metric_name(single_metric, date)
-                    weekly_metric_name = self._get_weekly_metric_name(single_metric, closest_monday)
-                    monthly_metric_name = self._get_monthly_metric_name(single_metric, date)
-
-                    results.append(
-                        [
-                            conn.hincrby(hash_key_daily, daily_metric_name, inc_amt),
-                            conn.hincrby(hash_key_weekly, weekly_metric_name, inc_amt),
-                            conn.hincrby(hash_key_weekly, monthly_metric_name, inc_amt),
-                            conn.incr(self._prefix + ":" + "analy:%s:count:%s" % (uid, single_metric), inc_amt)
-                        ]
-                    )
+        #group the results by uid and metric
+        return [list(itertools.islice(flat_results, len(metric_increments))) for metric_increments in increments]
 
-        return results
+    def track_events(self, events, chunk_size=10000, **kwargs):
+        """
+        Tracks a stream of events. Each event is a tuple of the form
+        ``(unique_identifier, metric, date, inc_amt)``, where ``inc_amt`` is optional and ``date`` can be
+        ``None`` for today.
+
+        Increments for the same bucket are summed in memory and written out in pipelined chunks once
+        ``chunk_size`` distinct buckets are pending, so any iterator can be consumed with bounded memory.
+
+        :param events: An iterable of events
+        :param chunk_size: The maximum number of distinct buckets held in memory before writing to redis
+        :return: A dictionary summarizing how many events and writes were made and how long it took
+        """
+        started = time.time()
+        num_events = 0
+        num_writes = 0
+        pending = defaultdict(int)
+        today = datetime.date.today()
+
+        for event in events:
+            unique_identifier, metric, date = event[:3]
+            inc_amt = event[3] if len(event) > 3 else 1
+            for command, key, field, amount in self._get_metric_increments(unique_identifier, metric, date or today, inc_amt):
+                pending[(command, key, field)] += amount
+            num_events += 1
+
+            if len(pending) >= chunk_size:
+                self._flush_increments(pending)
+                num_writes += len(pending)
+                pending = defaultdict(int)
+
+        if pending:
+            self._flush_increments(pending)
+            num_writes += len(pending)
+
+        return self._get_throughput_summary(num_events, num_writes, time.time() - started)
+
+    def bulk_load(self, rows, chunk_size=1000, sorted_by_uid=False, **kwargs):
+        """
+        Loads historical daily counts. Each row is a tuple of the form ``(unique_identifier, metric, date, count)``;
+        rows for the same day are summed. The daily, weekly, monthly (and yearly) buckets and the overall counts
+        are computed in memory and written with a single HMSET per hash, in one pipeline per host for each chunk
+        of ``chunk_size`` unique identifiers.
+
+        Loading replaces the buckets, overall counts and leaderboard scores of the metrics in the rows, so load the whole
+        history of a metric for a unique identifier in one go, before tracking it. The global rollups span every unique
+        identifier, so the loaded counts are added to them instead.
+
+        :param rows: An iterable of rows, in any order
+        :param chunk_size: The number of unique identifiers written at a time
+        :param sorted_by_uid: Set to ``True`` if all the rows of a unique identifier are next to each other, so the rows
+            can be streamed with bounded memory. Otherwise every row is held in memory until all of them are read.
+        :return: A dictionary summarizing how many rows (``events``) were loaded, how many writes were made and how long it took
+        """
+        started = time.time()
+        num_rows = 0
+        num_writes = 0
+        #unique_identifier: {(metric, date): count}
+        chunk = {}
+
+        for unique_identifier, metric, date, count in rows:
+            if sorted_by_uid and unique_identifier not in chunk and len(chunk) >= chunk_size:
+                num_writes += self._load_chunk(chunk)
+                chunk = {}
+
+            date = date.date() if hasattr(date, 'date') else date
+            chunk.setdefault(unique_identifier, defaultdict(int))[(metric, date)] += int(count)
+            num_rows += 1
+
+        unique_identifiers = chunk.keys()
+        for start in xrange(0, len(unique_identifiers), chunk_size):
+            num_writes += self._load_chunk(dict((uid, chunk[uid]) for uid in unique_identifiers[start:start + chunk_size]))
+
+        return self._get_throughput_summary(num_rows, num_writes, time.time() - started)
+
+    def _load_chunk(self, chunk):
+        """
+        Writes the buckets of a ``{unique_identifier: {(metric, date): count}}`` chunk of ``bulk_load`` and
+        returns the number of commands sent.
+        """
+        hashes = defaultdict(lambda: defaultdict(int))
+        counters = defaultdict(int)
+        sets = defaultdict(set)
+        leaderboards = defaultdict(lambda: defaultdict(int))
+        #(command, key, field): amount
+        global_increments = defaultdict(int)
+        for unique_identifier, counts in chunk.iteritems():
+            for (metric, date), count in counts.iteritems():
+                for command, key, field, amount in self._get_bucket_increments(unique_identifier, metric, date, count):
+                    if command == "hincrby":
+                        hashes[key][field] += amount
+                    else:
+                        counters[key] += amount
+
+                if self._has_global_rollup(metric) and unique_identifier != GLOBAL_IDENTIFIER:
+                    for command, key, field, amount in self._get_bucket_increments(GLOBAL_IDENTIFIER, metric, date, count):
+                        global_increments[(command, key, field)] += amount
+
+                if self._has_leaderboard(metric):
+                    for command, key, member, amount in self._get_leaderboard_increments(unique_identifier, metric, date, count):
+                        leaderboards[key][member] += amount
+
+                if self._metric_index:
+                    sets[self._get_metrics_index_key(unique_identifier)].add(metric)
+                    sets[self._get_uids_index_key(metric)].add(str(unique_identifier))
+                    sets[self._get_metrics_index_key()].add(metric)
+
+        with self._analytics_backend.map() as conn:
+            for key, fields in hashes.iteritems():
+                conn.hmset(key, fields)
+            for key, count in counters.iteritems():
+                conn.set(key, count)
+            for key, members in sets.iteritems():
+                conn.sadd(key, *members)
+            for key, scores in leaderboards.iteritems():
+                conn.zadd(key, *itertools.chain(*scores.iteritems()))
+            self._write_increments(conn, [(command, key, field, amount) for (command, key, field), amount in global_increments.iteritems()])
+            expiring = self._expire_new_keys(conn, itertools.chain(hashes, leaderboards, (key for command, key, field in global_increments)))
+        self._mark_expiring(expiring)
+
+        if self._cache is not None:
+            for key, fields in hashes.iteritems():
+                for field in fields:
+                    self._invalidate_cache(key, field)
+            for command, key, field in global_increments:
+                if command == "hincrby":
+                    self._invalidate_cache(key, field)
+
+        return len(hashes) + len(counters) + len(sets) + len(leaderboards) + len(global_increments)
 
     def get_metric_by_day(self, unique_identifier, metric, from_date, limit=30, **kwargs):
         """
@@ -232,9 +1509,13 @@ class Redis(BaseAnalyticsBackend):
         series = list(itertools.islice(date_generator, limit))
 
         metric_keys = [self._get_daily_metric_name(metric, daily_date) for daily_date in series]
+        closed_fields = self._get_closed_fields(metric_keys, (daily_date + datetime.timedelta(days=1) for daily_date in series))
+
+        key_func = lambda metric_key_date: self._get_daily_metric_key(unique_identifier, metric_key_date)
+        owned_fields = self._get_owned_fields(key_func, metric_keys, ([daily_date] for daily_date in series))
 
-        metric_func = lambda conn: [conn.hmget(self._get_daily_metric_key(unique_identifier, \
-                    metric_key_date), metric_keys) for metric_key_date in metric_key_date_range]
+        metric_func = lambda conn: [self._hmget(conn, key_func(metric_key_date), metric_keys, closed_fields,
+            owned_fields[key_func(metric_key_date)]) for metric_key_date in metric_key_date_range]
 
         if conn is not None:
             results = metric_func(conn)
@@ -264,9 +1545,15 @@ class Redis(BaseAnalyticsBackend):
         series = list(itertools.islice(date_generator, limit))
 
         metric_keys = [self._get_weekly_metric_name(metric, monday_date) for monday_date in series]
+        closed_fields = self._get_closed_fields(metric_keys, (monday_date + datetime.timedelta(weeks=1) for monday_date in series))
 
-        metric_func = lambda conn: [conn.hmget(self._get_weekly_metric_key(unique_identifier, \
-                metric_key_date), metric_keys) for metric_key_date in metric_key_date_range]
+        key_func = lambda metric_key_date: self._get_weekly_metric_key(unique_identifier, metric_key_date)
+        #a week that spans two years is stored in the hashes of both years
+        owned_fields = self._get_owned_fields(key_func, metric_keys,
+            ([monday_date, monday_date + datetime.timedelta(days=6)] for monday_date in series))
+
+        metric_func = lambda conn: [self._hmget(conn, key_func(metric_key_date), metric_keys, closed_fields,
+            owned_fields[key_func(metric_key_date)]) for metric_key_date in metric_key_date_range]
 
         if conn is not None:
             results = metric_func(conn)
@@ -298,10 +1585,13 @@ class Redis(BaseAnalyticsBackend):
         series = list(itertools.islice(date_generator, limit))
 
         metric_keys = [self._get_monthly_metric_name(metric, month_date) for month_date in series]
+        closed_fields = self._get_closed_fields(metric_keys, (month_date + relativedelta(months=1) for month_date in series))
+
+        key_func = lambda metric_key_date: self._get_weekly_metric_key(unique_identifier, metric_key_date)
+        owned_fields = self._get_owned_fields(key_func, metric_keys, ([month_date] for month_date in series))
 
-        metric_func = lambda conn: [conn.hmget(
-            self._get_weekly_metric_key(
-                unique_identifier, metric_key_date), metric_keys) for metric_key_date in metric_key_date_range]
+        metric_func = lambda conn: [self._hmget(conn, key_func(metric_key_date), metric_keys, closed_fields,
+            owned_fields[key_func(metric_key_date)]) for metric_key_date in metric_key_date_range]
 
         if conn is not None:
             results = metric_func(conn)
@@ -312,7 +1602,186 @@ class Redis(BaseAnalyticsBackend):
 
         return series, results
 
-    def get_metrics(self, metric_identifiers, from_date, limit=10, group_by="week", **kwargs):
+    def iter_metric(self, unique_identifier, metric, start_date, end_date, granularity="day", prefetch=True, **kwargs):
+        """
+        Lazily yields ``(date, value)`` pairs for the ``metric`` for ``unique_identifier`` from ``start_date``
+        to ``end_date``, in order. Only a chunk of the series is held in memory at a time: a month of days,
+        or a year of weeks or months, which is what a single hash holds.
+
+        :param unique_identifier: Unique string indetifying the object this metric is for
+        :param metric: A unique name for the metric you want to track
+        :param start_date: A python date object
+        :param end_date: A python date object, included in the series
+        :param granularity: The size of each period. Choices are: ``day``, ``week`` or ``month``
+        :param prefetch: Fetch the next chunk in a background thread while the current one is consumed
+        """
+        allowed_types = {
+            "day": self.get_metric_by_day,
+            "week": self.get_metric_by_week,
+            "month": self.get_metric_by_month,
+        }
+        if granularity not in allowed_types:
+            raise Exception("Allowed values for granularity are day, week or month.")
+
+        start_date = start_date.date() if hasattr(start_date, 'date') else start_date
+        end_date = end_date.date() if hasattr(end_date, 'date') else end_date
+        get_metric = allowed_types[granularity]
+
+        def fetch(chunk):
+            _, results = get_metric(unique_identifier, metric, chunk[0], limit=len(chunk))
+            return [(period, results[period.isoformat()]) for period in chunk]
+
+        chunks = self._get_metric_chunks(granularity, start_date, end_date)
+        pool = ThreadPool(1) if prefetch else None
+        try:
+            chunk = next(chunks, None)
+            pending = pool.apply_async(fetch, (chunk,)) if prefetch and chunk else None
+            while chunk:
+                values = pending.get() if prefetch else fetch(chunk)
+                chunk = next(chunks, None)
+                if prefetch and chunk:
+                    pending = pool.apply_async(fetch, (chunk,))
+
+                for value in values:
+                    yield value
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def _get_metric_chunks(self, granularity, start_date, end_date):
+        """
+        Yields the periods of ``granularity`` from ``start_date`` to ``end_date`` in lists of the
+        periods stored in the same hash.
+        """
+        if granularity == "day":
+            period, step = start_date, datetime.timedelta(days=1)
+            chunk_of = lambda date: (date.year, date.month)
+        elif granularity == "week":
+            period, step = self._get_closest_week(start_date), datetime.timedelta(weeks=1)
+            chunk_of = lambda date: date.year
+        else:
+            period, step = datetime.date(year=start_date.year, month=start_date.month, day=1), relativedelta(months=1)
+            chunk_of = lambda date: date.year
+
+        chunk = []
+        while period <= end_date:
+            if chunk and chunk_of(chunk[0]) != chunk_of(period):
+                yield chunk
+                chunk = []
+            chunk.append(period)
+            period += step
+
+        if chunk:
+            yield chunk
+
+    def aggregate_metrics(self, unique_identifiers, metric, from_date, limit=10, group_by="week", **kwargs):
+        """
+        Returns the total of the ``metric`` across all the ``unique_identifiers``, segmented by ``group_by``
+        starting from ``from_date``, in the same format as ``get_metric_by_day``. The redis hosts sum the
+        hashes they hold in parallel with a lua script and only send back a single series each, so the
+        amount of data returned doesn't depend on the number of ``unique_identifiers``.
+
+        :param unique_identifiers: A list of unique strings indetifying the objects to sum the metric for
+        :param metric: A unique name for the metric you want to track
+        :param from_date: A python date object
+        :param limit: The total number of periods to retrive starting from ``from_date``
+        :param group_by: The type of aggregation to perform on the metric. Choices are: ``day``, ``week`` or ``month``
+        """
+        if group_by not in ("day", "week", "month"):
+            raise Exception("Allowed values for group_by are day, week or month.")
+
+        if group_by == "day":
+            series = [from_date + datetime.timedelta(days=i) for i in xrange(limit)]
+        elif group_by == "week":
+            closest_monday_from_date = self._get_closest_week(from_date)
+            series = [closest_monday_from_date + datetime.timedelta(weeks=i) for i in xrange(limit)]
+        else:
+            first_of_month = datetime.date(year=from_date.year, month=from_date.month, day=1)
+            series = [first_of_month + relativedelta(months=i) for i in xrange(limit)]
+
+        #group the (position, field) pairs to read by hash and the hashes by host
+        key_fields = []
+        indexes_by_node = defaultdict(list)
+        for unique_identifier in unique_identifiers:
+            fields_by_key = defaultdict(list)
+            for position, period in enumerate(series):
+                for key, field, period_end in self._get_bucket_fields(unique_identifier, metric, group_by, period):
+                    fields_by_key[key].append((position, field))
+
+            for key, fields in fields_by_key.iteritems():
+                indexes_by_node[self._analytics_backend.get_conn(key).num].append(len(key_fields))
+                key_fields.append((key, fields))
+
+        #the hosts sum their hashes in parallel
+        node_totals = self._map_nodes(
+            lambda client, chunk: self._aggregate_node_fields(client, len(series), [key_fields[index] for index in chunk]),
+            indexes_by_node)
+
+        return self._parse_and_process_metrics(series, [totals for chunk, totals in node_totals])
+
+    def _aggregate_node_fields(self, client, length, key_fields):
+        """
+        Sums the ``(key, [(position, field), ...])`` hash fields that all live on the redis ``client``
+        into a series of ``length`` values, using the ``AGGREGATE_FIELDS`` script if possible.
+        """
+        keys = [key for key, fields in key_fields]
+        args = [length]
+        for key, fields in key_fields:
+            args.append(len(fields))
+            for position, field in fields:
+                args.extend((position + 1, field))
+
+        try:
+            return self._get_script("AGGREGATE_FIELDS")(keys=keys, args=args, client=client)
+        except ResponseError, e:
+            if "unknown command" not in str(e).lower():
+                raise
+
+        #scripting isn't available on this server, sum the fields here instead
+        pipe = client.pipeline(transaction=False)
+        for key, fields in key_fields:
+            pipe.hmget(key, [field for position, field in fields])
+
+        totals = [0] * length
+        for (key, fields), values in itertools.izip(key_fields, pipe.execute()):
+            for (position, field), value in itertools.izip(fields, values):
+                if value is not None:
+                    totals[position] += int(value)
+        return totals
+
+    def list_metrics(self, unique_identifier=None, **kwargs):
+        """
+        Returns the set of metrics tracked for ``unique_identifier``, or of all the metrics if it isn't given.
+        Only metrics tracked with ``metric_index`` on are listed.
+
+        :param unique_identifier: Unique string indetifying the object to list the metrics of
+        """
+        return self._analytics_backend.smembers(self._get_metrics_index_key(unique_identifier))
+
+    def list_uids(self, metric, **kwargs):
+        """
+        Returns the set of unique identifiers the ``metric`` was tracked for. Only metrics tracked with
+        ``metric_index`` on are listed.
+
+        :param metric: A unique name for the metric
+        """
+        return self._analytics_backend.smembers(self._get_uids_index_key(metric))
+
+    def get_all_metrics(self, unique_identifier, from_date, limit=10, group_by="week", **kwargs):
+        """
+        Retrieves every metric tracked for ``unique_identifier`` in a single pipeline.
+
+        :param unique_identifier: Unique string indetifying the object to get the metrics of
+        :param from_date: A python date object
+        :param limit: The total number of periods to retrive starting from ``from_date``
+        :param group_by: The type of aggregation to perform on the metric. Choices are: ``day``, ``week`` or ``month``
+        :return: A dictionary of ``metric: (series, values)``, see ``get_metric_by_day``
+        """
+        metrics = sorted(self.list_metrics(unique_identifier))
+        results = self.get_metrics([(unique_identifier, metric) for metric in metrics], from_date, limit=limit, group_by=group_by)
+        return dict(itertools.izip(metrics, results))
+
+    def get_metrics(self, metric_identifiers, from_date, limit=10, group_by="week", output="dict", **kwargs):
         """
         Retrieves a multiple metrics as efficiently as possible.
 
@@ -321,7 +1790,15 @@ class Redis(BaseAnalyticsBackend):
         :param from_date: A python date object
         :param limit: The total number of months to retrive starting from ``from_date``
         :param group_by: The type of aggregation to perform on the metric. Choices are: ``day``, ``week`` or ``month``
+        :param output: ``dict`` to get a ``(series, values)`` tuple for each metric, or ``numpy`` to get a
+            ``(series, matrix)`` tuple, where ``series`` is the ordered list of dates and ``matrix`` is an int64
+            numpy array with a row for each metric and a column for each date. ``numpy`` has to be installed.
         """
+        if output not in ("dict", "numpy"):
+            raise Exception("Allowed values for output are dict or numpy.")
+        if output == "numpy" and numpy is None:
+            raise ImportError("numpy is required for output='numpy'")
+
         results = []
         #validation of types:
         allowed_types = {
@@ -338,6 +1815,9 @@ class Redis(BaseAnalyticsBackend):
             for unique_identifier, metric in metric_identifiers:
                 results.append(group_by_func(unique_identifier, metric, from_date, limit=limit, connection=conn))
 
+        if output == "numpy":
+            return self._get_metrics_matrix(results)
+
         #we have to merge all the metric results afterwards because we are using a custom context processor
         return [
             self._parse_and_process_metrics(series, list_of_metrics) for
@@ -354,39 +1834,47 @@ class Redis(BaseAnalyticsBackend):
         :param end_date: Get the sepcified metrics before this date
         :return: The count for the metric, 0 otherwise
         """
-        result = None
-        if start_date and end_date:
-            start_date, end_date = (start_date, end_date,) if start_date < end_date else (end_date, start_date,)
+        with self._analytics_backend.map() as conn:
+            reduce_count = self._plan_count(conn, unique_identifier, metric, start_date, end_date)
 
-            start_date = start_date if hasattr(start_date, 'date') else datetime.datetime.combine(start_date, datetime.time())
-            end_date = end_date if hasattr(end_date, 'date') else datetime.datetime.combine(end_date, datetime.time())
+        return reduce_count()
 
-            monthly_metrics_dates = list(rrule.rrule(rrule.MONTHLY, dtstart=start_date, bymonthday=1, until=end_date))
+    def _plan_count(self, conn, unique_identifier, metric, start_date=None, end_date=None):
+        """
+        Queues the commands needed to count the ``metric`` for ``unique_identifier`` on ``conn``.
+        Date ranges are covered with the fewest year, month, week and day buckets (see
+        ``_get_range_buckets``), which doesn't need any replies to be planned.
 
-            #We can sorta optimize this by getting most of the data by month
-            if len(monthly_metrics_dates) >= 3:
+        :return: A function that reduces the replies to the count once ``conn`` has been executed
+        """
+        if start_date and end_date:
+            start_date, end_date = (start_date, end_date,) if start_date < end_date else (end_date, start_date,)
+            start_date = start_date.date() if hasattr(start_date, 'date') else start_date
+            end_date = end_date.date() if hasattr(end_date, 'date') else end_date
 
-                with self._analytics_backend.map() as conn:
-                        monthly_metric_series, monthly_metric_results, starting_metric_series, starting_metric_results, ending_metric_series, ending_metric_results = self._get_counts(
-                            conn, metric, unique_identifier, monthly_metrics_dates, start_date, end_date)
+            #group the fields by the hash they live in, so each hash is read with a single HMGET
+            fields_by_key = defaultdict(list)
+            for granularity, bucket_date in self._get_range_buckets(start_date, end_date):
+                for key, field, period_end in self._get_bucket_fields(unique_identifier, metric, granularity, bucket_date):
+                    fields_by_key[key].append((field, period_end))
 
-                monthly_metric_series, monthly_metric_results = self._parse_and_process_metrics(monthly_metric_series, monthly_metric_results)
-                starting_metric_series, starting_metric_results = self._parse_and_process_metrics(starting_metric_series, starting_metric_results)
-                ending_metric_series, ending_metric_results = self._parse_and_process_metrics(ending_metric_series, ending_metric_results)
+            replies = []
+            for key, fields in fields_by_key.iteritems():
+                field_names = [field for field, period_end in fields]
+                closed_fields = self._get_closed_fields(field_names, (period_end for field, period_end in fields))
+                replies.append(self._hmget(conn, key, field_names, closed_fields))
 
-                result = sum(monthly_metric_results.values()) + sum(starting_metric_results.values()) + sum(ending_metric_results.values())
-            else:
-                diff = end_date - start_date
-                metric_results = self.get_metric_by_day(unique_identifier, metric, start_date, limit=diff.days + 1)
-                result = sum(metric_results[1].values())
+            return lambda: sum(int(value) for reply in replies for value in reply if value is not None)
 
-        else:
+        result = conn.get(self._get_count_key(unique_identifier, metric))
+
+        def reduce_count():
             try:
-                result = int(self._analytics_backend.get(self._prefix + ":" + "analy:%s:count:%s" % (unique_identifier, metric,)))
+                return int(result)
             except TypeError:
-                result = 0
+                return 0
 
-        return result
+        return reduce_count
 
     def get_counts(self, metric_identifiers, **kwargs):
         """
@@ -394,21 +1882,245 @@ class Redis(BaseAnalyticsBackend):
 
         :param metric_identifiers: a list of tuples of the form `(unique_identifier, metric_name`) identifying which metrics to retrieve.
         For example [('user:1', 'people_invited',), ('user:2', 'people_invited',), ('user:1', 'comments_posted',), ('user:2', 'comments_posted',)]
+        :param start_date: Only count the metrics after this date
+        :param end_date: Only count the metrics before this date
+
+        Every range is planned first and all the commands are sent in a single pipeline per redis host,
+        so the number of round trips doesn't depend on the number of ``metric_identifiers``.
         """
-        parsed_results = []
-        results = [
-            self.get_count(unique_identifier, metric, **kwargs) for
-            unique_identifier, metric in metric_identifiers]
+        start_date = kwargs.get("start_date")
+        end_date = kwargs.get("end_date")
 
-        for result in results:
-            try:
-                parsed_result = int(result)
-            except TypeError:
-                parsed_result = 0
+        with self._analytics_backend.map() as conn:
+            reducers = [
+                self._plan_count(conn, unique_identifier, metric, start_date, end_date) for
+                unique_identifier, metric in metric_identifiers]
 
-            parsed_results.append(parsed_result)
+        return [reduce_count() for reduce_count in reducers]
 
-        return parsed_results
+    def get_total_between(self, unique_identifier, metric, start_date, end_date, **kwargs):
+        """
+        Gets the total of the ``metric`` for ``unique_identifier`` from ``start_date`` to ``end_date``, both included.
+        The range is read with the fewest buckets possible, e.g. a year and a half starting mid-month is read as
+        a few days, a few weeks, some months and a year (if ``year_rollups`` is on).
+
+        :param unique_identifier: Unique string indetifying the object this metric is for
+        :param metric: A unique name for the metric you want to track
+        :param start_date: A python date object
+        :param end_date: A python date object
+        :return: The total for the metric, 0 otherwise
+        """
+        return self.get_count(unique_identifier, metric, start_date, end_date)
+
+    def track_unique(self, metric, member, date=None, **kwargs):
+        """
+        Adds ``member`` to the unique members of ``metric`` for the day, week and month of ``date``.
+        Unique members are counted with HyperLogLogs, so the memory used per day, week or month is
+        constant no matter how many members there are, and counts have an error of about 1%.
+
+        :param metric: A unique name for the metric you want to track. This can be a list or a string.
+        :param member: The member to count, e.g. a user id. This can be a list or a string.
+        :param date: A python date object indicating when this event occured. Defaults to today.
+        :return: A list with a result for each of the buckets updated
+        """
+        metric = [metric] if isinstance(metric, basestring) else metric
+        member = list(member) if isinstance(member, (types.ListType, types.TupleType, types.GeneratorType,)) else [member]
+        if date is None:
+            date = datetime.date.today()
+
+        results = []
+        keys = []
+        with self._analytics_backend.map() as conn:
+            for single_metric in metric:
+                for granularity, bucket_date in (("day", date), ("week", self._get_closest_week(date)), ("month", date)):
+                    keys.append(self._get_unique_key(single_metric, granularity, bucket_date))
+                    results.append(conn.pfadd(keys[-1], *member))
+            expiring = self._expire_new_keys(conn, keys)
+        self._mark_expiring(expiring)
+
+        return results
+
+    def _get_unique_series(self, metric, granularity, series):
+        """
+        Counts the unique members of ``metric`` for each ``granularity`` period in ``series``.
+        """
+        with self._analytics_backend.map() as conn:
+            results = [conn.pfcount(self._get_unique_key(metric, granularity, period)) for period in series]
+
+        return self._parse_and_process_metrics(series, [results])
+
+    def get_unique_by_day(self, metric, from_date, limit=30, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` segmented by day starting from ``from_date``
+
+        :param metric: A unique name for the metric
+        :param from_date: A python date object
+        :param limit: The total number of days to retrive starting from ``from_date``
+        """
+        series = [from_date + datetime.timedelta(days=i) for i in xrange(limit)]
+        return self._get_unique_series(metric, "day", series)
+
+    def get_unique_by_week(self, metric, from_date, limit=10, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` segmented by week starting from ``from_date``
+
+        :param metric: A unique name for the metric
+        :param from_date: A python date object
+        :param limit: The total number of weeks to retrive starting from ``from_date``
+        """
+        closest_monday_from_date = self._get_closest_week(from_date)
+        series = [closest_monday_from_date + datetime.timedelta(weeks=i) for i in xrange(limit)]
+        return self._get_unique_series(metric, "week", series)
+
+    def get_unique_by_month(self, metric, from_date, limit=10, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` segmented by month starting from the
+        1st of the month specified in ``from_date``
+
+        :param metric: A unique name for the metric
+        :param from_date: A python date object
+        :param limit: The total number of months to retrive starting from ``from_date``
+        """
+        first_of_month = datetime.date(year=from_date.year, month=from_date.month, day=1)
+        series = [first_of_month + relativedelta(months=i) for i in xrange(limit)]
+        return self._get_unique_series(metric, "month", series)
+
+    def get_unique_count(self, metric, start_date, end_date, **kwargs):
+        """
+        Returns the number of unique members of ``metric`` between ``start_date`` and ``end_date``
+        (inclusive). Whole months in the range are read from the monthly buckets and the remaining
+        days from the daily buckets, and all of them are merged on the redis side.
+
+        :param metric: A unique name for the metric
+        :param start_date: Count the unique members from this date
+        :param end_date: Count the unique members up to this date
+        """
+        keys = [
+            self._get_unique_key(metric, granularity, bucket_date)
+            for granularity, bucket_date in self._get_month_and_day_buckets(start_date, end_date)]
+
+        return self._count_unique(keys)
+
+    def _get_month_and_day_buckets(self, start_date, end_date):
+        """
+        Covers the range between ``start_date`` and ``end_date`` (inclusive) with ``month`` buckets
+        for the whole months in it and ``day`` buckets for the rest.
+
+        :return: A list of ``(granularity, date)`` tuples
+        """
+        start_date, end_date = (start_date, end_date,) if start_date <= end_date else (end_date, start_date,)
+        current_date = datetime.date(year=start_date.year, month=start_date.month, day=start_date.day)
+        end_date = datetime.date(year=end_date.year, month=end_date.month, day=end_date.day)
+
+        buckets = []
+        while current_date <= end_date:
+            next_month = datetime.date(year=current_date.year, month=current_date.month, day=1) + relativedelta(months=1)
+            if current_date.day == 1 and next_month - datetime.timedelta(days=1) <= end_date:
+                buckets.append(("month", current_date))
+                current_date = next_month
+            else:
+                buckets.append(("day", current_date))
+                current_date += datetime.timedelta(days=1)
+
+        return buckets
+
+    def _count_unique(self, keys):
+        """
+        Returns the number of unique members in the union of the HyperLogLogs stored in ``keys``.
+        Multi key commands only work on a single host, so the HyperLogLogs on other hosts are copied
+        over to the host holding most of them before counting.
+        """
+        keys_by_node = defaultdict(list)
+        for key in keys:
+            keys_by_node[self._analytics_backend.get_conn(key).num].append(key)
+
+        target_num = max(keys_by_node, key=lambda db_num: len(keys_by_node[db_num]))
+        temp_keys = []
+        pipe = self._analytics_backend[target_num].connection.pipeline(transaction=False)
+        for db_num, node_keys in keys_by_node.iteritems():
+            if db_num == target_num:
+                continue
+
+            node_pipe = self._analytics_backend[db_num].connection.pipeline(transaction=False)
+            for key in node_keys:
+                node_pipe.get(key)
+            for value in node_pipe.execute():
+                if value is not None:
+                    temp_key = self._prefix + ":" + "uniq:tmp:%s" % (uuid.uuid4().hex,)
+                    pipe.set(temp_key, value, ex=60)
+                    temp_keys.append(temp_key)
+
+        pipe.pfcount(*(keys_by_node[target_num] + temp_keys))
+        if temp_keys:
+            pipe.delete(*temp_keys)
+            return pipe.execute()[-2]
+        return pipe.execute()[-1]
+
+    def get_top(self, metric, period="week", date=None, k=10, **kwargs):
+        """
+        Returns the unique identifiers with the highest counts for ``metric`` during the day, week or
+        month of ``date``. The backend has to be configured with ``leaderboards`` for ``metric``.
+
+        :param metric: A unique name for the metric
+        :param period: One of ``day``, ``week`` or ``month``
+        :param date: A python date object in the period. Defaults to today.
+        :param k: The number of unique identifiers to return
+        :return: A list of ``(unique_identifier, count)`` tuples, highest count first
+        """
+        if period not in ("day", "week", "month"):
+            raise Exception("Allowed values for period are day, week or month.")
+        if date is None:
+            date = datetime.date.today()
+        if period == "week":
+            date = self._get_closest_week(date)
+
+        return self._get_top_from_keys([self._get_leaderboard_key(metric, period, date)], k)
+
+    def get_top_between(self, metric, start_date, end_date, k=10, **kwargs):
+        """
+        Returns the unique identifiers with the highest counts for ``metric`` between ``start_date``
+        and ``end_date`` (inclusive). The leaderboards of the whole months and remaining days in the
+        range are added up with ZUNIONSTORE.
+
+        :param metric: A unique name for the metric
+        :param start_date: Rank the unique identifiers from this date
+        :param end_date: Rank the unique identifiers up to this date
+        :param k: The number of unique identifiers to return
+        :return: A list of ``(unique_identifier, count)`` tuples, highest count first
+        """
+        keys = [
+            self._get_leaderboard_key(metric, granularity, bucket_date)
+            for granularity, bucket_date in self._get_month_and_day_buckets(start_date, end_date)]
+
+        return self._get_top_from_keys(keys, k)
+
+    def _get_top_from_keys(self, keys, k):
+        """
+        Returns the top ``k`` members of the union of the sorted sets stored in ``keys``. Multi key
+        commands only work on a single host, so if the sorted sets live on several hosts each host
+        adds up its own and the results are added up on the client.
+        """
+        keys_by_node = defaultdict(list)
+        for key in keys:
+            keys_by_node[self._analytics_backend.get_conn(key).num].append(key)
+
+        #only fetch the whole union when it has to be added up with the other hosts
+        end = k - 1 if len(keys_by_node) == 1 else -1
+        totals = defaultdict(int)
+        for db_num, node_keys in keys_by_node.iteritems():
+            pipe = self._analytics_backend[db_num].connection.pipeline(transaction=False)
+            if len(node_keys) == 1:
+                pipe.zrevrange(node_keys[0], 0, end, withscores=True)
+            else:
+                temp_key = self._prefix + ":" + "top:tmp:%s" % (uuid.uuid4().hex,)
+                pipe.zunionstore(temp_key, node_keys)
+                pipe.zrevrange(temp_key, 0, end, withscores=True)
+                pipe.delete(temp_key)
+
+            for member, score in pipe.execute()[0 if len(node_keys) == 1 else 1]:
+                totals[member] += int(score)
+
+        return sorted(totals.iteritems(), key=lambda item: (-item[1], item[0]))[:k]
 
     def set_metric_by_day(self, unique_identifier, metric, date, count, sync_agg=True, update_counter=True):
         """
@@ -422,32 +2134,128 @@ class Redis(BaseAnalyticsBackend):
         :param metric: A unique name for the metric you want to track
         :param date: Sets the specified metrics for this date
         :param count: Sets the sepcified metrics to value of count
-        :param sync_agg: Boolean used to determine if week and month metrics should be updated
+        :param sync_agg: Boolean used to determine if week and month metrics (and leaderboards) should be updated
         :param update_counter: Boolean used to determine if overall counter should be updated
+        :return: The amount each count changed by, see ``set_metrics_by_day``
         """
         metric = [metric] if isinstance(metric, basestring) else metric
         unique_identifier = [unique_identifier] if not isinstance(unique_identifier, (types.ListType, types.TupleType, types.GeneratorType,)) else unique_identifier
-        results = []
-        with self._analytics_backend.map() as conn:
-            for uid in unique_identifier:
-                hash_key_daily = self._get_daily_metric_key(uid, date)
+        return self.set_metrics_by_day(
+            ((uid, single_metric, date, count) for uid in unique_identifier for single_metric in metric),
+            sync_agg=sync_agg, update_counter=update_counter)
 
-                for single_metric in metric:
-                    daily_metric_name = self._get_daily_metric_name(single_metric, date)
+    def set_metrics_by_day(self, items, sync_agg=True, update_counter=True):
+        """
+        Sets the count of many ``(unique_identifier, metric, date, count)`` items at once. Each daily count is
+        replaced and the week, month (and year) buckets, the overall counter and the global rollups are moved
+        by the same amount, on the redis hosts with a lua script. All the keys of an item are updated in a
+        single atomic call if they live on the same host, which is always the case with ``hash_tags``.
+        Otherwise the day is set atomically and the change is applied to the other hosts right after.
+
+        :param items: An iterable of ``(unique_identifier, metric, date, count)`` tuples
+        :param sync_agg: Boolean used to determine if week and month metrics (and leaderboards) should be updated
+        :param update_counter: Boolean used to determine if overall counter should be updated
+        :return: A list with the amount each count changed by
+        """
+        #(key, field, count, propagations) for each item
+        entries = [
+            (self._get_daily_metric_key(uid, date), self._get_daily_metric_name(metric, date), int(count),
+                self._get_set_propagations(uid, metric, date, sync_agg, update_counter))
+            for uid, metric, date, count in items]
+
+        try:
+            deltas = self._set_with_script(entries)
+        except ResponseError, e:
+            if "unknown command" not in str(e).lower():
+                raise
+            #scripting isn't available on this server, read the old counts before setting them instead
+            deltas = self._set_with_pipelines(entries)
+
+        for key, field, count, propagations in entries:
+            self._invalidate_cache(key, field)
+            for command, propagation_key, propagation_field in propagations:
+                if command == "hincrby":
+                    self._invalidate_cache(propagation_key, propagation_field)
+
+        return deltas
+
+    def _set_with_script(self, entries):
+        """
+        Sets the ``(key, field, count, propagations)`` entries with the ``SET_AND_PROPAGATE`` script on the
+        host of each daily hash and returns the amount each count changed by.
+        """
+        get_node = lambda key: self._analytics_backend.get_conn(key).num
+
+        indexes_by_node = defaultdict(list)
+        remote_indexes = set()
+        for index, (key, field, count, propagations) in enumerate(entries):
+            node = get_node(key)
+            indexes_by_node[node].append(index)
+            if any(get_node(propagation_key) != node for command, propagation_key, propagation_field in propagations):
+                remote_indexes.add(index)
+
+        def set_chunk(client, chunk):
+            keys = []
+            args = []
+            for index in chunk:
+                key, field, count, propagations = entries[index]
+                #propagations to other hosts are applied once the change is known
+                propagations = [] if index in remote_indexes else propagations
+                keys.append(key)
+                keys.extend(propagation_key for command, propagation_key, propagation_field in propagations)
+                args.extend((field, count, len(propagations)))
+                for command, propagation_key, propagation_field in propagations:
+                    args.extend((command, propagation_field or ""))
+            return self._get_script("SET_AND_PROPAGATE")(keys=keys, args=args, client=client)
+
+        deltas = [None] * len(entries)
+        for chunk, chunk_deltas in self._map_nodes(set_chunk, indexes_by_node):
+            for index, delta in zip(chunk, chunk_deltas):
+                deltas[index] = delta
+
+        self._apply_increments(
+            (command, propagation_key, propagation_field, deltas[index])
+            for index in sorted(remote_indexes) if deltas[index]
+            for command, propagation_key, propagation_field in entries[index][3])
+
+        if self._retention:
+            with self._analytics_backend.map() as conn:
+                expiring = self._expire_new_keys(conn, itertools.chain.from_iterable(
+                    [key] + [propagation_key for command, propagation_key, propagation_field in propagations]
+                    for key, field, count, propagations in entries))
+            self._mark_expiring(expiring)
 
-                    if update_counter:  # updates overall counter for metric
-                        overall_count = self.get_count(uid, single_metric)
-                        day, daily_count = self.get_metric_by_day(uid, single_metric, date, 1)[1].popitem()
-                        self._analytics_backend.set(self._prefix + ":" + "analy:%s:count:%s" % (uid, single_metric), overall_count + (count - daily_count))
+        return deltas
 
-                    results.append([conn.hset(hash_key_daily, daily_metric_name, count)])
+    def _set_with_pipelines(self, entries):
+        """
+        Sets the ``(key, field, count, propagations)`` entries without scripting. The old counts are read
+        in one pipeline per host, so the changes aren't atomic.
+        """
+        with self._analytics_backend.map() as conn:
+            old_counts = [conn.hget(key, field) for key, field, count, propagations in entries]
 
-        if sync_agg:
-            self.sync_agg_metric(unique_identifier, metric, date, date)
+        deltas = []
+        for (key, field, count, propagations), old_count in itertools.izip(entries, old_counts):
+            try:
+                deltas.append(count - int(old_count))
+            except TypeError:
+                deltas.append(count)
 
-        return results
+        with self._analytics_backend.map() as conn:
+            for key, field, count, propagations in entries:
+                conn.hset(key, field, count)
+            expiring = self._expire_new_keys(conn, (key for key, field, count, propagations in entries))
+        self._mark_expiring(expiring)
+
+        self._apply_increments(
+            (command, propagation_key, propagation_field, delta)
+            for (key, field, count, propagations), delta in itertools.izip(entries, deltas) if delta
+            for command, propagation_key, propagation_field in propagations)
+
+        return deltas
 
-    def sync_agg_metric(self, unique_identifier, metric, start_date, end_date):
+    def sync_agg_metric(self, unique_identifier, metric, start_date, end_date, batch_size=100, workers=4):
         """
         Uses the count for each day in the date range to recalculate the counters for the associated weeks and months for
         the ``metric`` for ``unique_identifier``. Useful for updating the counters for week and month after using set_metric_by_day.
@@ -459,11 +2267,13 @@ class Redis(BaseAnalyticsBackend):
         :param metric: A unique name for the metric you want to track
         :param start_date: Date syncing starts
         :param end_date: Date syncing end
+        :param batch_size: The number of unique identifiers read and written in a single pipeline
+        :param workers: The number of batches synced in parallel
         """
-        self.sync_week_metric(unique_identifier, metric, start_date, end_date)
-        self.sync_month_metric(unique_identifier, metric, start_date, end_date)
+        granularities = ("week", "month", "year") if self._year_rollups else ("week", "month")
+        self._sync_rollups(unique_identifier, metric, start_date, end_date, granularities, batch_size, workers)
 
-    def sync_week_metric(self, unique_identifier, metric, start_date, end_date):
+    def sync_week_metric(self, unique_identifier, metric, start_date, end_date, batch_size=100, workers=4):
         """
         Uses the count for each day in the date range to recalculate the counters for the weeks for
         the ``metric`` for ``unique_identifier``. Useful for updating the counters for week and month
@@ -476,28 +2286,12 @@ class Redis(BaseAnalyticsBackend):
         :param metric: A unique name for the metric you want to track
         :param start_date: Date syncing starts
         :param end_date: Date syncing end
+        :param batch_size: The number of unique identifiers read and written in a single pipeline
+        :param workers: The number of batches synced in parallel
         """
-        metric = [metric] if isinstance(metric, basestring) else metric
-        unique_identifier = [unique_identifier] if not isinstance(unique_identifier, (types.ListType, types.TupleType, types.GeneratorType,)) else unique_identifier
-        closest_monday_from_date = self._get_closest_week(start_date)
-        num_weeks = self._num_weeks(start_date, end_date)
-        metric_key_date_range = self._get_weekly_date_range(closest_monday_from_date, datetime.timedelta(weeks=num_weeks))
-
-        week_date_generator = (closest_monday_from_date + datetime.timedelta(days=i) for i in itertools.count(step=7))
-        #generate a list of mondays in between the start date and the end date
-        weeks_to_update = list(itertools.islice(week_date_generator, num_weeks))
-        for uid in unique_identifier:
-            for single_metric in metric:
-                for week in weeks_to_update:
-                    _, series_results = self.get_metric_by_day(uid, single_metric, from_date=week, limit=7)
-                    week_counter = sum([value for key, value in series_results.items()])
-
-                    hash_key_weekly = self._get_weekly_metric_key(uid, week)
-                    weekly_metric_name = self._get_weekly_metric_name(single_metric, week)
-                    with self._analytics_backend.map() as conn:
-                        conn.hset(hash_key_weekly, weekly_metric_name, week_counter)
+        self._sync_rollups(unique_identifier, metric, start_date, end_date, ("week",), batch_size, workers)
 
-    def sync_month_metric(self, unique_identifier, metric, start_date, end_date):
+    def sync_month_metric(self, unique_identifier, metric, start_date, end_date, batch_size=100, workers=4):
         """
         Uses the count for each day in the date range to recalculate the counters for the months for
         the ``metric`` for ``unique_identifier``. Useful for updating the counters for week and month after using set_metric_by_day.
@@ -509,36 +2303,466 @@ class Redis(BaseAnalyticsBackend):
         :param metric: A unique name for the metric you want to track
         :param start_date: Date syncing starts
         :param end_date: Date syncing end
+        :param batch_size: The number of unique identifiers read and written in a single pipeline
+        :param workers: The number of batches synced in parallel
+        """
+        self._sync_rollups(unique_identifier, metric, start_date, end_date, ("month",), batch_size, workers)
+
+    def _sync_rollups(self, unique_identifier, metric, start_date, end_date, granularities, batch_size, workers):
+        """
+        Recalculates the ``week``, ``month`` and/or ``year`` counters in ``granularities`` that overlap the date range.
+        The unique identifiers are split in batches of ``batch_size``. For each batch, the daily counts
+        covering every period are read in a single pipeline, the sums are done here and written back in
+        a single pipeline. Up to ``workers`` batches are synced in parallel.
         """
         metric = [metric] if isinstance(metric, basestring) else metric
-        unique_identifier = [unique_identifier] if not isinstance(unique_identifier, (types.ListType, types.TupleType, types.GeneratorType,)) else unique_identifier
-        num_months = self._num_months(start_date, end_date)
-        first_of_month = datetime.date(year=start_date.year, month=start_date.month, day=1)
-        metric_key_date_range = self._get_weekly_date_range(
-            first_of_month, relativedelta(months=num_months))
+        unique_identifier = [unique_identifier] if not isinstance(unique_identifier, (types.ListType, types.TupleType, types.GeneratorType,)) else list(unique_identifier)
+        start_date = start_date.date() if hasattr(start_date, 'date') else start_date
+        end_date = end_date.date() if hasattr(end_date, 'date') else end_date
+
+        #the (granularity, first day, first day of the next period) of each period to update
+        periods = []
+        if "week" in granularities:
+            closest_monday_from_date = self._get_closest_week(start_date)
+            for i in xrange(self._num_weeks(start_date, end_date)):
+                week = closest_monday_from_date + datetime.timedelta(weeks=i)
+                periods.append(("week", week, week + datetime.timedelta(weeks=1)))
+        if "month" in granularities:
+            first_of_month = datetime.date(year=start_date.year, month=start_date.month, day=1)
+            for i in xrange(self._num_months(start_date, end_date)):
+                month = first_of_month + relativedelta(months=i)
+                periods.append(("month", month, month + relativedelta(months=1)))
+        if "year" in granularities:
+            for year in xrange(start_date.year, end_date.year + 1):
+                first_of_year = datetime.date(year=year, month=1, day=1)
+                periods.append(("year", first_of_year, first_of_year + relativedelta(years=1)))
+
+        if not periods:
+            return
+
+        span_start = min(period_start for granularity, period_start, period_end in periods)
+        span_days = (max(period_end for granularity, period_start, period_end in periods) - span_start).days
+
+        def sync_batch(uids):
+            with self._analytics_backend.map() as conn:
+                results = [
+                    (uid, single_metric, self.get_metric_by_day(uid, single_metric, span_start, limit=span_days, connection=conn))
+                    for uid in uids for single_metric in metric]
+
+            writes = []
+            for uid, single_metric, (series, list_of_metrics) in results:
+                _, daily_counts = self._parse_and_process_metrics(series, list_of_metrics)
+                for granularity, period_start, period_end in periods:
+                    #track_metric stores the days of a week that spans two years in the hash of their own year
+                    counts_by_year = defaultdict(int)
+                    for i in xrange((period_end - period_start).days):
+                        day = period_start + datetime.timedelta(days=i)
+                        counts_by_year[day.year] += daily_counts[day.isoformat()]
+
+                    if granularity == "week":
+                        field = self._get_weekly_metric_name(single_metric, period_start)
+                        for year, count in counts_by_year.iteritems():
+                            writes.append((self._get_weekly_metric_key(uid, datetime.date(year=year, month=1, day=1)), field, count))
+                    elif granularity == "month":
+                        field = self._get_monthly_metric_name(single_metric, period_start)
+                        writes.append((self._get_weekly_metric_key(uid, period_start), field, counts_by_year[period_start.year]))
+                    else:
+                        field = self._get_yearly_metric_name(single_metric, period_start)
+                        writes.append((self._get_weekly_metric_key(uid, period_start), field, counts_by_year[period_start.year]))
 
-        month_date_generator = (first_of_month + relativedelta(months=i) for i in itertools.count())
-        #generate a list of first_of_month's in between the start date and the end date
-        months_to_update = list(itertools.islice(month_date_generator, num_months))
-        for uid in unique_identifier:
-            for single_metric in metric:
-                for month in months_to_update:
-                    _, series_results = self.get_metric_by_day(uid, single_metric, from_date=month, limit=monthrange(month.year, month.month)[1])
-                    month_counter = sum([value for key, value in series_results.items()])
+            with self._analytics_backend.map() as conn:
+                for key, field, count in writes:
+                    conn.hset(key, field, count)
+                    self._invalidate_cache(key, field)
+                expiring = self._expire_new_keys(conn, set(key for key, field, count in writes))
+            self._mark_expiring(expiring)
+
+        batches = [unique_identifier[i:i + batch_size] for i in xrange(0, len(unique_identifier), batch_size)]
+        if workers > 1 and len(batches) > 1:
+            pool = ThreadPool(min(workers, len(batches)))
+            try:
+                pool.map(sync_batch, batches)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for batch in batches:
+                sync_batch(batch)
 
-                    hash_key_monthly = self._get_weekly_metric_key(uid, month)
-                    monthly_metric_name = self._get_monthly_metric_name(single_metric, month)
+    def sync_year_metric(self, unique_identifier, metric, start_date, end_date, batch_size=100, workers=4):
+        """
+        Uses the count for each day in the date range to recalculate the yearly totals for
+        the ``metric`` for ``unique_identifier``. Only used with ``year_rollups``.
+
+        :param unique_identifier: Unique string indetifying the object this metric is for
+        :param metric: A unique name for the metric you want to track
+        :param start_date: Date syncing starts
+        :param end_date: Date syncing end
+        :param batch_size: The number of unique identifiers read and written in a single pipeline
+        :param workers: The number of batches synced in parallel
+        """
+        self._sync_rollups(unique_identifier, metric, start_date, end_date, ("year",), batch_size, workers)
+
+    def verify_rollups(self, repair=False, counters=False, batch_size=100, workers=4, max_rate=None):
+        """
+        Recalculates the weekly, monthly (and yearly) metrics of every unique identifier from its daily
+        metrics and reports the ones that don't match, e.g. because a pipeline was cut short or days
+        were set with ``sync_agg=False``. The keys are streamed with ``SCAN`` on each host and checked a
+        year of a unique identifier at a time, so it is safe to run against a live cluster.
+
+        A mismatch is only reported once a second read finds the same values, so writes made while
+        checking aren't mistaken for mismatches.
+
+        With a ``day`` retention, the periods that started before the oldest day still kept and the
+        overall counters are not checked.
+
+        :param repair: Move the mismatched values to the ones recalculated from the daily metrics
+        :param counters: Check (and repair) the overall counters too. ``track_count`` only moves the counters,
+            so don't turn this on for metrics tracked with it. The years each unique identifier has daily
+            metrics for are held in memory until the counters are checked, after everything else.
+        :param batch_size: The number of keys scanned at a time on each host, and of years of a unique
+            identifier read and written in a single pipeline
+        :param workers: The number of batches checked in parallel
+        :param max_rate: The maximum number of redis commands sent per second, across all the workers
+        :return: A dictionary holding the number of ``years`` of a unique identifier and values ``checked``,
+            the ``(key, field, expected, actual)`` ``mismatches`` (``field`` is ``None`` for counters), the
+            number of values ``repaired`` and the number of mismatches ``skipped`` because the values
+            changed between the two reads
+        """
+        rate_limiter = RateLimiter(max_rate)
+
+        metric_names = {}
+        if self._compact_keys:
+            metric_names = self._analytics_backend.hgetall(self._prefix + ":metric_names")
+            self._metric_ids.update((metric, metric_id) for metric_id, metric in metric_names.iteritems())
+
+        #daily hashes expire a month at a time, so every day from the start of this month on is still there
+        cutoff = None
+        if "day" in self._retention:
+            cutoff = datetime.date.today() - datetime.timedelta(days=self._retention["day"])
+            cutoff = datetime.date(year=cutoff.year, month=cutoff.month, day=1)
+        counters = counters and cutoff is None
+
+        #unique identifier: the years it has daily metrics for, only kept to check the counters
+        years_by_uid = defaultdict(set)
+
+        #yields the (unique identifier, year) of every yearly hash, and of the daily hashes without one
+        def scan_years():
+            daily_years = set()
+            for db_num in self._analytics_backend:
+                client = self._analytics_backend[db_num].connection
+                cursor = 0
+                while True:
+                    rate_limiter.wait()
+                    cursor, keys = client.scan(cursor, match=self._prefix + ":*", count=batch_size)
+
+                    parsed_keys = [parsed_key for parsed_key in (self._parse_key(key) for key in keys) if parsed_key is not None]
+                    daily = set((uid, period_start.year) for kind, uid, period_start in parsed_keys if kind == "day")
+                    if counters:
+                        for uid, year in daily:
+                            years_by_uid[uid].add(year)
+                    for kind, uid, period_start in parsed_keys:
+                        if kind == "year":
+                            yield uid, period_start.year
+
+                    #a year is checked from its yearly hash if there is one
+                    daily = sorted(daily - daily_years)
+                    rate_limiter.wait(len(daily))
                     with self._analytics_backend.map() as conn:
-                        conn.hset(hash_key_monthly, monthly_metric_name, month_counter)
+                        exists = [conn.exists(self._get_weekly_metric_key(uid, datetime.date(year=year, month=1, day=1))) for uid, year in daily]
+                    for (uid, year), yearly_exists in zip(daily, exists):
+                        if not yearly_exists:
+                            daily_years.add((uid, year))
+                            yield uid, year
+
+                    if not int(cursor):
+                        break
+
+        def get_daily_keys(uid, years):
+            return [
+                self._get_daily_metric_key(uid, datetime.date(year=year, month=month, day=1))
+                for year in sorted(years) for month in xrange(1, 13)]
+
+        #adds the values expected from the daily hashes, and the rollups or counters they cover, to ``expected``
+        def add_expected(expected, uid, daily_values, check_counters):
+            for values in daily_values:
+                for field, value in values.iteritems():
+                    parsed_field = self._parse_field("day", field)
+                    if parsed_field is None:
+                        continue
+
+                    granularity, metric, date = parsed_field
+                    if self._compact_keys:
+                        metric = metric_names.get(metric)
+                        if metric is None:
+                            continue
+
+                    bucket_increments = self._get_bucket_increments(uid, metric, date, int(value))
+                    if check_counters:
+                        command, key, bucket_field, amount = bucket_increments[-1]
+                        expected[(key, None)] += amount
+                        continue
+
+                    period_starts = [self._get_closest_week(date), datetime.date(year=date.year, month=date.month, day=1)]
+                    if self._year_rollups:
+                        period_starts.append(datetime.date(year=date.year, month=1, day=1))
+                    for (command, key, bucket_field, amount), period_start in zip(bucket_increments[1:-1], period_starts):
+                        if cutoff is None or period_start >= cutoff:
+                            expected[(key, bucket_field)] += amount
+
+        #both return the number of values checked and the (expected, actual) values of the mismatched (key, field)s
+        def check_years(units):
+            rate_limiter.wait(13 * len(units))
+            with self._analytics_backend.map() as conn:
+                replies = [
+                    (conn.hgetall(self._get_weekly_metric_key(uid, datetime.date(year=year, month=1, day=1))),
+                     [conn.hgetall(key) for key in get_daily_keys(uid, [year])])
+                    for uid, year in units]
+
+            expected = defaultdict(int)
+            actuals = {}
+            for (uid, year), (yearly_values, daily_values) in zip(units, replies):
+                add_expected(expected, uid, daily_values, False)
+                yearly_key = self._get_weekly_metric_key(uid, datetime.date(year=year, month=1, day=1))
+                for field, value in yearly_values.iteritems():
+                    actuals[(yearly_key, field)] = value
+                    #rollups without any daily metrics behind them should be 0
+                    parsed_field = self._parse_field("year", field)
+                    if parsed_field is None or (parsed_field[0] == "year" and not self._year_rollups):
+                        continue
+                    if cutoff is None or parsed_field[2] >= cutoff:
+                        expected[(yearly_key, field)] += 0
+            return len(expected), get_mismatches(expected, actuals)
+
+        def check_counters(uids):
+            rate_limiter.wait(sum(12 * len(years_by_uid[uid]) for uid in uids))
+            with self._analytics_backend.map() as conn:
+                replies = [(uid, [conn.hgetall(key) for key in get_daily_keys(uid, years_by_uid[uid])]) for uid in uids]
+
+            expected = defaultdict(int)
+            for uid, daily_values in replies:
+                add_expected(expected, uid, daily_values, True)
+
+            counter_keys = sorted(key for key, field in expected)
+            rate_limiter.wait(len(counter_keys))
+            with self._analytics_backend.map() as conn:
+                actuals = dict(((key, None), conn.get(key)) for key in counter_keys)
+            return len(expected), get_mismatches(expected, actuals)
+
+        def get_mismatches(expected, actuals):
+            mismatches = {}
+            for key_field, value in expected.iteritems():
+                actual = int(actuals.get(key_field) or 0)
+                if actual != value:
+                    mismatches[key_field] = (value, actual)
+            return mismatches
+
+        def verify_batch(check, units):
+            checked, mismatches = check(units)
+            if not mismatches:
+                return checked, [], 0
+
+            #read the units with mismatches again, values that changed in between were being written to
+            units = set()
+            for key, field in mismatches:
+                kind, uid, value = self._parse_key(key)
+                units.add((uid, value.year) if kind == "year" else uid)
+            confirmed = check(sorted(units))[1]
+            skipped = len(mismatches)
+            mismatches = sorted(
+                (key, field, value, actual) for (key, field), (value, actual) in mismatches.iteritems()
+                if confirmed.get((key, field)) == (value, actual))
+            skipped -= len(mismatches)
+
+            if repair and mismatches:
+                rate_limiter.wait(len(mismatches))
+                #move by the difference, so increments made since the values were read aren't lost
+                with self._analytics_backend.map() as conn:
+                    for key, field, value, actual in mismatches:
+                        if field is None:
+                            conn.incr(key, value - actual)
+                        else:
+                            conn.hincrby(key, field, value - actual)
+                            self._invalidate_cache(key, field)
+                    expiring = self._expire_new_keys(conn, set(key for key, field, value, actual in mismatches))
+                self._mark_expiring(expiring)
+
+            return checked, mismatches, skipped
+
+        #checks ``workers`` batches of units at a time, so only that many are held in memory
+        def verify_all(check, units):
+            pool = ThreadPool(workers) if workers > 1 else None
+            results = []
+            try:
+                while True:
+                    batches = []
+                    for i in xrange(max(workers, 1)):
+                        batch = list(itertools.islice(units, batch_size))
+                        if batch:
+                            batches.append(batch)
+                    if not batches:
+                        return results
+                    if pool is not None and len(batches) > 1:
+                        results.extend(pool.map(lambda batch: verify_batch(check, batch), batches))
+                    else:
+                        results.extend(verify_batch(check, batch) for batch in batches)
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+
+        num_years = [0]
+        def count_years(units):
+            for unit in units:
+                num_years[0] += 1
+                yield unit
+
+        results = verify_all(check_years, count_years(scan_years()))
+        if counters:
+            results.extend(verify_all(check_counters, iter(sorted(years_by_uid))))
+
+        mismatches = list(itertools.chain(*[batch_mismatches for checked, batch_mismatches, skipped in results]))
+        return {
+            "years": num_years[0],
+            "checked": sum(checked for checked, batch_mismatches, skipped in results),
+            "mismatches": mismatches,
+            "repaired": len(mismatches) if repair else 0,
+            "skipped": sum(skipped for checked, batch_mismatches, skipped in results),
+        }
+
+
+class AsyncRedis(BaseAnalyticsBackend):
+    """
+    A variant of the ``Redis`` backend that doesn't block the caller. Every call is run by a pool
+    of worker threads and immediately returns an ``AsyncResult``; use ``get()`` on it to wait for
+    the value the ``Redis`` backend would have returned.
+
+    It takes the same settings as ``Redis`` plus ``workers``, the number of threads in the pool,
+    and uses the same keys so both backends can share data. Redis connections are pooled per host
+    and each ``map()`` fans out to the hosts concurrently.
+    """
+    def __init__(self, settings, **kwargs):
+        self._redis = Redis(settings, **kwargs)
+        self._analytics_backend = self._redis.get_backend()
+        self._pool = ThreadPool(settings.get("workers", 4))
+        super(AsyncRedis, self).__init__(settings, **kwargs)
+
+    def _apply_async(self, name, args, kwargs):
+        return self._pool.apply_async(getattr(self._redis, name), args, kwargs)
+
+    def track_count(self, *args, **kwargs):
+        return self._apply_async("track_count", args, kwargs)
+
+    def track_metric(self, *args, **kwargs):
+        return self._apply_async("track_metric", args, kwargs)
+
+    def track_events(self, *args, **kwargs):
+        return self._apply_async("track_events", args, kwargs)
+
+    def bulk_load(self, *args, **kwargs):
+        return self._apply_async("bulk_load", args, kwargs)
+
+    def get_metric_by_day(self, *args, **kwargs):
+        return self._apply_async("get_metric_by_day", args, kwargs)
+
+    def get_metric_by_week(self, *args, **kwargs):
+        return self._apply_async("get_metric_by_week", args, kwargs)
+
+    def get_metric_by_month(self, *args, **kwargs):
+        return self._apply_async("get_metric_by_month", args, kwargs)
+
+    def iter_metric(self, *args, **kwargs):
+        """
+        Same as ``Redis.iter_metric``. The series is already fetched lazily, so this returns the
+        generator rather than an ``AsyncResult``.
+        """
+        return self._redis.iter_metric(*args, **kwargs)
+
+    def list_metrics(self, *args, **kwargs):
+        return self._apply_async("list_metrics", args, kwargs)
+
+    def list_uids(self, *args, **kwargs):
+        return self._apply_async("list_uids", args, kwargs)
+
+    def get_all_metrics(self, *args, **kwargs):
+        return self._apply_async("get_all_metrics", args, kwargs)
+
+    def get_metrics(self, *args, **kwargs):
+        return self._apply_async("get_metrics", args, kwargs)
+
+    def aggregate_metrics(self, *args, **kwargs):
+        return self._apply_async("aggregate_metrics", args, kwargs)
+
+    def get_count(self, *args, **kwargs):
+        return self._apply_async("get_count", args, kwargs)
+
+    def get_counts(self, *args, **kwargs):
+        return self._apply_async("get_counts", args, kwargs)
+
+    def get_total_between(self, *args, **kwargs):
+        return self._apply_async("get_total_between", args, kwargs)
+
+    def track_unique(self, *args, **kwargs):
+        return self._apply_async("track_unique", args, kwargs)
+
+    def get_unique_by_day(self, *args, **kwargs):
+        return self._apply_async("get_unique_by_day", args, kwargs)
+
+    def get_unique_by_week(self, *args, **kwargs):
+        return self._apply_async("get_unique_by_week", args, kwargs)
+
+    def get_unique_by_month(self, *args, **kwargs):
+        return self._apply_async("get_unique_by_month", args, kwargs)
 
-    def _get_counts(self, conn, metric, unique_identifier, monthly_metrics_dates, start_date, end_date):
-        start_diff = monthly_metrics_dates[0] - start_date
-        end_diff = end_date - monthly_metrics_dates[-1]
+    def get_unique_count(self, *args, **kwargs):
+        return self._apply_async("get_unique_count", args, kwargs)
 
-        monthly_metric_series, monthly_metric_results = self.get_metric_by_month(unique_identifier, metric, monthly_metrics_dates[0], limit=len(monthly_metrics_dates) - 1, connection=conn)
+    def get_top(self, *args, **kwargs):
+        return self._apply_async("get_top", args, kwargs)
 
-        #get the difference from the date to the start date and get all dates in between
-        starting_metric_series, starting_metric_results = self.get_metric_by_day(unique_identifier, metric, start_date, limit=start_diff.days, connection=conn) if start_diff.days > 0 else ([], [[]],)
-        ending_metric_series, ending_metric_results = self.get_metric_by_day(unique_identifier, metric, monthly_metrics_dates[-1], limit=end_diff.days + 1, connection=conn)
+    def get_top_between(self, *args, **kwargs):
+        return self._apply_async("get_top_between", args, kwargs)
 
-        return monthly_metric_series, monthly_metric_results, starting_metric_series, starting_metric_results, ending_metric_series, ending_metric_results
+    def set_metric_by_day(self, *args, **kwargs):
+        return self._apply_async("set_metric_by_day", args, kwargs)
+
+    def set_metrics_by_day(self, *args, **kwargs):
+        return self._apply_async("set_metrics_by_day", args, kwargs)
+
+    def sync_agg_metric(self, *args, **kwargs):
+        return self._apply_async("sync_agg_metric", args, kwargs)
+
+    def sync_week_metric(self, *args, **kwargs):
+        return self._apply_async("sync_week_metric", args, kwargs)
+
+    def sync_month_metric(self, *args, **kwargs):
+        return self._apply_async("sync_month_metric", args, kwargs)
+
+    def sync_year_metric(self, *args, **kwargs):
+        return self._apply_async("sync_year_metric", args, kwargs)
+
+    def verify_rollups(self, *args, **kwargs):
+        return self._apply_async("verify_rollups", args, kwargs)
+
+    def clear_all(self, *args, **kwargs):
+        return self._apply_async("clear_all", args, kwargs)
+
+    def clear_unique_identifier(self, *args, **kwargs):
+        return self._apply_async("clear_unique_identifier", args, kwargs)
+
+    def clear_metric(self, *args, **kwargs):
+        return self._apply_async("clear_metric", args, kwargs)
+
+    def clear_before(self, *args, **kwargs):
+        return self._apply_async("clear_before", args, kwargs)
+
+    def flush(self):
+        return self._apply_async("flush", (), {})
+
+    def close(self):
+        """
+        Waits for every pending call to finish, then closes the underlying ``Redis`` backend.
+        """
+        self._pool.close()
+        self._pool.join()
+        self._redis.close()
@@ -0,0 +1,111 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+
+#Applies a batch of increments in a single call. KEYS holds the key for each increment and
+#ARGV holds a (command, field, amount) triple for each key. The command is one of incrby,
+#hincrby, zincrby or sadd, where the field is the member for sorted sets and sets. The field
+#is empty for incrby and the amount is ignored for sadd.
+TRACK_INCREMENTS = """
+local results = {}
+for i, key in ipairs(KEYS) do
+    local command = ARGV[i * 3 - 2]
+    local field = ARGV[i * 3 - 1]
+    local amount = ARGV[i * 3]
+    if command == 'incrby' then
+        results[i] = redis.call('INCRBY', key, amount)
+    elseif command == 'hincrby' then
+        results[i] = redis.call('HINCRBY', key, field, amount)
+    elseif command == 'sadd' then
+        results[i] = redis.call('SADD', key, field)
+    else
+        results[i] = tonumber(redis.call('ZINCRBY', key, amount, field))
+    end
+end
+return results
+"""
+
+#Sums hash fields from many hashes into a single series. ARGV starts with the length of the series,
+#followed by, for each key in KEYS, the number of fields to read from it and a (position, field)
+#pair for each of those fields. Positions start at 1.
+AGGREGATE_FIELDS = """
+local totals = {}
+for i = 1, tonumber(ARGV[1]) do
+    totals[i] = 0
+end
+
+local arg = 2
+for _, key in ipairs(KEYS) do
+    local count = tonumber(ARGV[arg])
+    local positions = {}
+    local fields = {}
+    for j = 1, count do
+        positions[j] = tonumber(ARGV[arg + j * 2 - 1])
+        fields[j] = ARGV[arg + j * 2]
+    end
+    arg = arg + count * 2 + 1
+
+    if count > 0 then
+        local values = redis.call('HMGET', key, unpack(fields))
+        for j = 1, count do
+            if values[j] then
+                totals[positions[j]] = totals[positions[j]] + tonumber(values[j])
+            end
+        end
+    end
+end
+return totals
+"""
+
+#Sets hash fields and moves other counters by the same amount as each field changed. For each item,
+#KEYS holds the hash to set followed by the key of each of its propagations and ARGV holds the field,
+#the new value, the number of propagations and a (command, field) pair for each propagation, where
+#the command is one of incrby, hincrby or zincrby. Returns the change of each item.
+SET_AND_PROPAGATE = """
+local deltas = {}
+local k = 1
+local a = 1
+while a <= #ARGV do
+    local key = KEYS[k]
+    local field = ARGV[a]
+    local value = tonumber(ARGV[a + 1])
+    local count = tonumber(ARGV[a + 2])
+
+    local delta = value - (tonumber(redis.call('HGET', key, field)) or 0)
+    redis.call('HSET', key, field, value)
+
+    if delta ~= 0 then
+        for j = 1, count do
+            local command = ARGV[a + 1 + j * 2]
+            local propagation_field = ARGV[a + 2 + j * 2]
+            local propagation_key = KEYS[k + j]
+            if command == 'incrby' then
+                redis.call('INCRBY', propagation_key, delta)
+            elseif command == 'hincrby' then
+                redis.call('HINCRBY', propagation_key, propagation_field, delta)
+            else
+                redis.call('ZINCRBY', propagation_key, delta, propagation_field)
+            end
+        end
+    end
+
+    deltas[#deltas + 1] = delta
+    k = k + 1 + count
+    a = a + 3 + count * 2
+end
+return deltas
+"""
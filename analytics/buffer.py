@@ -0,0 +1,93 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from collections import defaultdict
+
+import threading
+import time
+
+
+class FlushError(Exception):
+    """
+    Raised by a ``flush_func`` when only some of the increments were written. ``pending`` holds
+    the ones that weren't, so only those are put back in the buffer.
+    """
+    def __init__(self, pending, message=None):
+        super(FlushError, self).__init__(message or "%s increments couldn't be written" % len(pending))
+        self.pending = pending
+
+
+class IncrementBuffer(object):
+    """
+    Sums increments in-process and hands them over to ``flush_func`` as a single batch.
+
+    A flush happens once ``max_size`` distinct entries are pending or ``max_age`` seconds
+    have passed since the last flush. The time threshold is checked whenever something is
+    added to the buffer, so call ``flush`` explicitly before shutting down.
+    """
+    def __init__(self, flush_func, max_size=1000, max_age=1.0):
+        self._flush_func = flush_func
+        self._max_size = max_size
+        self._max_age = max_age
+        self._pending = defaultdict(int)
+        self._lock = threading.RLock()
+        self._last_flush = time.time()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, key, amount=1):
+        """
+        Adds ``amount`` to the pending total for ``key``, flushing if a threshold was reached.
+
+        :param key: Any hashable identifying what is being incremented
+        :param amount: The amount to increment ``key`` by
+        """
+        with self._lock:
+            self._pending[key] += amount
+            should_flush = len(self._pending) >= self._max_size or \
+                time.time() - self._last_flush >= self._max_age
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands every pending increment to ``flush_func``. If ``flush_func`` raises a ``FlushError``,
+        the increments it didn't write are put back in the buffer so they can be retried on the next
+        flush. Any other exception puts back all of them, so a ``flush_func`` that can fail after
+        writing some of them should raise ``FlushError`` to avoid counting those twice.
+
+        :return: The number of distinct entries that were flushed
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            self._last_flush = time.time()
+
+        if not pending:
+            return 0
+
+        try:
+            self._flush_func(pending)
+        except Exception, e:
+            failed = e.pending if isinstance(e, FlushError) else pending
+            with self._lock:
+                for key, amount in failed.iteritems():
+                    self._pending[key] += amount
+            raise
+
+        return len(pending)
@@ -0,0 +1,84 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+Command line tool that loads historical daily counts from CSV files with
+``unique_identifier,metric,date,count`` rows, where ``date`` is formatted as ``YYYY-MM-DD``::
+
+    analytics-bulk-load --settings settings.json counts-2011.csv counts-2012.csv
+
+The settings file holds the JSON dictionary passed to ``create_analytic_backend``. Without it,
+the ``Redis`` backend is used with a redis server on localhost.
+"""
+from analytics import create_analytic_backend
+
+import argparse
+import csv
+import datetime
+import json
+import sys
+
+DEFAULT_SETTINGS = {
+    "backend": "analytics.backends.redis.Redis",
+    "settings": {
+        "hosts": [{}],
+    },
+}
+
+
+def read_rows(files, skip_header=False):
+    """
+    Yields the ``(unique_identifier, metric, date, count)`` rows of CSV ``files``. Blank lines are skipped.
+    """
+    for csv_file in files:
+        reader = csv.reader(csv_file)
+        if skip_header:
+            next(reader, None)
+
+        for line_num, row in enumerate(reader, 2 if skip_header else 1):
+            if not row:
+                continue
+            try:
+                unique_identifier, metric, date, count = row
+                yield unique_identifier, metric, datetime.datetime.strptime(date, "%Y-%m-%d").date(), int(count)
+            except ValueError:
+                raise ValueError("Invalid row on line %s of %s: %s" % (line_num, getattr(csv_file, "name", "input"), ",".join(row)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Loads historical daily counts into an analytics backend.")
+    parser.add_argument("files", nargs="*", type=argparse.FileType("rb"), help="CSV files to load, standard input if none are given")
+    parser.add_argument("--settings", type=argparse.FileType("r"), help="JSON file with the settings for create_analytic_backend")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="number of unique identifiers written at a time")
+    parser.add_argument("--sorted", action="store_true", help="the rows of each unique identifier are next to each other")
+    parser.add_argument("--skip-header", action="store_true", help="the first line of each file is a header")
+    args = parser.parse_args(argv)
+
+    settings = json.load(args.settings) if args.settings else DEFAULT_SETTINGS
+    backend = create_analytic_backend(settings)
+    try:
+        summary = backend.bulk_load(
+            read_rows(args.files or [sys.stdin], skip_header=args.skip_header),
+            chunk_size=args.chunk_size, sorted_by_uid=args.sorted)
+    finally:
+        backend.close()
+
+    print "Loaded %(events)d rows with %(writes)d writes in %(seconds).2fs (%(events_per_second).0f rows per second)" % summary
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
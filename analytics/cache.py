@@ -0,0 +1,74 @@
+"""
+Copyright 2012 Numan Sachwani <numan@7Geese.com>
+
+This file is provided to you under the Apache License,
+Version 2.0 (the "License"); you may not use this file
+except in compliance with the License.  You may obtain
+a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+"""
+from collections import OrderedDict
+
+import threading
+
+
+class LRUCache(object):
+    """
+    A thread safe in-process cache holding at most ``max_size`` entries. Once it is full,
+    the least recently used entry is evicted to make room for a new one.
+
+    Any object with the same ``get``, ``set``, ``delete`` and ``clear`` methods can be used
+    as the read-through cache of a backend instead.
+    """
+    def __init__(self, max_size=10000):
+        self._max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Returns the value cached for ``key``, or ``default`` if it isn't cached.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            #re-insert it so it becomes the most recently used entry
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Caches ``value`` for ``key``, evicting the least recently used entry if the cache is full.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """
+        Removes ``key`` from the cache if it is there.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Removes everything from the cache.
+        """
+        with self._lock:
+            self._data.clear()
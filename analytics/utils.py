@@ -15,6 +15,8 @@ KIND, either express or implied.  See the License for the
 specific language governing permissions and limitations
 under the License.
 """
+import threading
+import time
 
 
 # import_string comes form Werkzeug
@@ -42,3 +44,29 @@ def import_string(import_name, silent=False):
     except (ImportError, AttributeError):
         if not silent:
             raise
+
+
+class RateLimiter(object):
+    """
+    Spaces out operations so no more than ``rate`` of them are done per second on average,
+    across all the threads sharing the limiter. A ``rate`` of ``None`` doesn't limit anything.
+    """
+    def __init__(self, rate=None):
+        self._rate = rate
+        self._lock = threading.Lock()
+        self._next_time = time.time()
+
+    def wait(self, num_operations=1):
+        """
+        Blocks until ``num_operations`` more operations can be done.
+        """
+        if not self._rate:
+            return
+
+        with self._lock:
+            now = time.time()
+            start_time = max(now, self._next_time)
+            self._next_time = start_time + float(num_operations) / self._rate
+
+        if start_time > now:
+            time.sleep(start_time - now)
@@ -0,0 +1,77 @@
+"""
+Times how long the redis backend takes to assemble query results from the raw HMGET replies,
+next to the implementation it replaced. Doesn't need a running redis server. From the root of
+the repository:
+
+    PYTHONPATH=. python benchmarks/parse_and_process_metrics.py
+"""
+from analytics import create_analytic_backend
+
+import datetime
+import random
+import timeit
+
+
+def get_replies(num_hashes, num_fields):
+    return [
+        [str(random.randint(1, 100)) if random.random() < 0.3 else None for i in xrange(num_fields)]
+        for j in xrange(num_hashes)]
+
+
+def old_parse_and_process_metrics(series, list_of_metrics):
+    """
+    The implementation ``Redis._parse_and_process_metrics`` had before it summed the replies position-wise.
+    """
+    formatted_result_list = []
+    series = [dt.strftime("%Y-%m-%d") for dt in series]
+    for result in list_of_metrics:
+        values = {}
+        for index, date_string in enumerate(series):
+            values[date_string] = int(result[index]) if result[index] is not None else 0
+        formatted_result_list.append(values)
+
+    merged_values = reduce(
+        lambda a, b: dict((n, a.get(n, 0) + b.get(n, 0)) for n in set(a) | set(b)),
+        formatted_result_list)
+
+    return set(series), merged_values
+
+
+def compare(name, batch, number, new_func):
+    """
+    Prints how long the old and new implementations take to process the ``(series, replies)`` in ``batch``.
+    """
+    assert [old_parse_and_process_metrics(s, r) for s, r in batch] == [new_func(s, r) for s, r in batch]
+    timings = []
+    for func in (old_parse_and_process_metrics, new_func):
+        timer = timeit.Timer(lambda: [func(s, r) for s, r in batch])
+        timings.append(min(timer.repeat(3, number)) / number * 1000)
+    print "%-28s %8.2fms -> %6.2fms (%.1fx)" % (name, timings[0], timings[1], timings[0] / timings[1])
+
+
+def main():
+    backend = create_analytic_backend({
+        "backend": "analytics.backends.redis.Redis",
+        "settings": {
+            "hosts": [{"db": 0}]
+        },
+    })
+    from_date = datetime.date(year=2012, month=1, day=1)
+
+    print "%-28s %10s    %8s" % ("", "old", "new")
+
+    #a year of daily metrics touches 13 monthly hashes
+    series = [from_date + datetime.timedelta(days=i) for i in xrange(365)]
+    compare("365 day range, 13 hashes:", [(series, get_replies(13, len(series)))], 20, backend._parse_and_process_metrics)
+
+    series = [from_date + datetime.timedelta(days=i) for i in xrange(365 * 3)]
+    compare("3 year range, 37 hashes:", [(series, get_replies(37, len(series)))], 5, backend._parse_and_process_metrics)
+
+    #get_metrics with 1000 identifiers of 10 weeks each
+    series = [from_date + datetime.timedelta(weeks=i) for i in xrange(10)]
+    batch = [(series, get_replies(2, len(series))) for i in xrange(1000)]
+    compare("1000 identifiers, 10 weeks:", batch, 5, backend._parse_and_process_metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,9 +15,17 @@ setup(
     test_suite='nose.collector',
     install_requires=[
         'nydus>=0.10.6',
-        'redis>=2.7.2',
+        'redis>=2.10.0',
         'python-dateutil==1.5',
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
+    entry_points={
+        'console_scripts': [
+            'analytics-bulk-load = analytics.bulk_load:main',
+        ],
+    },
     tests_require=[
         'nose>=1.0',
     ],
@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_, raises
+
+from analytics import create_analytic_backend
+from analytics.backends.dummy import Dummy
+
+import datetime
+import threading
+import time
+
+
+class BlockingBackend(Dummy):
+    """
+    Holds on to the first batch it is asked to write until ``release`` is set.
+    """
+    release = None
+    written = None
+
+    def track_events(self, events, **kwargs):
+        self.release.wait()
+        self.written.extend(events)
+
+
+class TestBackgroundWriter(object):
+    def setUp(self):
+        self._backend = create_analytic_backend({
+            "backend": "analytics.backends.background.BackgroundWriter",
+            "settings": {
+                "backend": "analytics.backends.redis.Redis",
+                "settings": {
+                    "hosts": [{"db": 3}, {"db": 4}, {"db": 5}]
+                },
+                "batch_size": 10,
+            },
+        })
+
+        self._redis_backend = self._backend.get_backend()
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._backend.close()
+        self._redis_backend.flushdb()
+
+    def _create_blocked_writer(self, overflow):
+        BlockingBackend.release = threading.Event()
+        BlockingBackend.written = []
+        writer = create_analytic_backend({
+            "backend": "analytics.backends.background.BackgroundWriter",
+            "settings": {
+                "backend": BlockingBackend,
+                "queue_size": 2,
+                "batch_size": 1,
+                "overflow": overflow,
+            },
+        })
+
+        #wait for the worker to pick up the first event so the queue is empty
+        ok_(writer.track_metric("user:0", "badge:25", datetime.date(year=2012, month=4, day=5)))
+        for i in range(100):
+            if writer.get_stats()["pending"] == 0:
+                break
+            time.sleep(0.01)
+
+        return writer
+
+    def test_track_metric(self):
+        user_id = 1234
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=4, day=5)
+
+        for i in range(25):
+            ok_(self._backend.track_metric(user_id, [metric, "logins"], date, inc_amt=2))
+        ok_(self._backend.track_count(user_id, "visits", inc_amt=3))
+        self._backend.flush()
+
+        series, values = self._backend.get_metric_by_day(user_id, metric, date, limit=1)
+        eq_(values["2012-04-05"], 50)
+        eq_(self._backend.get_count(user_id, "logins"), 50)
+        eq_(self._backend.get_count(user_id, "visits"), 3)
+
+        stats = self._backend.get_stats()
+        eq_(stats["queued"], 51)
+        eq_(stats["flushed"], 51)
+        eq_(stats["dropped"], 0)
+        eq_(stats["pending"], 0)
+
+    def test_passes_through(self):
+        user_id = 1234
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=4, day=5)
+
+        ok_(self._backend.track_metric(user_id, metric, date, inc_amt=2))
+        self._backend.flush()
+
+        eq_(self._backend.get_total_between(user_id, metric, date, date), 2)
+        eq_([value for day, value in self._backend.iter_metric(user_id, metric, date, date)], [2])
+        self._backend.track_unique(metric, "user:1", date)
+        eq_(self._backend.get_unique_count(metric, date, date), 1)
+
+    def test_close_drains_queue(self):
+        user_id = 1234
+        metric = "badge:25"
+
+        eq_(self._backend.track_events([(user_id, metric, datetime.date(year=2012, month=4, day=5))] * 5), {"events": 5, "dropped": 0})
+        self._backend.close()
+
+        eq_(self._backend.get_count(user_id, metric), 5)
+
+    def test_track_after_close(self):
+        self._backend.close()
+
+        ok_(not self._backend.track_metric(1234, "badge:25", datetime.date(year=2012, month=4, day=5)))
+        ok_(not self._backend.track_count(1234, "visits"))
+        stats = self._backend.get_stats()
+        eq_(stats["queued"], 0)
+        eq_(stats["dropped"], 2)
+        eq_(stats["pending"], 0)
+
+    def test_close_with_concurrent_drop_oldest(self):
+        writer = self._create_blocked_writer("drop-oldest")
+        date = datetime.date(year=2012, month=4, day=5)
+
+        def track():
+            for i in range(200):
+                writer.track_metric("user:%s" % (i,), "badge:25", date)
+        threads = [threading.Thread(target=track) for i in range(4)]
+        for thread in threads:
+            thread.start()
+
+        BlockingBackend.release.set()
+        writer.close()
+        for thread in threads:
+            thread.join()
+
+        stats = writer.get_stats()
+        eq_(stats["pending"], 0)
+        #every event, including the one used to block the writer, was either written or dropped
+        eq_(stats["flushed"] + stats["dropped"], 801)
+        eq_(len(BlockingBackend.written), stats["flushed"])
+
+    def test_drop_new(self):
+        writer = self._create_blocked_writer("drop-new")
+
+        ok_(writer.track_metric("user:1", "badge:25", datetime.date(year=2012, month=4, day=5)))
+        ok_(writer.track_metric("user:2", "badge:25", datetime.date(year=2012, month=4, day=5)))
+        ok_(not writer.track_metric("user:3", "badge:25", datetime.date(year=2012, month=4, day=5)))
+
+        BlockingBackend.release.set()
+        writer.close()
+
+        eq_([event[0] for event in BlockingBackend.written], ["user:0", "user:1", "user:2"])
+        eq_(writer.get_stats()["dropped"], 1)
+
+    def test_drop_oldest(self):
+        writer = self._create_blocked_writer("drop-oldest")
+
+        ok_(writer.track_metric("user:1", "badge:25", datetime.date(year=2012, month=4, day=5)))
+        ok_(writer.track_metric("user:2", "badge:25", datetime.date(year=2012, month=4, day=5)))
+        ok_(writer.track_metric("user:3", "badge:25", datetime.date(year=2012, month=4, day=5)))
+
+        BlockingBackend.release.set()
+        writer.close()
+
+        eq_([event[0] for event in BlockingBackend.written], ["user:0", "user:2", "user:3"])
+        eq_(writer.get_stats()["dropped"], 1)
+
+    @raises(Exception)
+    def test_invalid_overflow(self):
+        create_analytic_backend({
+            "backend": "analytics.backends.background.BackgroundWriter",
+            "settings": {
+                "backend": "analytics.backends.dummy.Dummy",
+                "overflow": "drop-everything",
+            },
+        })
@@ -1,21 +1,31 @@
 from __future__ import absolute_import
 
+from nose.plugins.skip import SkipTest
 from nose.tools import ok_, eq_, raises, set_trace
+from redis.exceptions import ConnectionError, ResponseError
 
 from analytics import create_analytic_backend
+from analytics.buffer import FlushError
 
 import datetime
 import itertools
+import threading
+
+
+def _create_backend(backend="analytics.backends.redis.Redis", **settings):
+    """
+    Creates a ``backend`` using the test databases with the extra ``settings``.
+    """
+    settings.setdefault("hosts", [{"db": 3}, {"db": 4}, {"db": 5}])
+    return create_analytic_backend({
+        "backend": backend,
+        "settings": settings,
+    })
 
 
 class TestRedisAnalyticsBackend(object):
     def setUp(self):
-        self._backend = create_analytic_backend({
-            "backend": "analytics.backends.redis.Redis",
-            "settings": {
-                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}]
-            },
-        })
+        self._backend = _create_backend()
 
         self._redis_backend = self._backend.get_backend()
 
@@ -917,9 +927,14 @@ class TestRedisAnalyticsBackend(object):
 
         series, values = self._backend.get_metric_by_month(user_id, metric, from_date, limit=2)
         eq_(len(series), 2)
-        eq_(values["2011-12-01"], 5)  # The first set metric to 2 will be calculated when the sync is called for the second set call
+        eq_(values["2011-12-01"], 3)  # Only the change of the day set with sync_agg is applied to its month
         eq_(values["2012-01-01"], 0)
 
+        #syncing recalculates the month from all of its days
+        self._backend.sync_agg_metric(user_id, metric, date, date)
+        series, values = self._backend.get_metric_by_month(user_id, metric, from_date, limit=2)
+        eq_(values["2011-12-01"], 10)
+
     def test_sync_agg_metric_for_multi_users_at_the_same_time_with_sync(self):
         user_id = 1234
         user_id2 = "user:5678"
@@ -1049,3 +1064,1140 @@ class TestRedisAnalyticsBackend(object):
         eq_(values["2012-04-16"], 3)
         eq_(values["2012-04-23"], 0)
         eq_(values["2012-04-30"], 1)
+
+    def test_track_metric_buffered(self):
+        user_id = 1234
+        metric = "badge:25"
+        buffered_backend = _create_backend(buffer={"max_size": 100, "max_age": 60})
+
+        ok_(buffered_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=4, day=5), inc_amt=2))
+        ok_(buffered_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=4, day=5), inc_amt=3))
+        ok_(buffered_backend.track_count(user_id, "logins"))
+
+        #nothing should be written until the buffer is flushed
+        eq_(len(list(itertools.chain(*self._redis_backend.keys()))), 0)
+
+        buffered_backend.flush()
+
+        series, values = self._backend.get_metric_by_day(user_id, metric, datetime.date(year=2012, month=4, day=5), limit=1)
+        eq_(values["2012-04-05"], 5)
+        eq_(self._backend.get_count(user_id, metric), 5)
+        eq_(self._backend.get_count(user_id, "logins"), 1)
+
+    def test_track_metric_buffered_flushes_on_size(self):
+        user_id = 1234
+        metric = "badge:25"
+        buffered_backend = _create_backend(buffer={"max_size": 4, "max_age": 60})
+
+        #a single tracked metric produces 4 distinct increments which fills the buffer
+        ok_(buffered_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=4, day=5)))
+
+        eq_(self._backend.get_count(user_id, metric), 1)
+
+        ok_(buffered_backend.track_count(user_id, metric, inc_amt=2))
+        buffered_backend.close()
+
+        eq_(self._backend.get_count(user_id, metric), 3)
+
+    def test_track_metric_buffered_partial_failure(self):
+        user_id = 1234
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=4, day=5)
+        buffered_backend = _create_backend(buffer={"max_size": 100, "max_age": 60})
+        cluster = buffered_backend._analytics_backend
+        failing_client = cluster[cluster.get_conn(buffered_backend._get_count_key(user_id, metric)).num].connection
+
+        ok_(buffered_backend.track_metric(user_id, metric, date, inc_amt=2))
+
+        #the host holding the counter can't be written, the others can
+        apply_node_increments = buffered_backend._apply_node_increments
+        def failing_apply_node_increments(client, increments):
+            if client is failing_client:
+                raise ConnectionError()
+            return apply_node_increments(client, increments)
+        buffered_backend._apply_node_increments = failing_apply_node_increments
+        try:
+            buffered_backend.flush()
+            ok_(False)
+        except FlushError, e:
+            ok_(("incrby", buffered_backend._get_count_key(user_id, metric), None) in e.pending)
+        del buffered_backend._apply_node_increments
+
+        #only the increments of the failed host are retried, so nothing is counted twice
+        ok_(0 < len(buffered_backend._buffer) < 4)
+        buffered_backend.flush()
+
+        eq_(self._backend.get_count(user_id, metric), 2)
+        eq_(self._backend.get_metric_by_day(user_id, metric, date, limit=1)[1]["2012-04-05"], 2)
+        eq_(self._backend.get_metric_by_week(user_id, metric, date, limit=1)[1].values(), [2])
+        eq_(self._backend.get_metric_by_month(user_id, metric, date, limit=1)[1]["2012-04-01"], 2)
+
+    def test_track_metric_with_scripts(self):
+        user_id = 1234
+        metric = "badge:25"
+        scripted_backend = _create_backend(use_scripts=True)
+
+        results = scripted_backend.track_metric([user_id, "user:2"], [metric, "logins"], datetime.datetime(year=2012, month=4, day=5), inc_amt=2)
+        eq_(len(results), 4)
+        eq_(results[0], [2, 2, 2, 2])
+        ok_(scripted_backend._use_scripts)
+
+        scripted_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=4, day=5))
+
+        series, values = self._backend.get_metric_by_day(user_id, metric, datetime.date(year=2012, month=4, day=5), limit=1)
+        eq_(values["2012-04-05"], 3)
+        series, values = self._backend.get_metric_by_week(user_id, metric, datetime.date(year=2012, month=4, day=5), limit=1)
+        eq_(values["2012-04-02"], 3)
+        series, values = self._backend.get_metric_by_month(user_id, metric, datetime.date(year=2012, month=4, day=5), limit=1)
+        eq_(values["2012-04-01"], 3)
+        eq_(self._backend.get_count(user_id, metric), 3)
+        eq_(self._backend.get_count("user:2", "logins"), 2)
+
+    def test_track_metric_with_scripts_in_parallel(self):
+        scripted_backend = _create_backend(use_scripts=True)
+
+        #each host gets its own call, made from the thread pool
+        threads = []
+        apply_node_increments = scripted_backend._apply_node_increments
+        def recording_apply_node_increments(client, increments):
+            threads.append(threading.current_thread())
+            return apply_node_increments(client, increments)
+        scripted_backend._apply_node_increments = recording_apply_node_increments
+
+        ok_(scripted_backend.track_metric(["user:%s" % i for i in range(10)], "badge:25", datetime.date(year=2012, month=4, day=5)))
+        eq_(len(threads), 3)
+        ok_(threading.current_thread() not in threads)
+        eq_(self._backend.get_count("user:9", "badge:25"), 1)
+
+        scripted_backend.close()
+        eq_(scripted_backend._nodes_pool, None)
+
+    def test_track_metric_with_scripts_falls_back_to_pipelines(self):
+        user_id = 1234
+        metric = "badge:25"
+        scripted_backend = _create_backend(use_scripts=True)
+
+        def unavailable_script(name):
+            raise ResponseError("unknown command 'EVALSHA'")
+        scripted_backend._get_script = unavailable_script
+
+        ok_(scripted_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=4, day=5), inc_amt=2))
+        ok_(not scripted_backend._use_scripts)
+
+        eq_(self._backend.get_count(user_id, metric), 2)
+        series, values = self._backend.get_metric_by_day(user_id, metric, datetime.date(year=2012, month=4, day=5), limit=1)
+        eq_(values["2012-04-05"], 2)
+
+    def test_track_events(self):
+        user_id = 1234
+        metric = "badge:25"
+
+        events = itertools.chain(
+            ((user_id, metric, datetime.date(year=2012, month=4, day=5), 2) for i in range(10)),
+            [(user_id, metric, datetime.date(year=2012, month=5, day=1)), ("user:2", "logins", datetime.date(year=2012, month=4, day=5), 3)])
+
+        summary = self._backend.track_events(events, chunk_size=5)
+        eq_(summary["events"], 12)
+        #duplicate events only need a single write per bucket
+        eq_(summary["writes"], 11)
+        ok_(summary["events_per_second"] > 0)
+
+        series, values = self._backend.get_metric_by_day(user_id, metric, datetime.date(year=2012, month=4, day=5), limit=1)
+        eq_(values["2012-04-05"], 20)
+        series, values = self._backend.get_metric_by_month(user_id, metric, datetime.date(year=2012, month=4, day=1), limit=2)
+        eq_(values["2012-04-01"], 20)
+        eq_(values["2012-05-01"], 1)
+        eq_(self._backend.get_count(user_id, metric), 21)
+        eq_(self._backend.get_count("user:2", "logins"), 3)
+
+    def test_hash_tag_routing(self):
+        hash_tag_backend = _create_backend(hash_tags=True)
+        user_id = "user:1234"
+        metric = "badge:25"
+
+        for month in range(1, 13):
+            ok_(hash_tag_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=month, day=5)))
+
+        #all of the keys for the uid should live on a single host
+        keys_per_host = [len(keys) for keys in self._redis_backend.keys()]
+        eq_(sorted(keys_per_host)[:-1], [0, 0])
+        eq_(max(keys_per_host), 14)
+
+        series, values = hash_tag_backend.get_metric_by_month(user_id, metric, datetime.date(year=2012, month=1, day=1), limit=12)
+        eq_(sum(values.values()), 12)
+        eq_(hash_tag_backend.get_count(user_id, metric), 12)
+
+    def test_migrate_to_hash_tags(self):
+        hash_tag_backend = _create_backend(hash_tags=True)
+        user_id = "user:1234"
+        metric = "badge:25"
+        from_date = datetime.date(year=2011, month=12, day=1)
+
+        ok_(self._backend.track_metric(user_id, metric, datetime.datetime(year=2011, month=12, day=5), inc_amt=2))
+        ok_(self._backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=1, day=5), inc_amt=3))
+        ok_(hash_tag_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=1, day=5)))
+
+        eq_(hash_tag_backend.migrate_to_hash_tags(batch_size=2), 5)
+
+        series, values = hash_tag_backend.get_metric_by_month(user_id, metric, from_date, limit=2)
+        eq_(values["2011-12-01"], 2)
+        eq_(values["2012-01-01"], 4)
+        eq_(hash_tag_backend.get_count(user_id, metric), 6)
+
+        #nothing should be left under the old layout
+        eq_(self._backend.get_count(user_id, metric), 0)
+        ok_(all("{" in key for key in itertools.chain(*self._redis_backend.keys())))
+
+        eq_(hash_tag_backend.migrate_to_hash_tags(), 0)
+
+    @raises(Exception)
+    def test_migrate_to_hash_tags_requires_hash_tags(self):
+        self._backend.migrate_to_hash_tags()
+
+    def test_compact_keys(self):
+        compact_backend = _create_backend(compact_keys=True)
+        user_id = "user:1234"
+        metric = "badge:25"
+
+        ok_(compact_backend.track_metric(user_id, [metric, "logins"], datetime.datetime(year=2011, month=12, day=30), inc_amt=2))
+        ok_(compact_backend.track_metric(user_id, metric, datetime.datetime(year=2012, month=1, day=1), inc_amt=3))
+
+        #metric names should not be repeated in the keys or fields
+        keys = list(itertools.chain(*self._redis_backend.keys()))
+        ok_(not any(metric in key for key in keys))
+        daily_key = compact_backend._get_daily_metric_key(user_id, datetime.date(year=2011, month=12, day=30))
+        eq_(self._redis_backend.hgetall(daily_key), {"1:4381": "2", "2:4381": "2"})
+
+        series, values = compact_backend.get_metric_by_day(user_id, metric, datetime.date(year=2011, month=12, day=30), limit=3)
+        eq_(values, {"2011-12-30": 2, "2011-12-31": 0, "2012-01-01": 3})
+        series, values = compact_backend.get_metric_by_week(user_id, metric, datetime.date(year=2011, month=12, day=26), limit=2)
+        eq_(values, {"2011-12-26": 5, "2012-01-02": 0})
+        series, values = compact_backend.get_metric_by_month(user_id, metric, datetime.date(year=2011, month=12, day=1), limit=2)
+        eq_(values, {"2011-12-01": 2, "2012-01-01": 3})
+        eq_(compact_backend.get_count(user_id, metric), 5)
+        eq_(compact_backend.get_count(user_id, "logins"), 2)
+
+        #a fresh client should pick up the same metric ids from redis
+        other_backend = _create_backend(compact_keys=True)
+        eq_(other_backend._get_metric_id("logins"), "2")
+        eq_(other_backend._get_metric_id(metric), "1")
+        eq_(other_backend._get_metric_id("new_metric"), "3")
+
+    def test_get_compact_savings(self):
+        compact_backend = _create_backend(compact_keys=True)
+        date = datetime.date(year=2012, month=1, day=5)
+        eq_(self._backend.get_compact_savings("user:1234", "badge:25", date), [])
+
+        for backend in (self._backend, compact_backend):
+            self._redis_backend.flushdb()
+            backend.track_metric("user:1234", ["badge:25", "badge:26"], date)
+            backend.track_metric("user:1234", "badge:25", date + datetime.timedelta(days=1))
+            keys = set(itertools.chain(*self._redis_backend.keys()))
+
+            savings = backend.get_compact_savings("user:1234", "badge:25", date)
+            #only reads redis
+            eq_(set(itertools.chain(*self._redis_backend.keys())), keys)
+
+            eq_([key for key, compact_key, bytes_saved in savings], [
+                self._backend._get_daily_metric_key("user:1234", date),
+                self._backend._get_weekly_metric_key("user:1234", date),
+                self._backend._get_count_key("user:1234", "badge:25")])
+            daily_key, compact_daily_key, bytes_saved = savings[0]
+            #the key and the two days of the metric
+            eq_(bytes_saved, len(daily_key) - len(compact_daily_key) + 2 * (len("badge:25:12-01-05") - len("1:4387")))
+            ok_(all(bytes_saved > 0 for key, compact_key, bytes_saved in savings))
+
+    def test_retention(self):
+        retention_backend = _create_backend(retention={"day": 90, "week": 365, "month": 1095})
+        user_id = "user:1234"
+        metric = "badge:25"
+        today = datetime.date.today()
+
+        ok_(retention_backend.track_metric(user_id, metric, today))
+        ok_(retention_backend.track_metric(user_id, metric, today))
+
+        daily_key = retention_backend._get_daily_metric_key(user_id, today)
+        yearly_key = retention_backend._get_weekly_metric_key(user_id, today)
+        next_month = datetime.date(year=today.year, month=today.month, day=1) + datetime.timedelta(days=32)
+        next_year = datetime.date(year=today.year + 1, month=1, day=1)
+
+        #the daily hash is kept for 90 days after the month ends and the yearly hash for 1095 days after the year ends
+        daily_ttl = self._redis_backend.ttl(daily_key)
+        ok_(90 * 86400 < daily_ttl <= (90 + (next_month - today).days) * 86400)
+        yearly_ttl = self._redis_backend.ttl(yearly_key)
+        ok_(1095 * 86400 < yearly_ttl <= (1095 + (next_year - today).days) * 86400)
+        eq_(self._redis_backend.ttl(retention_backend._get_count_key(user_id, metric)), None)
+
+        eq_(retention_backend.get_count(user_id, metric), 2)
+
+    def test_retention_unique(self):
+        retention_backend = _create_backend(retention={"day": 90, "month": 1095})
+        metric = "badge:25"
+        today = datetime.date.today()
+        retention_backend.track_unique(metric, "user:1234", today)
+
+        #each granularity is kept for its own retention after its period ends
+        ok_(89 * 86400 < self._redis_backend.ttl(retention_backend._get_unique_key(metric, "day", today)) <= 91 * 86400)
+        eq_(self._redis_backend.ttl(retention_backend._get_unique_key(metric, "week", retention_backend._get_closest_week(today))), None)
+        ok_(1095 * 86400 < self._redis_backend.ttl(retention_backend._get_unique_key(metric, "month", today)) <= (1095 + 31) * 86400)
+
+        #existing keys are covered by apply_retention
+        self._backend.track_unique(metric, "user:1234", datetime.date(year=2011, month=12, day=5))
+        retention_backend.apply_retention()
+        eq_(retention_backend.get_unique_by_day(metric, datetime.date(year=2011, month=12, day=5), limit=1)[1]["2011-12-05"], 0)
+
+    def test_retention_leaderboards(self):
+        metric = "badge:25"
+        today = datetime.date.today()
+        for settings in ({"use_scripts": False}, {"use_scripts": True}, {"buffer": {"max_size": 1000}}):
+            self._redis_backend.flushdb()
+            retention_backend = _create_backend(retention={"day": 90, "week": 365}, leaderboards=True, **settings)
+            retention_backend.track_metric("user:1234", metric, today)
+            retention_backend.flush()
+
+            ok_(89 * 86400 < self._redis_backend.ttl(retention_backend._get_leaderboard_key(metric, "day", today)) <= 91 * 86400)
+            ok_(358 * 86400 < self._redis_backend.ttl(retention_backend._get_leaderboard_key(metric, "week", retention_backend._get_closest_week(today))) <= 372 * 86400)
+            eq_(self._redis_backend.ttl(retention_backend._get_leaderboard_key(metric, "month", today)), None)
+
+        self._redis_backend.flushdb()
+        retention_backend = _create_backend(retention={"day": 90, "week": 365}, leaderboards=True, **settings)
+        retention_backend.bulk_load([("user:1234", metric, today, 3)])
+        ok_(self._redis_backend.ttl(retention_backend._get_leaderboard_key(metric, "day", today)) > 0)
+
+    def test_apply_retention(self):
+        retention_backend = _create_backend(retention={"day": 90})
+        user_id = "user:1234"
+        metric = "badge:25"
+        today = datetime.date.today()
+        old_date = datetime.date(year=2011, month=12, day=5)
+
+        ok_(self._backend.track_metric(user_id, metric, today))
+        ok_(self._backend.track_metric(user_id, metric, old_date))
+        self._redis_backend.set("foo", "bar")
+
+        #only daily hashes have a retention period
+        eq_(retention_backend.apply_retention(batch_size=2), 2)
+
+        ok_(self._redis_backend.ttl(self._backend._get_daily_metric_key(user_id, today)) > 90 * 86400)
+        #daily data that is past its retention period is gone
+        series, values = self._backend.get_metric_by_day(user_id, metric, old_date, limit=1)
+        eq_(values["2011-12-05"], 0)
+        series, values = self._backend.get_metric_by_month(user_id, metric, old_date, limit=1)
+        eq_(values["2011-12-01"], 1)
+        eq_(self._redis_backend.ttl("foo"), None)
+
+        eq_(retention_backend.apply_retention(), 0)
+
+    def test_parse_key(self):
+        date = datetime.date(year=2012, month=4, day=5)
+
+        eq_(self._backend._parse_key(self._backend._get_daily_metric_key("user:1", date)), ("day", "user:1", datetime.date(year=2012, month=4, day=1)))
+        eq_(self._backend._parse_key(self._backend._get_weekly_metric_key("user:1", date)), ("year", "user:1", datetime.date(year=2012, month=1, day=1)))
+        eq_(self._backend._parse_key(self._backend._get_count_key("user:1", "badge:25")), ("count", "user:1", "badge:25"))
+        eq_(self._backend._parse_key("foo"), None)
+        eq_(self._backend._parse_key(self._backend._prefix + ":foo"), None)
+
+        self._backend._compact_keys = True
+        self._backend._hash_tags = True
+        eq_(self._backend._parse_key(self._backend._get_daily_metric_key("user:1", date)), ("day", "user:1", datetime.date(year=2012, month=4, day=1)))
+        eq_(self._backend._parse_key(self._backend._get_weekly_metric_key("user:1", date)), ("year", "user:1", datetime.date(year=2012, month=1, day=1)))
+        eq_(self._backend._parse_key(self._backend._get_count_key("user:1", "badge:25")), ("count", "user:1", "1"))
+        eq_(self._backend._parse_key(self._backend._prefix + ":metric_ids"), None)
+        eq_(self._backend._parse_key(self._backend._prefix + ":metric_ids:next"), None)
+
+    def test_track_unique(self):
+        metric = "login"
+        monday = datetime.date(year=2012, month=4, day=2)
+
+        ok_(self._backend.track_unique(metric, ["user:1", "user:2", "user:3"], monday))
+        ok_(self._backend.track_unique(metric, "user:1", monday))
+        ok_(self._backend.track_unique(metric, ["user:1", "user:4"], monday + datetime.timedelta(days=1)))
+        ok_(self._backend.track_unique(metric, "user:5", datetime.date(year=2012, month=5, day=1)))
+
+        series, values = self._backend.get_unique_by_day(metric, monday, limit=3)
+        eq_(values, {"2012-04-02": 3, "2012-04-03": 2, "2012-04-04": 0})
+        series, values = self._backend.get_unique_by_week(metric, monday + datetime.timedelta(days=3), limit=2)
+        eq_(values, {"2012-04-02": 4, "2012-04-09": 0})
+        series, values = self._backend.get_unique_by_month(metric, monday, limit=2)
+        eq_(values, {"2012-04-01": 4, "2012-05-01": 1})
+
+    def test_get_unique_count(self):
+        metric = "login"
+
+        for day in range(1, 31):
+            ok_(self._backend.track_unique(metric, ["user:%s" % day, "user:0"], datetime.date(year=2012, month=4, day=day)))
+        ok_(self._backend.track_unique(metric, ["user:0", "user:100"], datetime.date(year=2012, month=3, day=31)))
+        ok_(self._backend.track_unique(metric, ["user:1", "user:200"], datetime.date(year=2012, month=5, day=2)))
+
+        eq_(self._backend.get_unique_count(metric, datetime.date(year=2012, month=4, day=1), datetime.date(year=2012, month=4, day=30)), 31)
+        eq_(self._backend.get_unique_count(metric, datetime.date(year=2012, month=3, day=31), datetime.date(year=2012, month=5, day=2)), 33)
+        eq_(self._backend.get_unique_count(metric, datetime.date(year=2012, month=4, day=3), datetime.date(year=2012, month=4, day=1)), 4)
+        eq_(self._backend.get_unique_count(metric, datetime.date(year=2013, month=4, day=3), datetime.date(year=2013, month=4, day=1)), 0)
+
+        #temporary keys used to merge across hosts should be cleaned up
+        ok_(not any(":uniq:tmp:" in key for key in itertools.chain(*self._redis_backend.keys())))
+
+    def test_leaderboards(self):
+        for use_scripts in (False, True):
+            self._redis_backend.flushdb()
+            leaderboard_backend = _create_backend(leaderboards=["badge:25"], use_scripts=use_scripts)
+            metric = "badge:25"
+            monday = datetime.date(year=2012, month=4, day=2)
+
+            ok_(leaderboard_backend.track_metric(["user:1", "user:2"], [metric, "logins"], monday, inc_amt=2))
+            ok_(leaderboard_backend.track_metric("user:2", metric, monday + datetime.timedelta(days=1), inc_amt=3))
+            ok_(leaderboard_backend.track_metric("user:3", metric, monday + datetime.timedelta(days=7), inc_amt=10))
+
+            eq_(leaderboard_backend.get_top(metric, "day", monday), [("user:1", 2), ("user:2", 2)])
+            eq_(leaderboard_backend.get_top(metric, "week", monday + datetime.timedelta(days=3)), [("user:2", 5), ("user:1", 2)])
+            eq_(leaderboard_backend.get_top(metric, "week", monday, k=1), [("user:2", 5)])
+            eq_(leaderboard_backend.get_top(metric, "month", monday), [("user:3", 10), ("user:2", 5), ("user:1", 2)])
+            eq_(leaderboard_backend.get_top("logins", "month", monday), [])
+
+            #regular metrics should still be tracked
+            eq_(leaderboard_backend.get_count("user:2", metric), 5)
+
+    def test_get_top_between(self):
+        leaderboard_backend = _create_backend(leaderboards=True)
+        metric = "badge:25"
+
+        for day in range(1, 31):
+            ok_(leaderboard_backend.track_metric("user:%s" % (day % 3), metric, datetime.date(year=2012, month=4, day=day), inc_amt=day))
+        ok_(leaderboard_backend.track_metric("user:5", metric, datetime.date(year=2012, month=3, day=31), inc_amt=500))
+        ok_(leaderboard_backend.track_metric("user:6", metric, datetime.date(year=2012, month=5, day=2), inc_amt=160))
+
+        eq_(leaderboard_backend.get_top_between(metric, datetime.date(year=2012, month=4, day=1), datetime.date(year=2012, month=4, day=30)),
+            [("user:0", 165), ("user:2", 155), ("user:1", 145)])
+        eq_(leaderboard_backend.get_top_between(metric, datetime.date(year=2012, month=5, day=2), datetime.date(year=2012, month=3, day=31), k=3),
+            [("user:5", 500), ("user:0", 165), ("user:6", 160)])
+        eq_(leaderboard_backend.get_top_between(metric, datetime.date(year=2012, month=4, day=1), datetime.date(year=2012, month=4, day=3)),
+            [("user:0", 3), ("user:2", 2), ("user:1", 1)])
+
+        ok_(not any(":top:tmp:" in key for key in itertools.chain(*self._redis_backend.keys())))
+
+    def test_get_metrics_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            raise SkipTest("numpy is not installed")
+
+        from_date = datetime.date(year=2011, month=12, day=30)
+        ok_(self._backend.track_metric("user:1", "badge:25", datetime.date(year=2011, month=12, day=30), inc_amt=2))
+        ok_(self._backend.track_metric("user:1", "badge:25", datetime.date(year=2012, month=1, day=2), inc_amt=3))
+        ok_(self._backend.track_metric("user:2", "badge:25", datetime.date(year=2011, month=12, day=31)))
+
+        identifiers = [("user:1", "badge:25"), ("user:2", "badge:25"), ("user:3", "badge:25")]
+        series, matrix = self._backend.get_metrics(identifiers, from_date, limit=4, group_by="day", output="numpy")
+        eq_(series, ["2011-12-30", "2011-12-31", "2012-01-01", "2012-01-02"])
+        eq_(matrix.dtype, numpy.int64)
+        eq_(matrix.tolist(), [[2, 0, 0, 3], [0, 1, 0, 0], [0, 0, 0, 0]])
+
+        #should match the dictionary output
+        for row, (dict_series, values) in zip(matrix.tolist(), self._backend.get_metrics(identifiers, from_date, limit=4, group_by="day")):
+            eq_(row, [values[date] for date in series])
+
+        series, matrix = self._backend.get_metrics(identifiers, from_date, limit=2, group_by="week", output="numpy")
+        eq_(series, ["2011-12-26", "2012-01-02"])
+        eq_(matrix.tolist(), [[2, 3], [1, 0], [0, 0]])
+
+        series, matrix = self._backend.get_metrics([], from_date, output="numpy")
+        eq_(series, [])
+        eq_(matrix.shape, (0, 0))
+
+    @raises(Exception)
+    def test_get_metrics_invalid_output(self):
+        self._backend.get_metrics([("user:1", "badge:25")], datetime.date(year=2011, month=12, day=30), output="csv")
+
+    def test_cache_closed_periods(self):
+        backend = _create_backend(cache={"max_size": 1000})
+
+        user_id = 1234
+        metric = "badge:25"
+        past = datetime.date(year=2012, month=1, day=2)
+        today = datetime.date.today()
+
+        backend.track_metric(user_id, metric, past)
+        backend.track_metric(user_id, metric, today)
+
+        eq_(backend.get_metric_by_day(user_id, metric, past, limit=1)[1][past.isoformat()], 1)
+        eq_(backend.get_metric_by_day(user_id, metric, today, limit=1)[1][today.isoformat()], 1)
+        ok_(len(backend._cache) > 0)
+
+        #writes from elsewhere to closed periods aren't seen once cached, the open period is always read
+        self._redis_backend.hincrby(backend._get_daily_metric_key(user_id, past), backend._get_daily_metric_name(metric, past), 5)
+        self._redis_backend.hincrby(backend._get_daily_metric_key(user_id, today), backend._get_daily_metric_name(metric, today), 5)
+        eq_(backend.get_metric_by_day(user_id, metric, past, limit=1)[1][past.isoformat()], 1)
+        eq_(backend.get_metric_by_day(user_id, metric, today, limit=1)[1][today.isoformat()], 6)
+
+        #the backend's own writes invalidate the cache
+        backend.track_metric(user_id, metric, past)
+        eq_(backend.get_metric_by_day(user_id, metric, past, limit=1)[1][past.isoformat()], 7)
+        eq_(backend.get_metrics([(user_id, metric)], past, limit=1, group_by="day")[0][1][past.isoformat()], 7)
+
+        eq_(backend.get_metric_by_month(user_id, metric, past, limit=1)[1][past.replace(day=1).isoformat()], 2)
+        backend.set_metric_by_day(user_id, metric, past, 2, sync_agg=False)
+        eq_(backend.get_metric_by_day(user_id, metric, past, limit=1)[1][past.isoformat()], 2)
+        backend.sync_agg_metric(user_id, metric, past, past)
+        eq_(backend.get_metric_by_month(user_id, metric, past, limit=1)[1][past.replace(day=1).isoformat()], 2)
+
+        backend.clear_all()
+        eq_(len(backend._cache), 0)
+
+    def test_get_counts_single_round_trip(self):
+        start_date = datetime.date(year=2012, month=1, day=15)
+        end_date = datetime.date(year=2012, month=6, day=10)
+        metric = "badge:25"
+        user_ids = ["user:%s" % i for i in xrange(20)]
+
+        for i, user_id in enumerate(user_ids):
+            self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=1, day=10), inc_amt=100)
+            self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=1, day=20), inc_amt=i)
+            self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=3, day=5), inc_amt=2)
+            self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=6, day=10))
+
+        cluster = self._backend._analytics_backend
+        map_calls = []
+        original_map = cluster.map
+
+        def counting_map(*args, **kwargs):
+            map_calls.append(args)
+            return original_map(*args, **kwargs)
+
+        cluster.map = counting_map
+        try:
+            counts = self._backend.get_counts([(user_id, metric) for user_id in user_ids], start_date=start_date, end_date=end_date)
+        finally:
+            del cluster.map
+
+        eq_(len(map_calls), 1)
+        eq_(counts, [i + 3 for i in xrange(len(user_ids))])
+        eq_(counts, [self._backend.get_count(user_id, metric, start_date, end_date) for user_id in user_ids])
+
+    def test_get_range_buckets(self):
+        buckets = self._backend._get_range_buckets(datetime.date(year=2011, month=12, day=28), datetime.date(year=2012, month=3, day=12))
+        eq_(buckets, [
+            ("day", datetime.date(year=2011, month=12, day=28)),
+            ("day", datetime.date(year=2011, month=12, day=29)),
+            ("day", datetime.date(year=2011, month=12, day=30)),
+            ("day", datetime.date(year=2011, month=12, day=31)),
+            ("month", datetime.date(year=2012, month=1, day=1)),
+            ("month", datetime.date(year=2012, month=2, day=1)),
+            ("day", datetime.date(year=2012, month=3, day=1)),
+            ("day", datetime.date(year=2012, month=3, day=2)),
+            ("day", datetime.date(year=2012, month=3, day=3)),
+            ("day", datetime.date(year=2012, month=3, day=4)),
+            ("week", datetime.date(year=2012, month=3, day=5)),
+            ("day", datetime.date(year=2012, month=3, day=12)),
+        ])
+
+    def test_get_total_between(self):
+        backend = _create_backend(year_rollups=True)
+
+        user_id = "user1234"
+        metric = "badges:21"
+        start_date = datetime.date(year=2010, month=12, day=29)
+        dates = [start_date + datetime.timedelta(days=i * 5) for i in xrange(150)]
+        for i, date in enumerate(dates):
+            backend.track_metric(user_id, metric, date, inc_amt=i)
+
+        eq_(backend._get_range_buckets(datetime.date(year=2011, month=1, day=1), datetime.date(year=2011, month=12, day=31)),
+            [("year", datetime.date(year=2011, month=1, day=1))])
+
+        for start, end in [(dates[0], dates[-1]), (dates[3], dates[90]), (dates[1], dates[2]), (dates[80], dates[10])]:
+            expected = sum(i for i, date in enumerate(dates) if min(start, end) <= date <= max(start, end))
+            eq_(backend.get_total_between(user_id, metric, start, end), expected)
+            eq_(backend.get_counts([(user_id, metric)], start_date=start, end_date=end), [expected])
+
+        #the yearly totals are kept in sync when a day is overwritten
+        backend.set_metric_by_day(user_id, metric, dates[10], 1000)
+        expected = sum(i for i in xrange(len(dates)) if dates[i].year == 2011 and i != 10) + 1000
+        eq_(backend.get_total_between(user_id, metric, datetime.date(year=2011, month=1, day=1), datetime.date(year=2011, month=12, day=31)), expected)
+
+        #and recalculated along with the weeks and months
+        backend.set_metric_by_day(user_id, metric, dates[10], 10, sync_agg=False)
+        backend.track_metric("user4567", metric, dates[10], inc_amt=3)
+        backend.set_metric_by_day("user4567", metric, dates[10], 0, sync_agg=False)
+        backend.sync_agg_metric([user_id, "user4567"], metric, dates[10], dates[10], batch_size=1)
+        expected = sum(i for i in xrange(len(dates)) if dates[i].year == 2011)
+        eq_(backend.get_total_between(user_id, metric, datetime.date(year=2011, month=1, day=1), datetime.date(year=2011, month=12, day=31)), expected)
+        eq_(backend.get_total_between("user4567", metric, datetime.date(year=2011, month=1, day=1), datetime.date(year=2011, month=12, day=31)), 0)
+
+    def test_iter_metric(self):
+        user_id = "user1234"
+        metric = "badges:21"
+        start_date = datetime.date(year=2011, month=11, day=20)
+        end_date = datetime.date(year=2012, month=2, day=3)
+
+        for i in xrange(0, 80, 3):
+            self._backend.track_metric(user_id, metric, start_date + datetime.timedelta(days=i), inc_amt=i)
+
+        for granularity, get_metric, limit in [
+                ("day", self._backend.get_metric_by_day, 76),
+                ("week", self._backend.get_metric_by_week, 12),
+                ("month", self._backend.get_metric_by_month, 4)]:
+            _, expected = get_metric(user_id, metric, start_date, limit=limit)
+            for prefetch in (True, False):
+                series = list(self._backend.iter_metric(user_id, metric, start_date, end_date, granularity, prefetch=prefetch))
+                eq_(len(series), limit)
+                eq_([period for period, value in series], sorted(period for period, value in series))
+                eq_(dict((period.isoformat(), value) for period, value in series), expected)
+
+        #chunks follow the hashes
+        eq_([len(chunk) for chunk in self._backend._get_metric_chunks("day", start_date, end_date)], [11, 31, 31, 3])
+        eq_(list(self._backend.iter_metric(user_id, metric, end_date, start_date)), [])
+
+    @raises(Exception)
+    def test_iter_metric_invalid_granularity(self):
+        list(self._backend.iter_metric("user1234", "badges:21", datetime.date.today(), datetime.date.today(), "year"))
+
+    def test_reads_only_ask_hashes_for_their_own_fields(self):
+        class RecordingConnection(object):
+            def __init__(self):
+                self.calls = []
+
+            def hmget(self, key, fields):
+                self.calls.append((key, list(fields)))
+                return [None] * len(fields)
+
+        user_id = "user1234"
+        metric = "badges:21"
+
+        conn = RecordingConnection()
+        self._backend.get_metric_by_month(user_id, metric, datetime.date(year=2011, month=1, day=1), limit=36, connection=conn)
+        eq_([len(fields) for key, fields in conn.calls], [12, 12, 12])
+
+        conn = RecordingConnection()
+        self._backend.get_metric_by_day(user_id, metric, datetime.date(year=2011, month=1, day=30), limit=5, connection=conn)
+        eq_([len(fields) for key, fields in conn.calls], [2, 3])
+
+        #2012-12-31 is a monday, that week is stored in the hashes of both years
+        conn = RecordingConnection()
+        self._backend.get_metric_by_week(user_id, metric, datetime.date(year=2012, month=12, day=24), limit=3, connection=conn)
+        eq_(conn.calls[0][1], [self._backend._get_weekly_metric_name(metric, datetime.date(year=2012, month=12, day=day)) for day in (24, 31)])
+        eq_(conn.calls[1][1], [self._backend._get_weekly_metric_name(metric, datetime.date(year=2012, month=12, day=31)),
+            self._backend._get_weekly_metric_name(metric, datetime.date(year=2013, month=1, day=7))])
+
+        #the values still line up with the series
+        self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=12, day=31), inc_amt=2)
+        self._backend.track_metric(user_id, metric, datetime.date(year=2013, month=1, day=2), inc_amt=3)
+        self._backend.track_metric(user_id, metric, datetime.date(year=2013, month=3, day=2), inc_amt=4)
+        eq_(self._backend.get_metric_by_week(user_id, metric, datetime.date(year=2012, month=12, day=24), limit=3)[1],
+            {"2012-12-24": 0, "2012-12-31": 5, "2013-01-07": 0})
+        eq_(self._backend.get_metric_by_month(user_id, metric, datetime.date(year=2012, month=12, day=1), limit=4)[1],
+            {"2012-12-01": 2, "2013-01-01": 3, "2013-02-01": 0, "2013-03-01": 4})
+
+    def test_aggregate_metrics(self):
+        metric = "badges:21"
+        user_ids = ["user:%s" % i for i in xrange(30)]
+        from_date = datetime.date(year=2012, month=12, day=20)
+
+        for i, user_id in enumerate(user_ids):
+            self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=12, day=20), inc_amt=i)
+            self._backend.track_metric(user_id, metric, datetime.date(year=2013, month=1, day=1), inc_amt=2)
+            self._backend.track_metric(user_id, metric, datetime.date(year=2013, month=2, day=14))
+
+        for group_by, get_metric, limit in [
+                ("day", self._backend.get_metric_by_day, 60),
+                ("week", self._backend.get_metric_by_week, 10),
+                ("month", self._backend.get_metric_by_month, 3)]:
+            expected = {}
+            for user_id in user_ids:
+                for day, value in get_metric(user_id, metric, from_date, limit=limit)[1].iteritems():
+                    expected[day] = expected.get(day, 0) + value
+
+            series, values = self._backend.aggregate_metrics(user_ids, metric, from_date, limit=limit, group_by=group_by)
+            eq_(values, expected)
+            eq_(series, set(expected.keys()))
+
+        eq_(self._backend.aggregate_metrics(user_ids, metric, from_date, limit=3, group_by="month")[1],
+            {"2012-12-01": sum(xrange(30)), "2013-01-01": 60, "2013-02-01": 30})
+
+        #each host sums its hashes in a call made from the thread pool
+        threads = []
+        aggregate_node_fields = self._backend._aggregate_node_fields
+        def recording_aggregate_node_fields(client, length, key_fields):
+            threads.append(threading.current_thread())
+            return aggregate_node_fields(client, length, key_fields)
+        self._backend._aggregate_node_fields = recording_aggregate_node_fields
+        eq_(self._backend.aggregate_metrics(user_ids, metric, from_date, limit=3, group_by="month")[1]["2013-01-01"], 60)
+        eq_(len(threads), 3)
+        ok_(threading.current_thread() not in threads)
+        del self._backend._aggregate_node_fields
+
+        #without scripting the fields are summed on the client
+        def unavailable_script(name):
+            raise ResponseError("unknown command 'EVALSHA'")
+        self._backend._get_script = unavailable_script
+        eq_(self._backend.aggregate_metrics(user_ids, metric, from_date, limit=3, group_by="month")[1],
+            {"2012-12-01": sum(xrange(30)), "2013-01-01": 60, "2013-02-01": 30})
+
+    @raises(Exception)
+    def test_aggregate_metrics_invalid_group_by(self):
+        self._backend.aggregate_metrics(["user:1"], "badges:21", datetime.date.today(), group_by="year")
+
+    def test_global_rollups(self):
+        from analytics.backends.redis import GLOBAL_IDENTIFIER
+
+        backend = _create_backend(global_rollups=["badges:21"])
+
+        metric = "badges:21"
+        date = datetime.date(year=2012, month=4, day=5)
+        backend.track_metric(["user:1", "user:2"], [metric, "badges:22"], date, inc_amt=2)
+        backend.track_events([("user:3", metric, date, 3), ("user:3", metric, date + datetime.timedelta(days=1))])
+
+        eq_(backend.get_count(GLOBAL_IDENTIFIER, metric), 8)
+        eq_(backend.get_count(GLOBAL_IDENTIFIER, "badges:22"), 0)
+        eq_(backend.get_metric_by_day(GLOBAL_IDENTIFIER, metric, date, limit=2)[1], {"2012-04-05": 7, "2012-04-06": 1})
+        eq_(backend.get_metric_by_week(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-02": 8})
+        eq_(backend.get_metric_by_month(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-01": 8})
+
+        #setting a day moves the global rollups by the difference
+        backend.set_metric_by_day("user:1", metric, date, 10)
+        eq_(backend.get_count(GLOBAL_IDENTIFIER, metric), 16)
+        eq_(backend.get_metric_by_day(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-05": 15})
+        eq_(backend.get_metric_by_month(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-01": 16})
+
+    def test_global_rollups_set_without_sync(self):
+        from analytics.backends.redis import GLOBAL_IDENTIFIER
+
+        metric = "badges:21"
+        date = datetime.date(year=2012, month=4, day=5)
+        for use_scripts in (False, True):
+            self._redis_backend.flushdb()
+            backend = _create_backend(global_rollups=True, use_scripts=use_scripts)
+            backend.track_metric(["user:1", "user:2"], metric, date, inc_amt=3)
+
+            #only the global day moves along with the day
+            backend.set_metric_by_day("user:1", metric, date, 10, sync_agg=False, update_counter=False)
+            eq_(backend.get_metric_by_day(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-05": 13})
+            eq_(backend.get_metric_by_week(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-02": 6})
+            eq_(backend.get_metric_by_month(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-01": 6})
+            eq_(backend.get_count(GLOBAL_IDENTIFIER, metric), 6)
+
+            #the global counter moves with the counters of the unique identifiers
+            backend.set_metric_by_day("user:2", metric, date, 0, sync_agg=False)
+            eq_(backend.get_metric_by_day(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-05": 10})
+            eq_(backend.get_metric_by_month(GLOBAL_IDENTIFIER, metric, date, limit=1)[1], {"2012-04-01": 6})
+            eq_(backend.get_count(GLOBAL_IDENTIFIER, metric), backend.get_count("user:1", metric) + backend.get_count("user:2", metric))
+
+    def test_metric_index(self):
+        for use_scripts in (False, True):
+            self._redis_backend.flushdb()
+            backend = _create_backend(metric_index=True, use_scripts=use_scripts)
+
+            date = datetime.date(year=2012, month=4, day=5)
+            backend.track_metric(["user:1", "user:2"], "badges:21", date, inc_amt=2)
+            backend.track_metric("user:1", ["badges:22", "badges:23"], date)
+
+            eq_(backend.list_metrics("user:1"), set(["badges:21", "badges:22", "badges:23"]))
+            eq_(backend.list_metrics("user:2"), set(["badges:21"]))
+            eq_(backend.list_metrics("user:3"), set())
+            eq_(backend.list_metrics(), set(["badges:21", "badges:22", "badges:23"]))
+            eq_(backend.list_uids("badges:21"), set(["user:1", "user:2"]))
+            eq_(backend.list_uids("badges:23"), set(["user:1"]))
+
+            all_metrics = backend.get_all_metrics("user:1", date, limit=1, group_by="day")
+            eq_(sorted(all_metrics.keys()), ["badges:21", "badges:22", "badges:23"])
+            eq_(all_metrics["badges:21"][1], {"2012-04-05": 2})
+            eq_(all_metrics["badges:22"][1], {"2012-04-05": 1})
+
+    def test_sync_agg_metric_in_batches(self):
+        metric = "badges:21"
+        user_ids = ["user:%s" % i for i in xrange(25)]
+        days = [datetime.date(year=2012, month=12, day=28) + datetime.timedelta(days=i * 3) for i in xrange(20)]
+
+        for i, user_id in enumerate(user_ids):
+            self._backend.track_metric(user_id, metric, days[0], inc_amt=100)
+            for j, day in enumerate(days):
+                self._backend.set_metric_by_day(user_id, metric, day, i + j, sync_agg=False)
+
+        cluster = self._backend._analytics_backend
+        map_calls = []
+        original_map = cluster.map
+
+        def counting_map(*args, **kwargs):
+            map_calls.append(args)
+            return original_map(*args, **kwargs)
+
+        cluster.map = counting_map
+        try:
+            self._backend.sync_agg_metric(user_ids, metric, days[0], days[-1], batch_size=10, workers=3)
+        finally:
+            del cluster.map
+
+        #a pipeline to read and one to write for each batch
+        eq_(len(map_calls), 6)
+
+        for i, user_id in enumerate(user_ids):
+            _, daily = self._backend.get_metric_by_day(user_id, metric, days[0], limit=(days[-1] - days[0]).days + 1)
+            _, weekly = self._backend.get_metric_by_week(user_id, metric, days[0], limit=9)
+            _, monthly = self._backend.get_metric_by_month(user_id, metric, days[0], limit=3)
+            for week, value in weekly.iteritems():
+                monday = datetime.datetime.strptime(week, "%Y-%m-%d").date()
+                eq_(value, sum(daily.get((monday + datetime.timedelta(days=d)).isoformat(), 0) for d in xrange(7)))
+            eq_(monthly["2012-12-01"], i + (i + 1))
+            eq_(sum(monthly.values()), sum(daily.values()))
+
+        #the week of 2012-12-31 is split between the hashes of both years, like track_metric does it
+        eq_(self._backend.get_metric_by_week(user_ids[0], metric, datetime.date(year=2012, month=12, day=31), limit=1)[1],
+            {"2012-12-31": 1 + 2 + 3})
+
+    def test_set_metrics_by_day(self):
+        def unavailable_script(name):
+            raise ResponseError("unknown command 'EVALSHA'")
+
+        for hash_tags, scripting in ((False, True), (True, True), (False, False)):
+            self._redis_backend.flushdb()
+            backend = _create_backend(hash_tags=hash_tags)
+            if not scripting:
+                backend._get_script = unavailable_script
+
+            date = datetime.date(year=2012, month=4, day=5)
+            backend.track_metric(["user:1", "user:2"], "badges:21", date, inc_amt=4)
+            backend.track_metric("user:1", "badges:21", date + datetime.timedelta(days=1), inc_amt=1)
+
+            deltas = backend.set_metrics_by_day([
+                ("user:1", "badges:21", date, 10),
+                ("user:2", "badges:21", date, 1),
+                ("user:3", "badges:21", date, 2),
+            ])
+            eq_(deltas, [6, -3, 2])
+
+            eq_(backend.get_metric_by_day("user:1", "badges:21", date, limit=2)[1], {"2012-04-05": 10, "2012-04-06": 1})
+            eq_(backend.get_metric_by_week("user:1", "badges:21", date, limit=1)[1], {"2012-04-02": 11})
+            eq_(backend.get_metric_by_month("user:2", "badges:21", date, limit=1)[1], {"2012-04-01": 1})
+            eq_(backend.get_count("user:1", "badges:21"), 11)
+            eq_(backend.get_count("user:3", "badges:21"), 2)
+
+            #only the day and the counter
+            eq_(backend.set_metrics_by_day([("user:1", "badges:21", date, 0)], sync_agg=False), [-10])
+            eq_(backend.get_metric_by_week("user:1", "badges:21", date, limit=1)[1], {"2012-04-02": 11})
+            eq_(backend.get_count("user:1", "badges:21"), 1)
+
+    def test_bulk_load(self):
+        metric = "badges:21"
+        start_date = datetime.date(year=2011, month=12, day=20)
+        rows = []
+        for i in xrange(5):
+            for day in xrange(0, 40, 3):
+                rows.append(("user:%s" % i, metric, start_date + datetime.timedelta(days=day), i + day))
+        rows.append(("user:0", "badges:22", datetime.datetime(year=2012, month=1, day=2), 7))
+        rows.append(("user:0", "badges:22", datetime.date(year=2012, month=1, day=2), 3))
+
+        def get_all(uid):
+            return (
+                self._backend.get_metric_by_day(uid, metric, start_date, limit=40)[1],
+                self._backend.get_metric_by_week(uid, metric, start_date, limit=7)[1],
+                self._backend.get_metric_by_month(uid, metric, start_date, limit=3)[1],
+                self._backend.get_count(uid, metric),
+                self._backend.get_count(uid, "badges:22"))
+
+        for uid, row_metric, date, count in rows:
+            self._backend.track_metric(uid, row_metric, date, inc_amt=count)
+        tracked = [get_all(uid) for uid in ("user:0", "user:3")]
+
+        for sorted_by_uid, chunk_size in ((False, 2), (True, 2), (False, 1000)):
+            self._redis_backend.flushdb()
+            summary = self._backend.bulk_load(
+                sorted(rows, key=lambda row: row[0]) if sorted_by_uid else reversed(rows),
+                chunk_size=chunk_size, sorted_by_uid=sorted_by_uid)
+            eq_(summary["events"], len(rows))
+            eq_([get_all(uid) for uid in ("user:0", "user:3")], tracked)
+
+        #loading again replaces rather than adds
+        self._backend.bulk_load(rows)
+        eq_([get_all(uid) for uid in ("user:0", "user:3")], tracked)
+
+    def test_verify_rollups(self):
+        user_id = "user:1234"
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=1, day=31)
+
+        ok_(self._backend.track_metric(user_id, metric, date, inc_amt=2))
+        ok_(self._backend.track_metric("user:4567", metric, date))
+
+        report = self._backend.verify_rollups(counters=True, batch_size=1, workers=2)
+        eq_(report["years"], 2)
+        eq_(report["checked"], 6)
+        eq_(report["mismatches"], [])
+
+        self._backend.set_metric_by_day(user_id, metric, date, 5, sync_agg=False, update_counter=False)
+
+        report = self._backend.verify_rollups(repair=True, counters=True, max_rate=1000)
+        eq_(len(report["mismatches"]), 3)
+        ok_(all(expected == 5 and actual == 2 for key, field, expected, actual in report["mismatches"]))
+        eq_(report["repaired"], 3)
+
+        series, values = self._backend.get_metric_by_week(user_id, metric, date, limit=1)
+        eq_(values["2012-01-30"], 5)
+        series, values = self._backend.get_metric_by_month(user_id, metric, date, limit=1)
+        eq_(values["2012-01-01"], 5)
+        eq_(self._backend.get_count(user_id, metric), 5)
+
+        eq_(self._backend.verify_rollups(counters=True)["mismatches"], [])
+
+    def test_verify_rollups_concurrent_writes(self):
+        user_id = "user:1234"
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=1, day=31)
+
+        ok_(self._backend.track_metric(user_id, metric, date, inc_amt=5))
+        #a track_metric that has written the day but none of the other buckets yet
+        increments = self._backend._get_bucket_increments(user_id, metric, date, 3)
+        self._redis_backend.hincrby(increments[0][1], increments[0][2], 3)
+
+        get_bucket_increments = self._backend._get_bucket_increments
+        def finish_write(*args):
+            #it finishes while the daily metrics are being checked
+            if increments:
+                for command, key, field, amount in increments[1:]:
+                    if command == "incrby":
+                        self._redis_backend.incr(key, amount)
+                    else:
+                        self._redis_backend.hincrby(key, field, amount)
+                del increments[:]
+            return get_bucket_increments(*args)
+        self._backend._get_bucket_increments = finish_write
+
+        report = self._backend.verify_rollups(repair=True, counters=True)
+        eq_(report["mismatches"], [])
+        #the week and month, the counters are checked after the write has finished
+        eq_(report["skipped"], 2)
+
+        del self._backend._get_bucket_increments
+        eq_(self._backend.get_metric_by_month(user_id, metric, date, limit=1)[1]["2012-01-01"], 8)
+        eq_(self._backend.get_count(user_id, metric), 8)
+        eq_(self._backend.verify_rollups(counters=True)["mismatches"], [])
+
+    def test_verify_rollups_compact_keys(self):
+        compact_backend = _create_backend(compact_keys=True)
+        user_id = "user:1234"
+        metric = "badge:25"
+        #the week spans two years
+        date = datetime.date(year=2013, month=1, day=1)
+
+        ok_(compact_backend.track_metric(user_id, metric, datetime.date(year=2012, month=12, day=31), inc_amt=3))
+        ok_(compact_backend.track_metric(user_id, metric, date, inc_amt=4))
+        compact_backend.track_count(user_id, metric)
+
+        report = compact_backend.verify_rollups()
+        eq_(report["checked"], 4)
+        eq_(report["mismatches"], [])
+
+        report = compact_backend.verify_rollups(repair=True, counters=True)
+        eq_(len(report["mismatches"]), 1)
+        eq_(report["mismatches"][0][2:], (7, 8))
+        eq_(compact_backend.get_count(user_id, metric), 7)
+
+    def test_clear_unique_identifier(self):
+        backend = _create_backend(metric_index=True)
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=4, day=5)
+
+        ok_(backend.track_metric("user:1234", metric, date))
+        #shares the start of the first unique identifier
+        ok_(backend.track_metric("user:1234:analy:2", metric, date, inc_amt=2))
+        ok_(backend.track_metric("user:4567", metric, date, inc_amt=3))
+
+        eq_(backend.clear_unique_identifier("user:1234", batch_size=1), 3)
+
+        eq_(backend.get_count("user:1234", metric), 0)
+        eq_(backend.get_metric_by_month("user:1234", metric, date, limit=1)[1]["2012-04-01"], 0)
+        eq_(backend.get_count("user:1234:analy:2", metric), 2)
+        eq_(backend.get_count("user:4567", metric), 3)
+        eq_(backend.list_metrics("user:1234"), set())
+        eq_(backend.list_uids(metric), set(["user:1234:analy:2", "user:4567"]))
+
+    def test_clear_metric(self):
+        for backend in [self._backend, _create_backend(compact_keys=True, leaderboards=True)]:
+            date = datetime.date(year=2012, month=4, day=5)
+            ok_(backend.track_metric(["user:1234", "user:4567"], ["badge:25", "badge:25:gold"], date))
+            backend.track_unique("badge:25", "user:1234", date)
+
+            ok_(backend.clear_metric("badge:25") > 0)
+
+            eq_(backend.get_count("user:1234", "badge:25"), 0)
+            eq_(backend.get_metric_by_week("user:4567", "badge:25", date, limit=1)[1]["2012-04-02"], 0)
+            eq_(backend.get_unique_count("badge:25", date, date), 0)
+            eq_(backend.get_count("user:1234", "badge:25:gold"), 1)
+            eq_(backend.get_metric_by_day("user:4567", "badge:25:gold", date, limit=1)[1]["2012-04-05"], 1)
+            eq_(backend.get_metric_by_month("user:4567", "badge:25:gold", date, limit=1)[1]["2012-04-01"], 1)
+
+            backend.clear_all()
+
+    def test_clear_before(self):
+        user_id = "user:1234"
+        metric = "badge:25"
+
+        ok_(self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=3, day=30)))
+        ok_(self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=4, day=2), inc_amt=2))
+        ok_(self._backend.track_metric(user_id, metric, datetime.date(year=2012, month=4, day=9), inc_amt=4))
+        self._backend.track_unique(metric, user_id, datetime.date(year=2012, month=3, day=30))
+
+        self._backend.clear_before(datetime.date(year=2012, month=4, day=9))
+
+        series, values = self._backend.get_metric_by_day(user_id, metric, datetime.date(year=2012, month=3, day=30), limit=11)
+        eq_(sum(values.values()), 4)
+        series, values = self._backend.get_metric_by_week(user_id, metric, datetime.date(year=2012, month=3, day=26), limit=3)
+        eq_(values, {"2012-03-26": 0, "2012-04-02": 0, "2012-04-09": 4})
+        series, values = self._backend.get_metric_by_month(user_id, metric, datetime.date(year=2012, month=3, day=1), limit=2)
+        eq_(values, {"2012-03-01": 0, "2012-04-01": 6})
+        eq_(self._backend.get_unique_count(metric, datetime.date(year=2012, month=3, day=30), datetime.date(year=2012, month=3, day=30)), 0)
+        eq_(self._backend.get_count(user_id, metric), 7)
+
+    def test_clear_all_without_unlink(self):
+        ok_(self._backend.track_metric("user:1234", "badge:25", datetime.date(year=2012, month=4, day=5)))
+        self._backend._use_unlink = False
+        eq_(self._backend.clear_all(batch_size=1), 3)
+        eq_(list(itertools.chain(*self._redis_backend.keys())), [])
+
+    def test_bulk_load_global_rollups_and_leaderboards(self):
+        from analytics.backends.redis import GLOBAL_IDENTIFIER
+
+        backend = _create_backend(global_rollups=True, leaderboards=True)
+        metric = "badges:21"
+        start_date = datetime.date(year=2011, month=12, day=20)
+        rows = [("user:%s" % i, metric, start_date + datetime.timedelta(days=day), i + day) for i in xrange(5) for day in xrange(0, 40, 3)]
+
+        def get_all():
+            return (
+                backend.get_metric_by_day(GLOBAL_IDENTIFIER, metric, start_date, limit=40)[1],
+                backend.get_metric_by_week(GLOBAL_IDENTIFIER, metric, start_date, limit=7)[1],
+                backend.get_metric_by_month(GLOBAL_IDENTIFIER, metric, start_date, limit=3)[1],
+                backend.get_count(GLOBAL_IDENTIFIER, metric),
+                [backend.get_top(metric, period, start_date + datetime.timedelta(days=21)) for period in ("day", "week", "month")])
+
+        for uid, row_metric, date, count in rows:
+            backend.track_metric(uid, row_metric, date, inc_amt=count)
+        tracked = get_all()
+
+        self._redis_backend.flushdb()
+        backend.bulk_load(rows, chunk_size=2)
+        eq_(get_all(), tracked)
+        eq_(backend.verify_rollups(counters=True)["mismatches"], [])
+
+    def test_clear_resets_expiry(self):
+        retention_backend = _create_backend(retention={"day": 90, "week": 365, "month": 365})
+        user_id = "user:1234"
+        metric = "badge:25"
+        today = datetime.date.today()
+        daily_key = retention_backend._get_daily_metric_key(user_id, today)
+
+        for clear in (
+                retention_backend.clear_all,
+                lambda: retention_backend.clear_unique_identifier(user_id),
+                lambda: retention_backend.clear_metric(metric),
+                lambda: retention_backend.clear_before(today + datetime.timedelta(days=400))):
+            ok_(retention_backend.track_metric(user_id, metric, today))
+            clear()
+            eq_(self._redis_backend.exists(daily_key), False)
+
+            #keys written again get their expiry again
+            ok_(retention_backend.track_metric(user_id, metric, today))
+            ok_(self._redis_backend.ttl(daily_key) > 0)
+            retention_backend.clear_all()
+
+    def test_clear_before_cache(self):
+        backend = _create_backend(cache={"max_size": 100})
+        date = datetime.date(year=2011, month=12, day=5)
+        ok_(backend.track_metric("user:1234", "badge:25", date, inc_amt=7))
+        eq_(backend.get_metric_by_day("user:1234", "badge:25", date, limit=1)[1], {"2011-12-05": 7})
+
+        backend.clear_before(datetime.date(year=2012, month=1, day=1))
+        eq_(backend.get_metric_by_day("user:1234", "badge:25", date, limit=1)[1], {"2011-12-05": 0})
+
+    def test_verify_rollups_without_days(self):
+        user_id = "user:1234"
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=1, day=31)
+
+        ok_(self._backend.track_metric(user_id, metric, date, inc_amt=2))
+        #a week with no days behind it, in a year with days and in a year without any
+        for week in (datetime.date(year=2012, month=3, day=5), datetime.date(year=2011, month=3, day=7)):
+            self._redis_backend.hincrby(self._backend._get_weekly_metric_key(user_id, week), self._backend._get_weekly_metric_name(metric, week), 9)
+
+        report = self._backend.verify_rollups(repair=True)
+        eq_([(expected, actual) for key, field, expected, actual in report["mismatches"]], [(0, 9), (0, 9)])
+        eq_(self._backend.get_metric_by_week(user_id, metric, datetime.date(year=2012, month=3, day=5), limit=1)[1]["2012-03-05"], 0)
+        eq_(self._backend.get_metric_by_week(user_id, metric, datetime.date(year=2011, month=3, day=7), limit=1)[1]["2011-03-07"], 0)
+        eq_(self._backend.get_metric_by_week(user_id, metric, date, limit=1)[1]["2012-01-30"], 2)
+
+    def test_retention_failed_expiry(self):
+        retention_backend = _create_backend(retention={"day": 90})
+        user_id = "user:1234"
+        metric = "badge:25"
+        today = datetime.date.today()
+        daily_key = retention_backend._get_daily_metric_key(user_id, today)
+
+        #a write that fails after the expiry was queued doesn't mark the key
+        expire_new_keys = retention_backend._expire_new_keys
+        def failing_expire_new_keys(conn, keys):
+            expire_new_keys(conn, keys)
+            raise ResponseError("failed")
+        retention_backend._expire_new_keys = failing_expire_new_keys
+        try:
+            retention_backend.track_metric(user_id, metric, today)
+        except ResponseError:
+            pass
+        del retention_backend._expire_new_keys
+        eq_(retention_backend._expiring_keys.get(daily_key), None)
+
+        ok_(retention_backend.track_metric(user_id, metric, today))
+        ok_(self._redis_backend.ttl(daily_key) > 90 * 86400)
+
+        #once the expiry has run out the key gets it again when it is recreated
+        retention_backend._expiring_keys.set(daily_key, 0)
+        self._redis_backend.persist(daily_key)
+        ok_(retention_backend.track_metric(user_id, metric, today))
+        ok_(self._redis_backend.ttl(daily_key) > 90 * 86400)
+
+    def test_set_metric_by_day_leaderboards_without_sync(self):
+        for use_scripts in (False, True):
+            self._redis_backend.flushdb()
+            leaderboard_backend = _create_backend(leaderboards=True, use_scripts=use_scripts)
+            metric = "badge:25"
+            monday = datetime.date(year=2012, month=4, day=2)
+
+            ok_(leaderboard_backend.track_metric("user:1", metric, monday, inc_amt=2))
+            ok_(leaderboard_backend.set_metric_by_day("user:1", metric, monday, 5, sync_agg=False))
+
+            #the day leaderboard follows the day, the week and month ones are left for sync_agg_metric
+            eq_(leaderboard_backend.get_top(metric, "day", monday), [("user:1", 5)])
+            eq_(leaderboard_backend.get_top(metric, "week", monday), [("user:1", 2)])
+            eq_(leaderboard_backend.get_top(metric, "month", monday), [("user:1", 2)])
+
+
+class TestAsyncRedisAnalyticsBackend(object):
+    def setUp(self):
+        self._backend = _create_backend(backend="analytics.backends.redis.AsyncRedis", workers=2)
+
+        self._redis_backend = self._backend.get_backend()
+        self._redis_backend.flushdb()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+
+    def test_track_and_get_metrics(self):
+        user_id = 1234
+        metric = "badge:25"
+        date = datetime.date(year=2012, month=4, day=5)
+
+        pending = [self._backend.track_metric(user_id, metric, date, inc_amt=2) for i in range(5)]
+        [ok_(result.get()) for result in pending]
+
+        series, values = self._backend.get_metric_by_day(user_id, metric, date, limit=1).get()
+        eq_(values["2012-04-05"], 10)
+        eq_(self._backend.get_count(user_id, metric).get(), 10)
+
+        results = self._backend.get_metrics([(user_id, metric)], date, limit=1, group_by="month").get()
+        eq_(results[0][1]["2012-04-01"], 10)
+
+    def test_close_waits_for_pending_calls(self):
+        user_id = 1234
+        metric = "badge:25"
+
+        for i in range(10):
+            self._backend.track_count(user_id, metric)
+        self._backend.close()
+
+        eq_(int(self._redis_backend.get(self._backend._redis._get_count_key(user_id, metric))), 10)
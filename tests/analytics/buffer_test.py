@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+
+from nose.tools import ok_, eq_, raises
+
+from analytics.buffer import FlushError, IncrementBuffer
+
+
+class TestIncrementBuffer(object):
+    def setUp(self):
+        self._flushed = []
+
+    def _flush(self, pending):
+        self._flushed.append(dict(pending))
+
+    def test_add_sums_increments(self):
+        buf = IncrementBuffer(self._flush, max_size=10, max_age=60)
+
+        buf.add("a", 2)
+        buf.add("a", 3)
+        buf.add("b")
+
+        eq_(len(buf), 2)
+        eq_(self._flushed, [])
+
+        eq_(buf.flush(), 2)
+        eq_(self._flushed, [{"a": 5, "b": 1}])
+        eq_(len(buf), 0)
+
+    def test_flushes_on_max_size(self):
+        buf = IncrementBuffer(self._flush, max_size=2, max_age=60)
+
+        buf.add("a")
+        buf.add("a")
+        eq_(self._flushed, [])
+
+        buf.add("b")
+        eq_(self._flushed, [{"a": 2, "b": 1}])
+
+    def test_flushes_on_max_age(self):
+        buf = IncrementBuffer(self._flush, max_size=10, max_age=0)
+
+        buf.add("a")
+        eq_(self._flushed, [{"a": 1}])
+
+    def test_flush_empty_buffer(self):
+        buf = IncrementBuffer(self._flush)
+
+        eq_(buf.flush(), 0)
+        eq_(self._flushed, [])
+
+    @raises(ValueError)
+    def test_failed_flush_keeps_increments(self):
+        def failing_flush(pending):
+            raise ValueError()
+
+        buf = IncrementBuffer(failing_flush, max_size=10, max_age=60)
+        buf.add("a", 2)
+
+        try:
+            buf.flush()
+        finally:
+            eq_(len(buf), 1)
+            ok_(buf._pending["a"] == 2)
+
+    @raises(FlushError)
+    def test_partly_failed_flush_keeps_failed_increments(self):
+        def failing_flush(pending):
+            raise FlushError({"b": pending["b"]})
+
+        buf = IncrementBuffer(failing_flush, max_size=10, max_age=60)
+        buf.add("a", 2)
+        buf.add("b", 3)
+
+        try:
+            buf.flush()
+        finally:
+            eq_(dict(buf._pending), {"b": 3})
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+from nose.tools import eq_, raises
+
+from analytics import create_analytic_backend
+from analytics.bulk_load import main, read_rows
+
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import StringIO
+
+
+class TestBulkLoad(object):
+    def setUp(self):
+        self._settings = {
+            "backend": "analytics.backends.redis.Redis",
+            "settings": {
+                "hosts": [{"db": 3}, {"db": 4}, {"db": 5}]
+            },
+        }
+        self._backend = create_analytic_backend(self._settings)
+        self._redis_backend = self._backend.get_backend()
+        self._redis_backend.flushdb()
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self._redis_backend.flushdb()
+        shutil.rmtree(self._dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self._dir, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_read_rows(self):
+        rows = list(read_rows([StringIO.StringIO("uid,metric,date,count\nuser:1,logins,2012-01-05,3\n\nuser:2,logins,2012-01-06,1\n")], skip_header=True))
+        eq_(rows, [
+            ("user:1", "logins", datetime.date(year=2012, month=1, day=5), 3),
+            ("user:2", "logins", datetime.date(year=2012, month=1, day=6), 1),
+        ])
+
+    @raises(ValueError)
+    def test_read_rows_invalid_row(self):
+        list(read_rows([StringIO.StringIO("user:1,logins,05/01/2012,3\n")]))
+
+    def test_main(self):
+        settings = self._write("settings.json", json.dumps(self._settings))
+        counts = self._write("counts.csv", "user:1,logins,2012-01-05,3\nuser:1,logins,2012-02-01,2\nuser:2,logins,2012-01-06,1\n")
+
+        eq_(main(["--settings", settings, "--chunk-size", "1", counts]), 0)
+
+        eq_(self._backend.get_count("user:1", "logins"), 5)
+        eq_(self._backend.get_metric_by_month("user:1", "logins", datetime.date(year=2012, month=1, day=1), limit=2)[1],
+            {"2012-01-01": 3, "2012-02-01": 2})
+        eq_(self._backend.get_count("user:2", "logins"), 1)
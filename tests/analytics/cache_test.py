@@ -0,0 +1,46 @@
+from __future__ import absolute_import
+
+from nose.tools import eq_
+
+from analytics.cache import LRUCache
+
+
+class TestLRUCache(object):
+    def test_get_and_set(self):
+        cache = LRUCache(max_size=10)
+
+        eq_(cache.get("a"), None)
+        eq_(cache.get("a", 0), 0)
+
+        cache.set("a", 1)
+        cache.set("b", None)
+        eq_(cache.get("a"), 1)
+        eq_(cache.get("b", 0), None)
+        eq_(len(cache), 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        #reading "a" makes "b" the least recently used entry
+        cache.get("a")
+        cache.set("c", 3)
+
+        eq_(len(cache), 2)
+        eq_(cache.get("a"), 1)
+        eq_(cache.get("b"), None)
+        eq_(cache.get("c"), 3)
+
+    def test_delete_and_clear(self):
+        cache = LRUCache()
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        cache.delete("missing")
+        eq_(cache.get("a"), None)
+        eq_(cache.get("b"), 2)
+
+        cache.clear()
+        eq_(len(cache), 0)